@@ -13,8 +13,29 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+
+import eventlet
 from neutron.common import rpc as n_rpc
+from oslo_log import log as logging
 import oslo_messaging
+from oslo_utils import excutils
+
+from neutron_lbaas._i18n import _LE, _LW
+
+LOG = logging.getLogger(__name__)
+
+# Number of queued status changes after which they are sent without waiting
+# for the end of the coalescing window.
+MAX_STATUS_BATCH_SIZE = 500
+
+
+def _is_unsupported_call(exc):
+    """Tells whether exc means the plugin does not implement a call yet."""
+    if isinstance(exc, oslo_messaging.UnsupportedVersion):
+        return True
+    return (isinstance(exc, oslo_messaging.RemoteError) and
+            exc.exc_type in ('UnsupportedVersion', 'NoSuchMethod'))
 
 
 class LbaasAgentApi(object):
@@ -22,12 +43,21 @@ class LbaasAgentApi(object):
 
     # history
     #   1.0 Initial version
+    #   1.1 Add update_statuses_bulk
+    #   1.2 Add update_loadbalancers_stats
+    #   1.3 Add get_loadbalancers_for_agent
 
-    def __init__(self, topic, context, host):
+    def __init__(self, topic, context, host, status_update_window=0):
         self.context = context
         self.host = host
         target = oslo_messaging.Target(topic=topic, version='1.0')
         self.client = n_rpc.get_client(target)
+        self.status_update_window = status_update_window
+        self._pending_statuses = collections.OrderedDict()
+        self._flush_scheduled = False
+        self._bulk_statuses_supported = True
+        self._bulk_stats_supported = True
+        self._bulk_get_supported = True
 
     def get_ready_devices(self):
         cctxt = self.client.prepare()
@@ -38,6 +68,30 @@ class LbaasAgentApi(object):
         return cctxt.call(self.context, 'get_loadbalancer',
                           loadbalancer_id=loadbalancer_id)
 
+    def get_loadbalancers_for_agent(self, loadbalancer_ids, revisions=None):
+        """Returns the graphs of several load balancers in one call.
+
+        revisions maps load balancer ids to the revision deployed by the
+        agent, the plugin does not send the graphs still at that revision.
+        Returns None if the plugin does not support it, the load balancers
+        then have to be fetched one by one with get_loadbalancer.
+        """
+        if not self._bulk_get_supported:
+            return None
+        cctxt = self.client.prepare(version='1.3')
+        try:
+            return cctxt.call(self.context, 'get_loadbalancers_for_agent',
+                              loadbalancer_ids=loadbalancer_ids,
+                              revisions=revisions)
+        except Exception as e:
+            if not _is_unsupported_call(e):
+                raise
+            LOG.warning(_LW('The plugin does not support fetching '
+                            'loadbalancers in bulk, falling back to '
+                            'get_loadbalancer'))
+            self._bulk_get_supported = False
+            return None
+
     def loadbalancer_deployed(self, loadbalancer_id):
         cctxt = self.client.prepare()
         return cctxt.call(self.context, 'loadbalancer_deployed',
@@ -51,6 +105,88 @@ class LbaasAgentApi(object):
                           provisioning_status=provisioning_status,
                           operating_status=operating_status)
 
+    def update_statuses_bulk(self, statuses):
+        cctxt = self.client.prepare(version='1.1')
+        return cctxt.call(self.context, 'update_statuses_bulk',
+                          statuses=statuses)
+
+    def queue_status_update(self, obj_type, obj_id, provisioning_status=None,
+                            operating_status=None):
+        """Queues a status change to be sent to the plugin in a batch.
+
+        Changes queued for the same object within the coalescing window are
+        merged, the latest provisioning and operating statuses win. With no
+        window the change is sent right away.
+        """
+        status = self._pending_statuses.setdefault(
+            (obj_type, obj_id), {'obj_type': obj_type, 'obj_id': obj_id,
+                                 'provisioning_status': None,
+                                 'operating_status': None})
+        if provisioning_status:
+            status['provisioning_status'] = provisioning_status
+        if operating_status:
+            status['operating_status'] = operating_status
+
+        if (not self.status_update_window or
+                len(self._pending_statuses) >= MAX_STATUS_BATCH_SIZE):
+            self.flush_status_updates()
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            eventlet.spawn_after(self.status_update_window,
+                                 self._flush_status_updates_later)
+
+    def flush_status_updates(self):
+        """Sends the queued status changes to the plugin.
+
+        The changes are sent with a single update_statuses_bulk call, or one
+        update_status call per object if the plugin does not support it.
+        On failure the changes that were not sent are queued again.
+        """
+        if not self._pending_statuses:
+            return
+        statuses = list(self._pending_statuses.values())
+        self._pending_statuses = collections.OrderedDict()
+        sent = 0
+        try:
+            if self._bulk_statuses_supported:
+                try:
+                    self.update_statuses_bulk(statuses)
+                    return
+                except Exception as e:
+                    if not _is_unsupported_call(e):
+                        raise
+                    LOG.warning(_LW('The plugin does not support bulk status '
+                                    'updates, falling back to update_status'))
+                    self._bulk_statuses_supported = False
+            for sent, status in enumerate(statuses):
+                self.update_status(**status)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self._requeue_statuses(statuses[sent:])
+
+    def _requeue_statuses(self, statuses):
+        requeued = collections.OrderedDict(
+            ((s['obj_type'], s['obj_id']), s) for s in statuses)
+        # changes queued in the meantime are more recent
+        for key, status in self._pending_statuses.items():
+            old_status = requeued.setdefault(key, status)
+            for field in ('provisioning_status', 'operating_status'):
+                if status[field]:
+                    old_status[field] = status[field]
+        self._pending_statuses = requeued
+
+    def _flush_status_updates_later(self):
+        self._flush_scheduled = False
+        try:
+            self.flush_status_updates()
+        except Exception:
+            LOG.exception(_LE('Failed to send status updates to the plugin, '
+                              'retrying later'))
+            if not self._flush_scheduled:
+                self._flush_scheduled = True
+                eventlet.spawn_after(self.status_update_window,
+                                     self._flush_status_updates_later)
+
     def loadbalancer_destroyed(self, loadbalancer_id):
         cctxt = self.client.prepare()
         return cctxt.call(self.context, 'loadbalancer_destroyed',
@@ -70,3 +206,24 @@ class LbaasAgentApi(object):
         cctxt = self.client.prepare()
         return cctxt.call(self.context, 'update_loadbalancer_stats',
                           loadbalancer_id=loadbalancer_id, stats=stats)
+
+    def update_loadbalancers_stats(self, stats):
+        """Sends the statistics of several load balancers in one call.
+
+        Falls back to one update_loadbalancer_stats call per load balancer
+        if the plugin does not support it.
+        """
+        if self._bulk_stats_supported:
+            cctxt = self.client.prepare(version='1.2')
+            try:
+                return cctxt.call(self.context, 'update_loadbalancers_stats',
+                                  stats=stats)
+            except Exception as e:
+                if not _is_unsupported_call(e):
+                    raise
+                LOG.warning(_LW('The plugin does not support bulk stats '
+                                'updates, falling back to '
+                                'update_loadbalancer_stats'))
+                self._bulk_stats_supported = False
+        for loadbalancer_id, lb_stats in stats.items():
+            self.update_loadbalancer_stats(loadbalancer_id, lb_stats)
@@ -13,6 +13,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+
+import eventlet
 from neutron.agent.linux import external_process
 from neutron.agent import rpc as agent_rpc
 from neutron import context as ncontext
@@ -35,6 +38,17 @@ from neutron_lbaas.services.loadbalancer import data_models
 LOG = logging.getLogger(__name__)
 
 DEVICE_DRIVERS = 'device_drivers'
+# Seconds between two statistics collection cycles
+STATS_INTERVAL = 6
+# Number of loadbalancer graphs fetched with a single call during a resync
+RESYNC_BATCH_SIZE = 50
+# Order in which loadbalancers are deployed during a resync, the ones users
+# are waiting for come first.
+RESYNC_ORDER = {
+    constants.PENDING_CREATE: 0,
+    constants.PENDING_UPDATE: 1,
+    constants.ACTIVE: 2,
+}
 
 OPTS = [
     cfg.MultiStrOpt(
@@ -43,6 +57,25 @@ OPTS = [
                  'namespace_driver.HaproxyNSDriver'],
         help=_('Drivers used to manage loadbalancing devices'),
     ),
+    cfg.IntOpt(
+        'stats_concurrency',
+        default=20,
+        help=_('Maximum number of loadbalancers whose statistics are '
+               'collected concurrently'),
+    ),
+    cfg.FloatOpt(
+        'status_update_window',
+        default=0,
+        help=_('Seconds during which status changes are coalesced before '
+               'being sent to the plugin in a single call. 0 sends every '
+               'status change right away.'),
+    ),
+    cfg.IntOpt(
+        'resync_concurrency',
+        default=10,
+        help=_('Maximum number of loadbalancers deployed concurrently when '
+               'the agent resyncs its state with the plugin'),
+    ),
 ]
 
 
@@ -54,7 +87,8 @@ class LbaasAgentManager(periodic_task.PeriodicTasks):
 
     # history
     #   1.0 Initial version
-    target = oslo_messaging.Target(version='1.0')
+    #   1.1 Add adopt_loadbalancers
+    target = oslo_messaging.Target(version='1.1')
 
     def __init__(self, conf):
         super(LbaasAgentManager, self).__init__(conf)
@@ -64,7 +98,8 @@ class LbaasAgentManager(periodic_task.PeriodicTasks):
         self.plugin_rpc = agent_api.LbaasAgentApi(
             lb_const.LOADBALANCER_PLUGINV2,
             self.context,
-            self.conf.host
+            self.conf.host,
+            status_update_window=self.conf.status_update_window
         )
         self._process_monitor = external_process.ProcessMonitor(
             config=self.conf, resource_type='loadbalancer')
@@ -74,7 +109,8 @@ class LbaasAgentManager(periodic_task.PeriodicTasks):
             'binary': 'neutron-lbaasv2-agent',
             'host': conf.host,
             'topic': lb_const.LOADBALANCER_AGENTV2,
-            'configurations': {'device_drivers': self.device_drivers.keys()},
+            'configurations': {'device_drivers': self.device_drivers.keys(),
+                               'rpc_version': self.target.version},
             'agent_type': lb_const.AGENT_TYPE_LOADBALANCERV2,
             'start_flag': True}
         self.admin_state_up = True
@@ -83,6 +119,11 @@ class LbaasAgentManager(periodic_task.PeriodicTasks):
         self.needs_resync = False
         # pool_id->device_driver_name mapping used to store known instances
         self.instance_mapping = {}
+        # loadbalancer_id->revision of the graph deployed by a resync
+        self._deployed_revisions = {}
+        # loadbalancer_id->stats last sent to the plugin
+        self._last_stats = {}
+        self._stats_cycle_start = None
 
     def _load_drivers(self):
         self.device_drivers = {}
@@ -134,22 +175,52 @@ class LbaasAgentManager(periodic_task.PeriodicTasks):
             self.needs_resync = False
             self.sync_state()
 
-    @periodic_task.periodic_task(spacing=6)
+    @periodic_task.periodic_task(spacing=STATS_INTERVAL)
     def collect_stats(self, context):
-        for loadbalancer_id, driver_name in self.instance_mapping.items():
-            driver = self.device_drivers[driver_name]
+        cycle_start = time.time()
+        if self._stats_cycle_start is not None:
+            # how late this cycle started compared to its schedule
+            self.agent_state['configurations']['stats_lag'] = round(max(
+                0, cycle_start - self._stats_cycle_start - STATS_INTERVAL), 3)
+        self._stats_cycle_start = cycle_start
+
+        pool = eventlet.GreenPool(self.conf.stats_concurrency)
+        changed_stats = {}
+        for loadbalancer_id, stats in pool.starmap(
+                self._get_loadbalancer_stats,
+                list(self.instance_mapping.items())):
+            # only send the stats of the load balancers which changed since
+            # the last cycle
+            if stats and stats != self._last_stats.get(loadbalancer_id):
+                changed_stats[loadbalancer_id] = stats
+        for loadbalancer_id in set(self._last_stats) - set(
+                self.instance_mapping):
+            del self._last_stats[loadbalancer_id]
+
+        if changed_stats:
             try:
-                stats = driver.loadbalancer.get_stats(loadbalancer_id)
-                if stats:
-                    self.plugin_rpc.update_loadbalancer_stats(
-                        loadbalancer_id, stats)
+                self.plugin_rpc.update_loadbalancers_stats(changed_stats)
+                self._last_stats.update(changed_stats)
             except Exception:
-                LOG.exception(_LE('Error updating statistics on loadbalancer'
-                                  ' %s'),
-                              loadbalancer_id)
-                self.needs_resync = True
+                LOG.exception(_LE('Error sending statistics of %d '
+                                  'loadbalancers'), len(changed_stats))
+        self.agent_state['configurations']['stats_cycle_time'] = round(
+            time.time() - cycle_start, 3)
+
+    def _get_loadbalancer_stats(self, loadbalancer_id, driver_name):
+        driver = self.device_drivers[driver_name]
+        try:
+            return loadbalancer_id, driver.loadbalancer.get_stats(
+                loadbalancer_id)
+        except Exception:
+            LOG.exception(_LE('Error updating statistics on loadbalancer'
+                              ' %s'),
+                          loadbalancer_id)
+            self.needs_resync = True
+            return loadbalancer_id, None
 
     def sync_state(self):
+        start = time.time()
         known_instances = set(self.instance_mapping.keys())
         try:
             ready_instances = set(self.plugin_rpc.get_ready_devices())
@@ -157,14 +228,69 @@ class LbaasAgentManager(periodic_task.PeriodicTasks):
             for deleted_id in known_instances - ready_instances:
                 self._destroy_loadbalancer(deleted_id)
 
-            for loadbalancer_id in ready_instances:
-                self._reload_loadbalancer(loadbalancer_id)
+            self._resync_loadbalancers(ready_instances)
 
         except Exception:
             LOG.exception(_LE('Unable to retrieve ready devices'))
             self.needs_resync = True
 
         self.remove_orphans()
+        duration = time.time() - start
+        self.agent_state['configurations']['resync_duration'] = round(
+            duration, 3)
+        LOG.debug('Resync done in %.3f seconds', duration)
+
+    def _resync_loadbalancers(self, loadbalancer_ids, progress='resync'):
+        """Deploys loadbalancers concurrently, pending ones first.
+
+        The loadbalancers which did not change since they were deployed are
+        skipped. The progress is reported to the plugin with the agent
+        state, in the <progress>_unchanged, <progress>_total and
+        <progress>_done counters.
+        """
+        loadbalancers = []
+        unchanged = 0
+        for loadbalancer in self._get_loadbalancers(loadbalancer_ids):
+            if loadbalancer[1] and loadbalancer[1].get('unchanged'):
+                unchanged += 1
+            else:
+                loadbalancers.append(loadbalancer)
+        loadbalancers.sort(key=self._get_resync_priority)
+        configurations = self.agent_state['configurations']
+        configurations[progress + '_unchanged'] = unchanged
+        configurations[progress + '_total'] = len(loadbalancers)
+        configurations[progress + '_done'] = 0
+        pool = eventlet.GreenPool(self.conf.resync_concurrency)
+        for _result in pool.starmap(self._reload_loadbalancer, loadbalancers):
+            configurations[progress + '_done'] += 1
+
+    def _get_loadbalancers(self, loadbalancer_ids):
+        """Returns (id, graph) pairs for the loadbalancers to deploy.
+
+        The graphs are fetched in batches. If the plugin can only return
+        them one by one, the graphs are None and fetched at deploy time.
+        """
+        loadbalancer_ids = list(loadbalancer_ids)
+        loadbalancers = []
+        for i in range(0, len(loadbalancer_ids), RESYNC_BATCH_SIZE):
+            batch = loadbalancer_ids[i:i + RESYNC_BATCH_SIZE]
+            revisions = dict((lb_id, self._deployed_revisions[lb_id])
+                             for lb_id in batch
+                             if lb_id in self._deployed_revisions and
+                             lb_id in self.instance_mapping)
+            lb_dicts = self.plugin_rpc.get_loadbalancers_for_agent(
+                batch, revisions=revisions)
+            if lb_dicts is None:
+                return [(lb_id, None) for lb_id in loadbalancer_ids]
+            loadbalancers.extend((lb_dict['id'], lb_dict)
+                                 for lb_dict in lb_dicts)
+        return loadbalancers
+
+    @staticmethod
+    def _get_resync_priority(loadbalancer):
+        loadbalancer_dict = loadbalancer[1] or {}
+        return RESYNC_ORDER.get(loadbalancer_dict.get('provisioning_status'),
+                                len(RESYNC_ORDER))
 
     def _get_driver(self, loadbalancer_id):
         if loadbalancer_id not in self.instance_mapping:
@@ -173,10 +299,13 @@ class LbaasAgentManager(periodic_task.PeriodicTasks):
         driver_name = self.instance_mapping[loadbalancer_id]
         return self.device_drivers[driver_name]
 
-    def _reload_loadbalancer(self, loadbalancer_id):
+    def _reload_loadbalancer(self, loadbalancer_id, loadbalancer_dict=None):
+        self._deployed_revisions.pop(loadbalancer_id, None)
         try:
-            loadbalancer_dict = self.plugin_rpc.get_loadbalancer(
-                loadbalancer_id)
+            if loadbalancer_dict is None:
+                loadbalancer_dict = self.plugin_rpc.get_loadbalancer(
+                    loadbalancer_id)
+            revision = loadbalancer_dict.get('revision')
             loadbalancer = data_models.LoadBalancer.from_dict(
                 loadbalancer_dict)
             driver_name = loadbalancer.provider.device_driver
@@ -189,6 +318,8 @@ class LbaasAgentManager(periodic_task.PeriodicTasks):
             self.device_drivers[driver_name].deploy_instance(loadbalancer)
             self.instance_mapping[loadbalancer_id] = driver_name
             self.plugin_rpc.loadbalancer_deployed(loadbalancer_id)
+            if revision:
+                self._deployed_revisions[loadbalancer_id] = revision
         except Exception:
             LOG.exception(_LE('Unable to deploy instance for '
                               'loadbalancer: %s'),
@@ -196,6 +327,7 @@ class LbaasAgentManager(periodic_task.PeriodicTasks):
             self.needs_resync = True
 
     def _destroy_loadbalancer(self, lb_id):
+        self._deployed_revisions.pop(lb_id, None)
         driver = self._get_driver(lb_id)
         try:
             driver.undeploy_instance(lb_id, delete_namespace=True)
@@ -217,6 +349,10 @@ class LbaasAgentManager(periodic_task.PeriodicTasks):
 
     def _handle_failed_driver_call(self, operation, obj, driver):
         obj_type = obj.__class__.__name__.lower()
+        lb = (obj if isinstance(obj, data_models.LoadBalancer)
+              else obj.root_loadbalancer)
+        # what is deployed no longer matches any revision of the graph
+        self._deployed_revisions.pop(lb.id, None)
         LOG.exception(_LE('%(operation)s %(obj)s %(id)s failed on device '
                           'driver %(driver)s'),
                       {'operation': operation.capitalize(), 'obj': obj_type,
@@ -256,12 +392,12 @@ class LbaasAgentManager(periodic_task.PeriodicTasks):
             lb = obj
         else:
             lb = obj.root_loadbalancer
-            self.plugin_rpc.update_status(obj_type, obj.id,
-                                          provisioning_status=obj_p_status,
-                                          operating_status=obj_o_status)
-        self.plugin_rpc.update_status('loadbalancer', lb.id,
-                                      provisioning_status=lb_p_status,
-                                      operating_status=lb_o_status)
+            self.plugin_rpc.queue_status_update(
+                obj_type, obj.id, provisioning_status=obj_p_status,
+                operating_status=obj_o_status)
+        self.plugin_rpc.queue_status_update(
+            'loadbalancer', lb.id, provisioning_status=lb_p_status,
+            operating_status=lb_o_status)
 
     def create_loadbalancer(self, context, loadbalancer, driver_name):
         loadbalancer = data_models.LoadBalancer.from_dict(loadbalancer)
@@ -280,6 +416,24 @@ class LbaasAgentManager(periodic_task.PeriodicTasks):
             self.instance_mapping[loadbalancer.id] = driver_name
             self._update_statuses(loadbalancer)
 
+    def adopt_loadbalancers(self, context, loadbalancer_ids):
+        """Deploys the loadbalancers rescheduled from a dead agent.
+
+        They are deployed in the background, the progress is reported with
+        the adopt_* counters of the agent state.
+        """
+        LOG.info(_LI('Adopting %d loadbalancers rescheduled to this agent'),
+                 len(loadbalancer_ids))
+        eventlet.spawn_n(self._adopt_loadbalancers, loadbalancer_ids)
+
+    def _adopt_loadbalancers(self, loadbalancer_ids):
+        try:
+            self._resync_loadbalancers(loadbalancer_ids, progress='adopt')
+        except Exception:
+            LOG.exception(_LE('Unable to adopt loadbalancers %s'),
+                          loadbalancer_ids)
+            self.needs_resync = True
+
     def update_loadbalancer(self, context, old_loadbalancer, loadbalancer):
         loadbalancer = data_models.LoadBalancer.from_dict(loadbalancer)
         old_loadbalancer = data_models.LoadBalancer.from_dict(old_loadbalancer)
@@ -297,6 +451,7 @@ class LbaasAgentManager(periodic_task.PeriodicTasks):
         driver = self._get_driver(loadbalancer.id)
         driver.loadbalancer.delete(loadbalancer)
         del self.instance_mapping[loadbalancer.id]
+        self._deployed_revisions.pop(loadbalancer.id, None)
 
     def create_listener(self, context, listener):
         listener = data_models.Listener.from_dict(listener)
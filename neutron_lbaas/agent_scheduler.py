@@ -13,17 +13,22 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import abc
+import heapq
 import random
 
 from neutron.db import agentschedulers_db
 from neutron.db.models import agent as agents_db
 from neutron_lib.db import model_base
+from oslo_config import cfg
 from oslo_log import log as logging
+import six
 import sqlalchemy as sa
 from sqlalchemy import orm
 from sqlalchemy.orm import joinedload
 
 from neutron_lbaas._i18n import _LW
+from neutron_lbaas.db.loadbalancer import models
 from neutron_lbaas.extensions import lbaas_agentschedulerv2
 from neutron_lbaas.services.loadbalancer import constants as lb_const
 
@@ -96,6 +101,44 @@ class LbaasAgentSchedulerDbMixin(agentschedulers_db.AgentSchedulerDbMixin,
                 candidates.append(agent)
         return candidates
 
+    def get_lbaas_agents_load(self, context, agent_ids, weight=None):
+        """Returns the load of lbaas agents, from one aggregate query.
+
+        :param agent_ids: ids of the agents
+        :param weight: 'listeners' or 'members' to add the number of
+                       listeners or members of the hosted load balancers
+        :returns: dict of agent id -> number of hosted load balancers, plus
+                  their listeners or members
+        """
+        columns = [LoadbalancerAgentBinding.agent_id,
+                   sa.func.count(sa.distinct(
+                       LoadbalancerAgentBinding.loadbalancer_id))]
+        if weight == 'listeners':
+            columns.append(sa.func.count(models.Listener.id))
+        elif weight == 'members':
+            columns.append(sa.func.count(models.MemberV2.id))
+        query = context.session.query(*columns).select_from(
+            LoadbalancerAgentBinding)
+        if weight == 'listeners':
+            query = query.outerjoin(
+                models.Listener,
+                models.Listener.loadbalancer_id ==
+                LoadbalancerAgentBinding.loadbalancer_id)
+        elif weight == 'members':
+            query = query.outerjoin(
+                models.PoolV2,
+                models.PoolV2.loadbalancer_id ==
+                LoadbalancerAgentBinding.loadbalancer_id).outerjoin(
+                models.MemberV2, models.MemberV2.pool_id == models.PoolV2.id)
+        query = query.filter(
+            LoadbalancerAgentBinding.agent_id.in_(agent_ids)).group_by(
+            LoadbalancerAgentBinding.agent_id)
+
+        load = dict.fromkeys(agent_ids, 0)
+        for row in query:
+            load[row[0]] = sum(row[1:])
+        return load
+
     def get_down_loadbalancer_bindings(self, context, agent_dead_limit):
             cutoff = self.get_cutoff_time(agent_dead_limit)
             return (context.session.query(LoadbalancerAgentBinding).join(
@@ -112,8 +155,24 @@ class LbaasAgentSchedulerDbMixin(agentschedulers_db.AgentSchedulerDbMixin,
             query.delete()
 
 
-class ChanceScheduler(object):
-    """Allocate a loadbalancer agent for a vip in a random way."""
+@six.add_metaclass(abc.ABCMeta)
+class LoadbalancerScheduler(object):
+    """Allocate a loadbalancer agent chosen among the eligible ones."""
+
+    @abc.abstractmethod
+    def _choose_agent(self, plugin, context, candidates):
+        """Returns the agent of candidates to host a load balancer."""
+
+    def place(self, plugin, context, candidates, loadbalancer_ids):
+        """Spreads load balancers over the candidate agents.
+
+        :returns: list of (agent, ids of the load balancers placed on it)
+        """
+        placements = {}
+        for lb_id in loadbalancer_ids:
+            agent = self._choose_agent(plugin, context, candidates)
+            placements.setdefault(agent['id'], (agent, []))[1].append(lb_id)
+        return list(placements.values())
 
     def schedule(self, plugin, context, loadbalancer, device_driver):
         """Schedule the load balancer to an active loadbalancer agent if there
@@ -144,7 +203,7 @@ class ChanceScheduler(object):
                             device_driver)
                 return
 
-            chosen_agent = random.choice(candidates)
+            chosen_agent = self._choose_agent(plugin, context, candidates)
             binding = LoadbalancerAgentBinding()
             binding.agent = chosen_agent
             binding.loadbalancer_id = loadbalancer.id
@@ -156,3 +215,50 @@ class ChanceScheduler(object):
                     'agent_id': chosen_agent['id']}
             )
             return chosen_agent
+
+
+class ChanceScheduler(LoadbalancerScheduler):
+    """Allocate a loadbalancer agent for a vip in a random way."""
+
+    def _choose_agent(self, plugin, context, candidates):
+        return random.choice(candidates)
+
+
+class LeastLoadedScheduler(LoadbalancerScheduler):
+    """Allocate the least loaded loadbalancer agent for a vip.
+
+    The load of an agent is set by loadbalancer_scheduler_load. Agents with
+    the same load are chosen by host name, then by id.
+    """
+
+    def _get_load(self, plugin, context, candidates):
+        weight = cfg.CONF.loadbalancer_scheduler_load
+        if weight == 'instances':
+            return dict(
+                (agent['id'],
+                 plugin.db.get_configuration_dict(agent).get('instances', 0))
+                for agent in candidates)
+        return plugin.db.get_lbaas_agents_load(
+            context, [agent['id'] for agent in candidates], weight)
+
+    def _choose_agent(self, plugin, context, candidates):
+        load = self._get_load(plugin, context, candidates)
+        return min(candidates, key=lambda agent: (
+            load[agent['id']], agent['host'], agent['id']))
+
+    def place(self, plugin, context, candidates, loadbalancer_ids):
+        """Places each load balancer on the least loaded agent.
+
+        The load is read once, each load balancer placed adds one to the
+        load of its agent.
+        """
+        load = self._get_load(plugin, context, candidates)
+        heap = [(load[agent['id']], agent['host'], agent['id'], agent)
+                for agent in candidates]
+        heapq.heapify(heap)
+        placements = {}
+        for lb_id in loadbalancer_ids:
+            agent_load, host, agent_id, agent = heapq.heappop(heap)
+            placements.setdefault(agent_id, (agent, []))[1].append(lb_id)
+            heapq.heappush(heap, (agent_load + 1, host, agent_id, agent))
+        return list(placements.values())
@@ -13,7 +13,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import re
+import time
 
 import netaddr
 from neutron.callbacks import events
@@ -22,6 +24,8 @@ from neutron.callbacks import resources
 from neutron.common import ipv6_utils
 from neutron.db import api as db_api
 from neutron.db import common_db_mixin as base_db
+from neutron.db.models import servicetype as st_db
+from neutron.db import models_v2
 from neutron.plugins.common import constants
 from neutron_lib import constants as n_const
 from neutron_lib import exceptions as n_exc
@@ -30,7 +34,8 @@ from oslo_db import exception
 from oslo_log import log as logging
 from oslo_utils import excutils
 from oslo_utils import uuidutils
-from sqlalchemy import orm
+from sqlalchemy import event
+from sqlalchemy import func
 from sqlalchemy.orm import exc
 from sqlalchemy.orm import lazyload
 
@@ -46,8 +51,204 @@ from neutron_lbaas.services.loadbalancer import data_models
 
 LOG = logging.getLogger(__name__)
 
+# Maximum number of ids bound into a single IN clause when bulk loading
+# load balancer graphs.
+GRAPH_QUERY_CHUNK_SIZE = 500
+# Seconds a status graph is reused by get_loadbalancer_status_graph
+STATUS_GRAPH_CACHE_TTL = 2
+# Maximum number of load balancers whose status graphs are cached
+STATUS_GRAPH_CACHE_SIZE = 1024
+# Columns of the entities read to build the status tree of a load balancer
+STATUS_GRAPH_COLUMNS = {
+    models.LoadBalancer: ('id', 'name', 'admin_state_up',
+                          'provisioning_status', 'operating_status'),
+    models.Listener: ('id', 'name', 'loadbalancer_id', 'default_pool_id',
+                      'admin_state_up', 'provisioning_status',
+                      'operating_status'),
+    models.PoolV2: ('id', 'name', 'loadbalancer_id', 'healthmonitor_id',
+                    'admin_state_up', 'provisioning_status',
+                    'operating_status'),
+    models.L7Policy: ('id', 'name', 'listener_id', 'action',
+                      'admin_state_up', 'provisioning_status'),
+    models.L7Rule: ('id', 'l7policy_id', 'type', 'admin_state_up',
+                    'provisioning_status'),
+    models.MemberV2: ('id', 'name', 'pool_id', 'address', 'protocol_port',
+                      'admin_state_up', 'provisioning_status',
+                      'operating_status'),
+    models.HealthMonitorV2: ('id', 'name', 'type', 'admin_state_up',
+                             'provisioning_status'),
+}
+
+
+class StatusGraphCache(object):
+    """Status graphs of load balancers, reused for a short time.
+
+    A graph is dropped as soon as a status of one of its entities is
+    written, or one of its entities is deleted, and once more when the
+    transaction of the write commits. A graph read while such a write
+    happened is not stored. At most STATUS_GRAPH_CACHE_SIZE load balancers
+    are cached, the oldest ones are dropped first.
+    """
 
-class LoadBalancerPluginDbv2(base_db.CommonDbMixin,
+    # key of the session info holding the ids to drop on commit
+    SESSION_KEY = 'lbaas_status_graph_ids'
+
+    def __init__(self):
+        # load balancer id -> (entity ids, {scope: (expiration, graph)}),
+        # oldest first
+        self._graphs = collections.OrderedDict()
+        # entity id -> id of the load balancer of its cached graph
+        self._owners = {}
+        self.generation = 0
+
+    def get(self, lb_id, scope):
+        entry = self._graphs.get(lb_id)
+        cached = entry[1].get(scope) if entry else None
+        if not cached:
+            return None
+        if cached[0] > time.time():
+            return cached[1]
+        del entry[1][scope]
+        if not entry[1]:
+            self._drop(lb_id)
+
+    def put(self, lb_id, scope, graph, entity_ids, generation):
+        if generation != self.generation:
+            return
+        entry = self._graphs.get(lb_id)
+        if entry is None:
+            while len(self._graphs) >= STATUS_GRAPH_CACHE_SIZE:
+                self._drop(next(iter(self._graphs)))
+            entry = self._graphs[lb_id] = (set(), {})
+        entry[0].update(entity_ids)
+        entry[1][scope] = (time.time() + STATUS_GRAPH_CACHE_TTL, graph)
+        for entity_id in entity_ids:
+            self._owners[entity_id] = lb_id
+
+    def _drop(self, lb_id):
+        entry = self._graphs.pop(lb_id, None)
+        if entry:
+            for entity_id in entry[0]:
+                self._owners.pop(entity_id, None)
+
+    def invalidate(self, id, session=None):
+        """Drops the graph holding the entity id.
+
+        With a session, the graph is dropped again once the transaction of
+        the session commits, so a graph read before the commit is not
+        served.
+        """
+        self.generation += 1
+        self._drop(self._owners.get(id, id))
+        if session is None:
+            return
+        ids = session.info.get(self.SESSION_KEY)
+        if ids is None:
+            ids = session.info[self.SESSION_KEY] = set()
+            event.listen(session, 'after_commit', self._after_commit,
+                         once=True)
+        ids.add(id)
+
+    def _after_commit(self, session):
+        for id in session.info.pop(self.SESSION_KEY, ()):
+            self.invalidate(id)
+
+
+_status_graphs = StatusGraphCache()
+
+# Provisioning statuses of a load balancer which forbid its modification
+PENDING_STATUSES = (constants.PENDING_CREATE, constants.PENDING_UPDATE,
+                    constants.PENDING_DELETE)
+# Joins from a model to the column holding the id of its root load balancer
+ROOT_LOADBALANCER_PATHS = {
+    models.LoadBalancer: ((), models.LoadBalancer.id),
+    models.Listener: ((), models.Listener.loadbalancer_id),
+    models.PoolV2: ((), models.PoolV2.loadbalancer_id),
+    models.MemberV2: (
+        ((models.PoolV2, models.MemberV2.pool_id == models.PoolV2.id),),
+        models.PoolV2.loadbalancer_id),
+    models.HealthMonitorV2: (
+        ((models.PoolV2,
+          models.PoolV2.healthmonitor_id == models.HealthMonitorV2.id),),
+        models.PoolV2.loadbalancer_id),
+    models.L7Policy: (
+        ((models.Listener,
+          models.L7Policy.listener_id == models.Listener.id),),
+        models.Listener.loadbalancer_id),
+    models.L7Rule: (
+        ((models.L7Policy, models.L7Rule.l7policy_id == models.L7Policy.id),
+         (models.Listener, models.L7Policy.listener_id == models.Listener.id)),
+        models.Listener.loadbalancer_id),
+}
+
+
+class LoadBalancerStatusDbMixin(base_db.CommonDbMixin):
+    """Reads and writes the statuses of the LBaaS entities alone.
+
+    Only the id and status columns are read, the joined relationships of
+    the models are never loaded, and the statuses of many entities of a
+    model are written with a single UPDATE.
+    """
+
+    def get_provisioning_statuses(self, context, model, ids):
+        """Maps the ids of entities of model to their provisioning status.
+
+        Entities that do not exist are left out.
+        """
+        ids = list(ids)
+        statuses = {}
+        for i in range(0, len(ids), GRAPH_QUERY_CHUNK_SIZE):
+            query = self._model_query(context, model).with_entities(
+                model.id, model.provisioning_status).filter(
+                model.id.in_(ids[i:i + GRAPH_QUERY_CHUNK_SIZE]))
+            statuses.update(query)
+        return statuses
+
+    def get_root_loadbalancer_id(self, context, model, id):
+        joins, lb_id_column = ROOT_LOADBALANCER_PATHS[model]
+        query = self._model_query(context, model).filter(model.id == id)
+        for target, onclause in joins:
+            query = query.outerjoin(target, onclause)
+        row = query.with_entities(lb_id_column).first()
+        if row is None:
+            raise loadbalancerv2.EntityNotFound(name=model.NAME, id=id)
+        return row[0]
+
+    def set_statuses(self, context, model, ids, provisioning_status=None,
+                     operating_status=None, only_statuses=None,
+                     except_statuses=None):
+        """Sets the statuses of the entities of model with bulk UPDATEs.
+
+        Only the entities whose provisioning status is in only_statuses, or
+        not in except_statuses, are changed. Returns the number of entities
+        changed.
+        """
+        values = {}
+        if provisioning_status:
+            values[model.provisioning_status] = provisioning_status
+        if operating_status and hasattr(model, 'operating_status'):
+            values[model.operating_status] = operating_status
+        ids = list(ids)
+        if not values or not ids:
+            return 0
+        for id in ids:
+            _status_graphs.invalidate(id, context.session)
+        count = 0
+        with context.session.begin(subtransactions=True):
+            for i in range(0, len(ids), GRAPH_QUERY_CHUNK_SIZE):
+                query = self._model_query(context, model).filter(
+                    model.id.in_(ids[i:i + GRAPH_QUERY_CHUNK_SIZE]))
+                if only_statuses:
+                    query = query.filter(
+                        model.provisioning_status.in_(only_statuses))
+                if except_statuses:
+                    query = query.filter(
+                        ~model.provisioning_status.in_(except_statuses))
+                count += query.update(values, synchronize_session='fetch')
+        return count
+
+
+class LoadBalancerPluginDbv2(LoadBalancerStatusDbMixin,
                              agent_scheduler.LbaasAgentSchedulerDbMixin):
     """Wraps loadbalancer with SQLAlchemy models.
 
@@ -198,34 +399,37 @@ class LoadBalancerPluginDbv2(base_db.CommonDbMixin,
 
     def assert_modification_allowed(self, obj):
         status = getattr(obj, 'provisioning_status', None)
-        if status in [constants.PENDING_DELETE, constants.PENDING_UPDATE,
-                      constants.PENDING_CREATE]:
+        if status in PENDING_STATUSES:
             id = getattr(obj, 'id', None)
             raise loadbalancerv2.StateInvalid(id=id, state=status)
 
     def test_and_set_status(self, context, model, id, status):
         with context.session.begin(subtransactions=True):
-            db_lb_child = None
-            if model == models.LoadBalancer:
-                db_lb = self._get_resource(context, model, id, for_update=True)
-            else:
-                db_lb_child = self._get_resource(context, model, id)
-                db_lb = self._get_resource(context, models.LoadBalancer,
-                                           db_lb_child.root_loadbalancer.id)
-            # This method will raise an exception if modification is not
-            # allowed.
-            self.assert_modification_allowed(db_lb)
-
             # if the model passed in is not a load balancer then we will
             # set its root load balancer's provisioning status to
             # PENDING_UPDATE and the model's status to the status passed in
             # Otherwise we are just setting the load balancer's provisioning
             # status to the status passed in
-            if db_lb_child:
-                db_lb.provisioning_status = constants.PENDING_UPDATE
-                db_lb_child.provisioning_status = status
+            if model == models.LoadBalancer:
+                lb_id, lb_status = id, status
             else:
-                db_lb.provisioning_status = status
+                lb_id = self.get_root_loadbalancer_id(context, model, id)
+                lb_status = constants.PENDING_UPDATE
+            # The load balancer is tested and set by the same UPDATE, it is
+            # only read when the modification is not allowed.
+            if not self.set_statuses(context, models.LoadBalancer, [lb_id],
+                                     provisioning_status=lb_status,
+                                     except_statuses=PENDING_STATUSES):
+                current = self.get_provisioning_statuses(
+                    context, models.LoadBalancer, [lb_id])
+                if lb_id not in current:
+                    raise loadbalancerv2.EntityNotFound(
+                        name=models.LoadBalancer.NAME, id=lb_id)
+                raise loadbalancerv2.StateInvalid(id=lb_id,
+                                                  state=current[lb_id])
+            if model != models.LoadBalancer:
+                self.set_statuses(context, model, [id],
+                                  provisioning_status=status)
 
     def update_loadbalancer_provisioning_status(self, context, lb_id,
                                                 status=constants.ACTIVE):
@@ -235,23 +439,45 @@ class LoadBalancerPluginDbv2(base_db.CommonDbMixin,
     def update_status(self, context, model, id, provisioning_status=None,
                       operating_status=None):
         with context.session.begin(subtransactions=True):
-            if issubclass(model, models.LoadBalancer):
-                try:
-                    model_db = (self._model_query(context, model).
-                                filter(model.id == id).
-                                options(orm.noload('vip_port')).
-                                one())
-                except exc.NoResultFound:
-                    raise loadbalancerv2.EntityNotFound(
-                        name=models.LoadBalancer.NAME, id=id)
-            else:
-                model_db = self._get_resource(context, model, id)
-            if provisioning_status and (model_db.provisioning_status !=
-                                        provisioning_status):
-                model_db.provisioning_status = provisioning_status
-            if (operating_status and hasattr(model_db, 'operating_status') and
-                    model_db.operating_status != operating_status):
-                model_db.operating_status = operating_status
+            if not self.set_statuses(context, model, [id],
+                                     provisioning_status=provisioning_status,
+                                     operating_status=operating_status):
+                # nothing was written, either nothing had to be or the
+                # entity does not exist
+                if not self.get_provisioning_statuses(context, model, [id]):
+                    raise loadbalancerv2.EntityNotFound(name=model.NAME,
+                                                        id=id)
+
+    def update_statuses(self, context, statuses):
+        """Applies a batch of status changes in a single transaction.
+
+        statuses is a list of (model, id, provisioning_status,
+        operating_status) tuples, one row is looked up per model instead of
+        one query per status change. Returns the (model, id) pairs that
+        could not be found.
+        """
+        changes_by_model = collections.OrderedDict()
+        for model, id, provisioning_status, operating_status in statuses:
+            _status_graphs.invalidate(id, context.session)
+            changes_by_model.setdefault(model, collections.OrderedDict())[
+                id] = (provisioning_status, operating_status)
+        not_found = []
+        with context.session.begin(subtransactions=True):
+            for model, changes in changes_by_model.items():
+                for model_db in self._get_resources_by_column(
+                        context, model, model.id, changes):
+                    self._set_status(model_db, *changes.pop(model_db.id))
+                not_found.extend((model, id) for id in changes)
+        return not_found
+
+    @staticmethod
+    def _set_status(model_db, provisioning_status, operating_status):
+        if provisioning_status and (model_db.provisioning_status !=
+                                    provisioning_status):
+            model_db.provisioning_status = provisioning_status
+        if (operating_status and hasattr(model_db, 'operating_status') and
+                model_db.operating_status != operating_status):
+            model_db.operating_status = operating_status
 
     def create_loadbalancer_graph(self, context, loadbalancer,
                                   allocate_vip=True):
@@ -347,6 +573,7 @@ class LoadBalancerPluginDbv2(base_db.CommonDbMixin,
         return data_models.LoadBalancer.from_sqlalchemy_model(lb_db)
 
     def delete_loadbalancer(self, context, id, delete_vip_port=True):
+        _status_graphs.invalidate(id, context.session)
         with context.session.begin(subtransactions=True):
             lb_db = self._get_resource(context, models.LoadBalancer, id)
             context.session.delete(lb_db)
@@ -374,16 +601,235 @@ class LoadBalancerPluginDbv2(base_db.CommonDbMixin,
             _prevent_lbaasv2_port_delete_callback, resources.PORT,
             events.BEFORE_DELETE)
 
+    def _get_resources_by_column(self, context, model, column, values,
+                                 order_by=None, eager_load=False,
+                                 columns=None):
+        """Returns the rows of model whose column value is in values.
+
+        Unless eager_load is set, relationships of the rows are not loaded.
+        With columns, only those columns of the rows are read. The values
+        are split in chunks so the IN clause stays a reasonable size.
+        """
+        values = list(values)
+        results = []
+        for i in range(0, len(values), GRAPH_QUERY_CHUNK_SIZE):
+            if columns:
+                query = context.session.query(
+                    *[getattr(model, name) for name in columns])
+            else:
+                query = context.session.query(model)
+            query = query.filter(
+                column.in_(values[i:i + GRAPH_QUERY_CHUNK_SIZE]))
+            if not eager_load and not columns:
+                query = query.options(lazyload('*'))
+            if order_by is not None:
+                query = query.order_by(order_by)
+            results.extend(query)
+        return results
+
+    def _load_loadbalancer_graphs(self, context, lb_dbs):
+        """Builds complete load balancer data models for lb_dbs.
+
+        Each table of the graph is read with one query (per chunk of ids)
+        and the data models are wired together from id indexed maps, instead
+        of relying on the joined relationships of the SQLAlchemy models.
+        """
+        lbs = collections.OrderedDict()
+        for lb_db in lb_dbs:
+            lbs[lb_db.id] = data_models.LoadBalancer.from_sqlalchemy_columns(
+                lb_db)
+        if not lbs:
+            return []
+
+        for provider_db in self._get_resources_by_column(
+                context, st_db.ProviderResourceAssociation,
+                st_db.ProviderResourceAssociation.resource_id, lbs):
+            lbs[provider_db.resource_id].provider = (
+                data_models.ProviderResourceAssociation.
+                from_sqlalchemy_columns(provider_db))
+
+        for stats_db in self._get_resources_by_column(
+                context, models.LoadBalancerStatistics,
+                models.LoadBalancerStatistics.loadbalancer_id, lbs):
+            stats = data_models.LoadBalancerStatistics.from_sqlalchemy_columns(
+                stats_db)
+            stats.loadbalancer = lbs[stats.loadbalancer_id]
+            stats.loadbalancer.stats = stats
+
+        lbs_by_port = {}
+        for lb in lbs.values():
+            if lb.vip_port_id:
+                lbs_by_port.setdefault(lb.vip_port_id, []).append(lb)
+        # Ports keep their own eager loading so fixed ips come along.
+        for port_db in self._get_resources_by_column(
+                context, models_v2.Port, models_v2.Port.id, lbs_by_port,
+                eager_load=True):
+            port = data_models.Port.from_sqlalchemy_model(port_db)
+            for lb in lbs_by_port[port_db.id]:
+                lb.vip_port = port
+
+        pools = {}
+        for pool_db in self._get_resources_by_column(
+                context, models.PoolV2, models.PoolV2.loadbalancer_id, lbs):
+            pool = data_models.Pool.from_sqlalchemy_columns(pool_db)
+            pool.loadbalancer = lbs[pool.loadbalancer_id]
+            pool.loadbalancer.pools.append(pool)
+            pools[pool.id] = pool
+
+        listeners = {}
+        for listener_db in self._get_resources_by_column(
+                context, models.Listener, models.Listener.loadbalancer_id,
+                lbs):
+            listener = data_models.Listener.from_sqlalchemy_columns(
+                listener_db)
+            listener.loadbalancer = lbs[listener.loadbalancer_id]
+            listener.loadbalancer.listeners.append(listener)
+            listener.default_pool = pools.get(listener.default_pool_id)
+            if listener.default_pool:
+                listener.default_pool.listeners.append(listener)
+            listeners[listener.id] = listener
+
+        for pool in pools.values():
+            if pool.listeners:
+                pool.listener = pool.listeners[0]
+
+        for sni_db in self._get_resources_by_column(
+                context, models.SNI, models.SNI.listener_id, listeners,
+                order_by=models.SNI.position):
+            sni = data_models.SNI.from_sqlalchemy_columns(sni_db)
+            sni.listener = listeners[sni.listener_id]
+            sni.listener.sni_containers.append(sni)
+
+        policies = {}
+        for policy_db in self._get_resources_by_column(
+                context, models.L7Policy, models.L7Policy.listener_id,
+                listeners, order_by=models.L7Policy.position):
+            policy = data_models.L7Policy.from_sqlalchemy_columns(policy_db)
+            policy.listener = listeners[policy.listener_id]
+            policy.listener.l7_policies.append(policy)
+            policy.redirect_pool = pools.get(policy.redirect_pool_id)
+            if policy.redirect_pool:
+                policy.redirect_pool.l7_policies.append(policy)
+            policies[policy.id] = policy
+
+        for rule_db in self._get_resources_by_column(
+                context, models.L7Rule, models.L7Rule.l7policy_id, policies):
+            rule = data_models.L7Rule.from_sqlalchemy_columns(rule_db)
+            rule.policy = policies[rule.l7policy_id]
+            rule.policy.rules.append(rule)
+
+        for sp_db in self._get_resources_by_column(
+                context, models.SessionPersistenceV2,
+                models.SessionPersistenceV2.pool_id, pools):
+            sp = data_models.SessionPersistence.from_sqlalchemy_columns(sp_db)
+            sp.pool = pools[sp.pool_id]
+            sp.pool.session_persistence = sp
+
+        for member_db in self._get_resources_by_column(
+                context, models.MemberV2, models.MemberV2.pool_id, pools):
+            member = data_models.Member.from_sqlalchemy_columns(member_db)
+            member.pool = pools[member.pool_id]
+            member.pool.members.append(member)
+
+        pools_by_hm = {pool.healthmonitor_id: pool
+                       for pool in pools.values() if pool.healthmonitor_id}
+        for hm_db in self._get_resources_by_column(
+                context, models.HealthMonitorV2, models.HealthMonitorV2.id,
+                pools_by_hm):
+            hm = data_models.HealthMonitor.from_sqlalchemy_columns(hm_db)
+            hm.pool = pools_by_hm[hm.id]
+            hm.pool.healthmonitor = hm
+
+        return list(lbs.values())
+
     def get_loadbalancers(self, context, filters=None):
-        lb_dbs = self._get_resources(context, models.LoadBalancer,
-                                     filters=filters)
-        return [data_models.LoadBalancer.from_sqlalchemy_model(lb_db)
-                for lb_db in lb_dbs]
+        query = self._get_collection_query(context, models.LoadBalancer,
+                                           filters=filters)
+        return self._load_loadbalancer_graphs(
+            context, query.options(lazyload('*')))
 
     def get_loadbalancer(self, context, id):
         lb_db = self._get_resource(context, models.LoadBalancer, id)
         return data_models.LoadBalancer.from_sqlalchemy_model(lb_db)
 
+    def get_loadbalancer_graph(self, context, id):
+        """Returns the load balancer using the bulk graph loader."""
+        lbs = self.get_loadbalancers(context, filters={'id': [id]})
+        if not lbs:
+            raise loadbalancerv2.EntityNotFound(
+                name=models.LoadBalancer.NAME, id=id)
+        return lbs[0]
+
+    def get_loadbalancer_status_graph(self, context, id, use_cache=True):
+        """Returns the load balancer with what its status tree needs.
+
+        Only the names, statuses and relationships of the entities are
+        read, one query per table. The graph is reused for
+        STATUS_GRAPH_CACHE_TTL seconds unless a status of the load balancer
+        changes meanwhile. The cached graph is shared, callers which modify
+        the graph or need the current statuses pass use_cache=False to get
+        a graph of their own.
+        """
+        scope = None if context.is_admin else context.tenant_id
+        lb = _status_graphs.get(id, scope) if use_cache else None
+        if lb:
+            return lb
+        generation = _status_graphs.generation
+
+        columns = STATUS_GRAPH_COLUMNS[models.LoadBalancer]
+        lb_row = self._model_query(context, models.LoadBalancer).with_entities(
+            *[getattr(models.LoadBalancer, name) for name in columns]).filter(
+            models.LoadBalancer.id == id).first()
+        if lb_row is None:
+            raise loadbalancerv2.EntityNotFound(
+                name=models.LoadBalancer.NAME, id=id)
+        lb = data_models.LoadBalancer(**lb_row._asdict())
+        entity_ids = [lb.id]
+
+        def _read(model, column, values, order_by=None):
+            rows = self._get_resources_by_column(
+                context, model, column, values, order_by=order_by,
+                columns=STATUS_GRAPH_COLUMNS[model])
+            entity_ids.extend(row.id for row in rows)
+            return [row._asdict() for row in rows]
+
+        pools = {}
+        for row in _read(models.PoolV2, models.PoolV2.loadbalancer_id, [id]):
+            pool = pools[row['id']] = data_models.Pool(**row)
+            lb.pools.append(pool)
+
+        listeners = {}
+        for row in _read(models.Listener, models.Listener.loadbalancer_id,
+                         [id]):
+            listener = listeners[row['id']] = data_models.Listener(**row)
+            listener.default_pool = pools.get(listener.default_pool_id)
+            lb.listeners.append(listener)
+
+        policies = {}
+        for row in _read(models.L7Policy, models.L7Policy.listener_id,
+                         listeners, order_by=models.L7Policy.position):
+            policy = policies[row['id']] = data_models.L7Policy(**row)
+            listeners[policy.listener_id].l7_policies.append(policy)
+
+        for row in _read(models.L7Rule, models.L7Rule.l7policy_id, policies):
+            rule = data_models.L7Rule(**row)
+            policies[rule.l7policy_id].rules.append(rule)
+
+        for row in _read(models.MemberV2, models.MemberV2.pool_id, pools):
+            member = data_models.Member(**row)
+            pools[member.pool_id].members.append(member)
+
+        pools_by_hm = dict((pool.healthmonitor_id, pool)
+                           for pool in pools.values() if pool.healthmonitor_id)
+        for row in _read(models.HealthMonitorV2, models.HealthMonitorV2.id,
+                         pools_by_hm):
+            pools_by_hm[row['id']].healthmonitor = (
+                data_models.HealthMonitor(**row))
+
+        if use_cache:
+            _status_graphs.put(id, scope, lb, entity_ids, generation)
+        return lb
+
     def _validate_listener_data(self, context, listener):
         pool_id = listener.get('default_pool_id')
         lb_id = listener.get('loadbalancer_id')
@@ -547,6 +993,7 @@ class LoadBalancerPluginDbv2(base_db.CommonDbMixin,
         return data_models.Listener.from_sqlalchemy_model(listener_db)
 
     def delete_listener(self, context, id):
+        _status_graphs.invalidate(id, context.session)
         listener_db_entry = self._get_resource(context, models.Listener, id)
         with context.session.begin(subtransactions=True):
             context.session.delete(listener_db_entry)
@@ -653,6 +1100,7 @@ class LoadBalancerPluginDbv2(base_db.CommonDbMixin,
         return data_models.Pool.from_sqlalchemy_model(pool_db)
 
     def delete_pool(self, context, id):
+        _status_graphs.invalidate(id, context.session)
         with context.session.begin(subtransactions=True):
             pool_db = self._get_resource(context, models.PoolV2, id)
             for l in pool_db.listeners:
@@ -701,6 +1149,7 @@ class LoadBalancerPluginDbv2(base_db.CommonDbMixin,
         return data_models.Member.from_sqlalchemy_model(member_db)
 
     def delete_pool_member(self, context, id):
+        _status_graphs.invalidate(id, context.session)
         with context.session.begin(subtransactions=True):
             member_db = self._get_resource(context, models.MemberV2, id)
             context.session.delete(member_db)
@@ -717,6 +1166,7 @@ class LoadBalancerPluginDbv2(base_db.CommonDbMixin,
         return data_models.Member.from_sqlalchemy_model(member_db)
 
     def delete_member(self, context, id):
+        _status_graphs.invalidate(id, context.session)
         with context.session.begin(subtransactions=True):
             member_db = self._get_resource(context, models.MemberV2, id)
             context.session.delete(member_db)
@@ -752,6 +1202,7 @@ class LoadBalancerPluginDbv2(base_db.CommonDbMixin,
         return data_models.HealthMonitor.from_sqlalchemy_model(hm_db)
 
     def delete_healthmonitor(self, context, id):
+        _status_graphs.invalidate(id, context.session)
         with context.session.begin(subtransactions=True):
             hm_db_entry = self._get_resource(context,
                                              models.HealthMonitorV2, id)
@@ -779,9 +1230,93 @@ class LoadBalancerPluginDbv2(base_db.CommonDbMixin,
                                                           loadbalancer_id,
                                                           data=stats_data)
 
+    def update_loadbalancers_stats(self, context, stats_by_lb):
+        """Stores the statistics of several load balancers at once.
+
+        stats_by_lb maps load balancer ids to their statistics. Returns the
+        ids of the load balancers that were not found.
+        """
+        not_found = []
+        with context.session.begin(subtransactions=True):
+            missing = set(stats_by_lb)
+            for stats_db in self._get_resources_by_column(
+                    context, models.LoadBalancerStatistics,
+                    models.LoadBalancerStatistics.loadbalancer_id,
+                    stats_by_lb):
+                missing.discard(stats_db.loadbalancer_id)
+                new_stats = self._create_loadbalancer_stats(
+                    context, stats_db.loadbalancer_id,
+                    data=stats_by_lb[stats_db.loadbalancer_id])
+                for attr in ('bytes_in', 'bytes_out', 'active_connections',
+                             'total_connections'):
+                    setattr(stats_db, attr, getattr(new_stats, attr))
+            for loadbalancer_id in missing:
+                if self._resource_exists(context, models.LoadBalancer,
+                                         loadbalancer_id):
+                    self.update_loadbalancer_stats(
+                        context, loadbalancer_id, stats_by_lb[loadbalancer_id])
+                else:
+                    not_found.append(loadbalancer_id)
+        return not_found
+
+    def update_listeners_stats(self, context, stats_by_listener):
+        """Stores the statistics of several listeners at once.
+
+        stats_by_listener maps listener ids to their statistics. Returns the
+        ids of the listeners that were not found.
+        """
+        with context.session.begin(subtransactions=True):
+            missing = set(stats_by_listener)
+            for stats_db in self._get_resources_by_column(
+                    context, models.ListenerStatistics,
+                    models.ListenerStatistics.listener_id,
+                    stats_by_listener):
+                missing.discard(stats_db.listener_id)
+                values = self._listener_stats_values(
+                    stats_by_listener[stats_db.listener_id])
+                for attr, value in values.items():
+                    setattr(stats_db, attr, value)
+            for listener in self._get_resources_by_column(
+                    context, models.Listener, models.Listener.id, missing,
+                    columns=('id',)):
+                missing.discard(listener.id)
+                context.session.add(models.ListenerStatistics(
+                    listener_id=listener.id,
+                    **self._listener_stats_values(
+                        stats_by_listener[listener.id])))
+        return list(missing)
+
+    @staticmethod
+    def _listener_stats_values(data):
+        return {
+            'bytes_in': int(data.get(lb_const.STATS_IN_BYTES) or 0),
+            'bytes_out': int(data.get(lb_const.STATS_OUT_BYTES) or 0),
+            'active_connections': int(
+                data.get(lb_const.STATS_ACTIVE_CONNECTIONS) or 0),
+            'total_connections': int(
+                data.get(lb_const.STATS_TOTAL_CONNECTIONS) or 0)}
+
     def stats(self, context, loadbalancer_id):
         loadbalancer = self._get_resource(context, models.LoadBalancer,
                                           loadbalancer_id)
+        # Drivers reporting statistics per listener have them summed here,
+        # so reports stored by different workers never overwrite each other.
+        listener_stats = models.ListenerStatistics
+        query = context.session.query(
+            func.count(listener_stats.listener_id),
+            func.sum(listener_stats.bytes_in),
+            func.sum(listener_stats.bytes_out),
+            func.sum(listener_stats.active_connections),
+            func.sum(listener_stats.total_connections)).join(
+            models.Listener,
+            models.Listener.id == listener_stats.listener_id).filter(
+            models.Listener.loadbalancer_id == loadbalancer_id)
+        count, bytes_in, bytes_out, active, total = query.one()
+        if count:
+            return data_models.LoadBalancerStatistics(
+                loadbalancer_id=loadbalancer_id, bytes_in=int(bytes_in),
+                bytes_out=int(bytes_out), active_connections=int(active),
+                total_connections=int(total))
         return data_models.LoadBalancerStatistics.from_sqlalchemy_model(
             loadbalancer.stats)
 
@@ -846,6 +1381,7 @@ class LoadBalancerPluginDbv2(base_db.CommonDbMixin,
         return data_models.L7Policy.from_sqlalchemy_model(l7policy_db)
 
     def delete_l7policy(self, context, id):
+        _status_graphs.invalidate(id, context.session)
         with context.session.begin(subtransactions=True):
             l7policy_db = self._get_resource(context, models.L7Policy, id)
             listener_id = l7policy_db.listener_id
@@ -901,6 +1437,7 @@ class LoadBalancerPluginDbv2(base_db.CommonDbMixin,
         return data_models.L7Rule.from_sqlalchemy_model(rule_db)
 
     def delete_l7policy_rule(self, context, id):
+        _status_graphs.invalidate(id, context.session)
         with context.session.begin(subtransactions=True):
             rule_db_entry = self._get_resource(context, models.L7Rule, id)
             context.session.delete(rule_db_entry)
@@ -66,6 +66,24 @@ class LoadBalancerStatistics(model_base.BASEV2):
         return value
 
 
+class ListenerStatistics(model_base.BASEV2):
+    """Represents the statistics a driver reports for a listener."""
+
+    NAME = 'listener_stats'
+
+    __tablename__ = "lbaas_listener_statistics"
+
+    listener_id = sa.Column(sa.String(36),
+                            sa.ForeignKey("lbaas_listeners.id",
+                                          ondelete="CASCADE"),
+                            primary_key=True,
+                            nullable=False)
+    bytes_in = sa.Column(sa.BigInteger, nullable=False)
+    bytes_out = sa.Column(sa.BigInteger, nullable=False)
+    active_connections = sa.Column(sa.BigInteger, nullable=False)
+    total_connections = sa.Column(sa.BigInteger, nullable=False)
+
+
 class MemberV2(model_base.BASEV2, model_base.HasId, model_base.HasProject):
     """Represents a v2 neutron load balancer member."""
 
@@ -367,6 +385,10 @@ class Listener(model_base.BASEV2, model_base.HasId, model_base.HasProject):
         foreign_keys=[L7Policy.listener_id],
         cascade="all, delete-orphan",
         backref=orm.backref("listener"))
+    stats = orm.relationship(
+        ListenerStatistics,
+        uselist=False,
+        cascade="all, delete-orphan")
 
     @property
     def root_loadbalancer(self):
@@ -0,0 +1,45 @@
+# Copyright 2017 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Add listener statistics
+
+Revision ID: a6ba4c2d5f1e
+Revises: 844352f9fe6f
+Create Date: 2017-01-18 10:12:41.533421
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6ba4c2d5f1e'
+down_revision = '844352f9fe6f'
+
+
+def upgrade():
+    op.create_table(
+        u'lbaas_listener_statistics',
+        sa.Column(u'listener_id', sa.String(36), nullable=False),
+        sa.Column(u'bytes_in', sa.BigInteger(), nullable=False),
+        sa.Column(u'bytes_out', sa.BigInteger(), nullable=False),
+        sa.Column(u'active_connections', sa.BigInteger(), nullable=False),
+        sa.Column(u'total_connections', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint(u'listener_id'),
+        sa.ForeignKeyConstraint([u'listener_id'],
+                                [u'lbaas_listeners.id'],
+                                ondelete='CASCADE')
+    )
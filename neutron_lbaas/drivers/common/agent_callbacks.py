@@ -12,11 +12,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
+
 from neutron.plugins.common import constants
 from neutron_lib.api.definitions import portbindings
 from neutron_lib import exceptions as n_exc
 from oslo_log import log as logging
 import oslo_messaging as messaging
+from oslo_serialization import jsonutils
 
 from neutron_lbaas._i18n import _, _LW
 from neutron_lbaas.db.loadbalancer import loadbalancer_dbv2
@@ -25,12 +28,48 @@ from neutron_lbaas.services.loadbalancer import data_models
 
 LOG = logging.getLogger(__name__)
 
+MODEL_MAPPING = {
+    'loadbalancer': db_models.LoadBalancer,
+    'pool': db_models.PoolV2,
+    'listener': db_models.Listener,
+    'member': db_models.MemberV2,
+    'healthmonitor': db_models.HealthMonitorV2
+}
+
+
+# statuses set by the health checks, they change without anything to
+# deploy. The provisioning statuses are kept: the drivers render a member,
+# a pool or a listener depending on them (PENDING_DELETE).
+REVISION_EXCLUDED_FIELDS = ('operating_status',)
+
+
+def _strip_statuses(value):
+    if isinstance(value, dict):
+        return dict((k, _strip_statuses(v)) for k, v in value.items()
+                    if k not in REVISION_EXCLUDED_FIELDS)
+    if isinstance(value, list):
+        return [_strip_statuses(v) for v in value]
+    return value
+
+
+def get_revision(lb_dict):
+    """Returns the revision of a serialized load balancer graph.
+
+    The load balancer tables have no revision number, the revision is a
+    digest of everything an agent deploys, operating statuses excluded.
+    """
+    return hashlib.sha1(jsonutils.dumps(
+        _strip_statuses(lb_dict), sort_keys=True).encode('utf-8')).hexdigest()
+
 
 class LoadBalancerCallbacks(object):
 
     # history
     #   1.0 Initial version
-    target = messaging.Target(version='1.0')
+    #   1.1 Add update_statuses_bulk
+    #   1.2 Add update_loadbalancers_stats
+    #   1.3 Add get_loadbalancers_for_agent
+    target = messaging.Target(version='1.3')
 
     def __init__(self, plugin):
         super(LoadBalancerCallbacks, self).__init__()
@@ -65,57 +104,124 @@ class LoadBalancerCallbacks(object):
 
     def get_loadbalancer(self, context, loadbalancer_id=None):
         lb_model = self.plugin.db.get_loadbalancer(context, loadbalancer_id)
-        if lb_model.vip_port and lb_model.vip_port.fixed_ips:
-            for fixed_ip in lb_model.vip_port.fixed_ips:
-                subnet_dict = self.plugin.db._core_plugin.get_subnet(
-                    context, fixed_ip.subnet_id
-                )
-                setattr(fixed_ip, 'subnet', data_models.Subnet.from_dict(
-                    subnet_dict))
-        if lb_model.provider:
-            device_driver = self.plugin.drivers[
-                lb_model.provider.provider_name].device_driver
-            setattr(lb_model.provider, 'device_driver', device_driver)
-        if lb_model.vip_port:
-            network_dict = self.plugin.db._core_plugin.get_network(
-                context, lb_model.vip_port.network_id)
-            setattr(lb_model.vip_port, 'network',
-                    data_models.Network.from_dict(network_dict))
-        lb_dict = lb_model.to_dict(stats=False)
-
-        return lb_dict
+        return self._serialize_loadbalancers(context, [lb_model])[0]
+
+    def get_loadbalancers_for_agent(self, context, loadbalancer_ids=None,
+                                    host=None, revisions=None):
+        """Returns the graphs of several load balancers in one call.
+
+        The load balancers are the ones in loadbalancer_ids, or the ones
+        ready on host when no ids are given. Load balancers deleted in the
+        meantime are left out of the result.
+
+        Each graph carries its revision. revisions maps load balancer ids
+        to the revision the agent deployed, the graphs still at that
+        revision are sent as {'id': ..., 'revision': ..., 'unchanged': True}
+        only.
+        """
+        if loadbalancer_ids is None:
+            loadbalancer_ids = self.get_ready_devices(context, host=host)
+        if not loadbalancer_ids:
+            return []
+        revisions = revisions or {}
+        lb_models = self.plugin.db.get_loadbalancers(
+            context, filters={'id': list(loadbalancer_ids)})
+        lb_dicts = []
+        for lb_dict in self._serialize_loadbalancers(context, lb_models):
+            revision = get_revision(lb_dict)
+            if revisions.get(lb_dict['id']) == revision:
+                lb_dict = {'id': lb_dict['id'], 'unchanged': True}
+            lb_dict['revision'] = revision
+            lb_dicts.append(lb_dict)
+        return lb_dicts
+
+    def _serialize_loadbalancers(self, context, lb_models):
+        """Serializes load balancers the way the agents expect them.
+
+        The subnets and the networks of the VIP ports are fetched with one
+        call each for all the load balancers.
+        """
+        core_plugin = self.plugin.db._core_plugin
+        vip_ports = [lb_model.vip_port for lb_model in lb_models
+                     if lb_model.vip_port]
+        subnet_ids = set(fixed_ip.subnet_id for port in vip_ports
+                         for fixed_ip in port.fixed_ips or [])
+        network_ids = set(port.network_id for port in vip_ports)
+        subnets = {}
+        if subnet_ids:
+            for subnet_dict in core_plugin.get_subnets(
+                    context, filters={'id': list(subnet_ids)}):
+                subnets[subnet_dict['id']] = data_models.Subnet.from_dict(
+                    subnet_dict)
+        networks = {}
+        if network_ids:
+            for network_dict in core_plugin.get_networks(
+                    context, filters={'id': list(network_ids)}):
+                networks[network_dict['id']] = data_models.Network.from_dict(
+                    network_dict)
+
+        lb_dicts = []
+        for lb_model in lb_models:
+            if lb_model.vip_port:
+                for fixed_ip in lb_model.vip_port.fixed_ips or []:
+                    if fixed_ip.subnet_id in subnets:
+                        setattr(fixed_ip, 'subnet',
+                                subnets[fixed_ip.subnet_id])
+                if lb_model.vip_port.network_id in networks:
+                    setattr(lb_model.vip_port, 'network',
+                            networks[lb_model.vip_port.network_id])
+            if lb_model.provider:
+                device_driver = self.plugin.drivers[
+                    lb_model.provider.provider_name].device_driver
+                setattr(lb_model.provider, 'device_driver', device_driver)
+            lb_dicts.append(lb_model.to_dict(stats=False))
+        return lb_dicts
 
     def loadbalancer_deployed(self, context, loadbalancer_id):
+        db = self.plugin.db
+        pending = constants.ACTIVE_PENDING_STATUSES
         with context.session.begin(subtransactions=True):
-            qry = context.session.query(db_models.LoadBalancer)
-            qry = qry.filter_by(id=loadbalancer_id)
-            loadbalancer = qry.one()
-
-            # set all resources to active
-            if (loadbalancer.provisioning_status in
-                    constants.ACTIVE_PENDING_STATUSES):
-                loadbalancer.provisioning_status = constants.ACTIVE
-
-            if loadbalancer.listeners:
-                for l in loadbalancer.listeners:
-                    if (l.provisioning_status in
-                            constants.ACTIVE_PENDING_STATUSES):
-                        l.provisioning_status = constants.ACTIVE
-                    if (l.default_pool
-                        and l.default_pool.provisioning_status in
-                            constants.ACTIVE_PENDING_STATUSES):
-                        l.default_pool.provisioning_status = constants.ACTIVE
-                        if l.default_pool.members:
-                            for m in l.default_pool.members:
-                                if (m.provisioning_status in
-                                        constants.ACTIVE_PENDING_STATUSES):
-                                    m.provisioning_status = constants.ACTIVE
-                        if l.default_pool.healthmonitor:
-                            hm = l.default_pool.healthmonitor
-                            ps = hm.provisioning_status
-                            if ps in constants.ACTIVE_PENDING_STATUSES:
-                                (l.default_pool.healthmonitor
-                                 .provisioning_status) = constants.ACTIVE
+            # set all resources to active, only the ids of the listeners and
+            # pools are read and each table is updated at once
+            db.set_statuses(context, db_models.LoadBalancer,
+                            [loadbalancer_id],
+                            provisioning_status=constants.ACTIVE,
+                            only_statuses=pending)
+
+            listeners = context.session.query(
+                db_models.Listener.id, db_models.Listener.default_pool_id
+            ).filter_by(loadbalancer_id=loadbalancer_id).all()
+            db.set_statuses(context, db_models.Listener,
+                            [l.id for l in listeners],
+                            provisioning_status=constants.ACTIVE,
+                            only_statuses=pending)
+
+            # the members and health monitor of a default pool are only
+            # activated along with their pool
+            pool_ids = set(l.default_pool_id for l in listeners
+                           if l.default_pool_id)
+            if not pool_ids:
+                return
+            pools = context.session.query(
+                db_models.PoolV2.id, db_models.PoolV2.healthmonitor_id
+            ).filter(db_models.PoolV2.id.in_(pool_ids),
+                     db_models.PoolV2.provisioning_status.in_(pending)).all()
+            if not pools:
+                return
+            db.set_statuses(context, db_models.PoolV2,
+                            [p.id for p in pools],
+                            provisioning_status=constants.ACTIVE)
+            member_ids = [m.id for m in context.session.query(
+                db_models.MemberV2.id).filter(
+                db_models.MemberV2.pool_id.in_([p.id for p in pools]),
+                db_models.MemberV2.provisioning_status.in_(pending))]
+            db.set_statuses(context, db_models.MemberV2, member_ids,
+                            provisioning_status=constants.ACTIVE)
+            db.set_statuses(context, db_models.HealthMonitorV2,
+                            [p.healthmonitor_id for p in pools
+                             if p.healthmonitor_id],
+                            provisioning_status=constants.ACTIVE,
+                            only_statuses=pending)
 
     def update_status(self, context, obj_type, obj_id,
                       provisioning_status=None, operating_status=None):
@@ -125,18 +231,11 @@ class LoadBalancerCallbacks(object):
                             'operating_status') % {'obj_type': obj_type,
                                                    'obj_id': obj_id})
             return
-        model_mapping = {
-            'loadbalancer': db_models.LoadBalancer,
-            'pool': db_models.PoolV2,
-            'listener': db_models.Listener,
-            'member': db_models.MemberV2,
-            'healthmonitor': db_models.HealthMonitorV2
-        }
-        if obj_type not in model_mapping:
+        if obj_type not in MODEL_MAPPING:
             raise n_exc.Invalid(_('Unknown object type: %s') % obj_type)
         try:
             self.plugin.db.update_status(
-                context, model_mapping[obj_type], obj_id,
+                context, MODEL_MAPPING[obj_type], obj_id,
                 provisioning_status=provisioning_status,
                 operating_status=operating_status)
         except n_exc.NotFound:
@@ -147,6 +246,38 @@ class LoadBalancerCallbacks(object):
                             'concurrently'),
                         {'obj_type': obj_type, 'obj_id': obj_id})
 
+    def update_statuses_bulk(self, context, statuses=None):
+        """Applies a batch of status changes sent by an agent.
+
+        Each entry of statuses is a dict with the update_status arguments.
+        All the changes are applied in a single transaction.
+        """
+        updates = []
+        for status in statuses or []:
+            obj_type = status['obj_type']
+            if obj_type not in MODEL_MAPPING:
+                raise n_exc.Invalid(_('Unknown object type: %s') % obj_type)
+            provisioning_status = status.get('provisioning_status')
+            operating_status = status.get('operating_status')
+            if not provisioning_status and not operating_status:
+                LOG.warning(_LW('update_statuses_bulk for %(obj_type)s '
+                                '%(obj_id)s called without specifying '
+                                'provisioning_status or operating_status'),
+                            {'obj_type': obj_type,
+                             'obj_id': status['obj_id']})
+                continue
+            updates.append((MODEL_MAPPING[obj_type], status['obj_id'],
+                            provisioning_status, operating_status))
+        if not updates:
+            return
+        not_found = self.plugin.db.update_statuses(context, updates)
+        for model, obj_id in not_found:
+            # the object was probably deleted by another request
+            LOG.warning(_LW('Cannot update status: %(obj_type)s %(obj_id)s '
+                            'not found in the DB, it was probably deleted '
+                            'concurrently'),
+                        {'obj_type': model.NAME, 'obj_id': obj_id})
+
     def loadbalancer_destroyed(self, context, loadbalancer_id=None):
         """Agent confirmation hook that a load balancer has been destroyed.
 
@@ -212,3 +343,16 @@ class LoadBalancerCallbacks(object):
                                   stats=None):
         self.plugin.db.update_loadbalancer_stats(context, loadbalancer_id,
                                                  stats)
+
+    def update_loadbalancers_stats(self, context, stats=None):
+        """Stores the statistics collected by an agent in one cycle.
+
+        stats maps load balancer ids to their statistics.
+        """
+        if not stats:
+            return
+        not_found = self.plugin.db.update_loadbalancers_stats(context, stats)
+        for loadbalancer_id in not_found:
+            LOG.debug('Cannot update stats: loadbalancer %s not found in '
+                      'the DB, it was probably deleted concurrently',
+                      loadbalancer_id)
@@ -12,7 +12,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+
 from neutron.common import rpc as n_rpc
+from neutron import context as ncontext
 from neutron.db import agents_db
 from neutron.db import common_db_mixin
 from neutron.services import provider_configuration as provconf
@@ -21,8 +23,9 @@ from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging as messaging
 from oslo_utils import importutils
+from oslo_utils import versionutils
 
-from neutron_lbaas._i18n import _
+from neutron_lbaas._i18n import _, _LE, _LW
 from neutron_lbaas import agent_scheduler as agent_scheduler_v2
 from neutron_lbaas.common import exceptions
 from neutron_lbaas.db.loadbalancer import loadbalancer_dbv2 as ldbv2
@@ -41,6 +44,14 @@ AGENT_SCHEDULER_OPTS = [
                default='neutron_lbaas.agent_scheduler.ChanceScheduler',
                help=_('Driver to use for scheduling '
                       'to a default loadbalancer agent')),
+    cfg.StrOpt('loadbalancer_scheduler_load',
+               default='loadbalancers',
+               choices=['loadbalancers', 'listeners', 'members',
+                        'instances'],
+               help=_('Load of an agent for the LeastLoadedScheduler: the '
+                      'number of load balancers it hosts, plus their '
+                      'listeners or members, or the number of instances '
+                      'reported by the agent')),
     cfg.BoolOpt('allow_automatic_lbaas_agent_failover',
                 default=False,
                 help=_('Automatically reschedule loadbalancer from offline '
@@ -70,6 +81,7 @@ class LoadBalancerAgentApi(object):
 
     # history
     #   1.0 Initial version
+    #   1.1 Add adopt_loadbalancers
     #
 
     def __init__(self, topic):
@@ -87,6 +99,22 @@ class LoadBalancerAgentApi(object):
         cctxt.cast(context, 'create_loadbalancer',
                    loadbalancer=loadbalancer, driver_name=driver_name)
 
+    def can_adopt_loadbalancers(self, agent_conf):
+        """Whether an agent serves adopt_loadbalancers.
+
+        The client has no version cap, the agents report the version of
+        their RPC API in their configurations instead. Agents older than
+        1.1 do not report it.
+        """
+        version = agent_conf.get('rpc_version')
+        return bool(version) and (
+            versionutils.convert_version_to_tuple(version) >= (1, 1))
+
+    def adopt_loadbalancers(self, context, loadbalancer_ids, host):
+        cctxt = self.client.prepare(server=host, version='1.1')
+        cctxt.cast(context, 'adopt_loadbalancers',
+                   loadbalancer_ids=loadbalancer_ids)
+
     def update_loadbalancer(self, context, old_loadbalancer,
                             loadbalancer, host):
         cctxt = self.client.prepare(server=host)
@@ -163,15 +191,109 @@ class LoadBalancerManager(driver_base.BaseLoadBalancerManager,
         self.db = ldbv2.LoadBalancerPluginDbv2()
 
     def reschedule_lbaas_from_down_agents(self):
-        """Reschedule lbaas from down lbaasv2 agents if admin state is up."""
-        self.reschedule_resources_from_down_agents(
-                agent_type=lb_const.AGENT_TYPE_LOADBALANCERV2,
-                get_down_bindings=self.get_down_loadbalancer_bindings,
-                agent_id_attr='agent_id',
-                resource_id_attr='loadbalancer_id',
-                resource_name='loadbalancer',
-                reschedule_resource=self.reschedule_loadbalancer,
-                rescheduling_failed=exceptions.LoadbalancerReschedulingFailed)
+        """Reschedule lbaas from down lbaasv2 agents if admin state is up.
+
+        The loadbalancers of all the down agents are rescheduled at once:
+        they are spread over the least loaded active agents, their bindings
+        are rewritten in a single transaction and each new agent is asked
+        to adopt its loadbalancers with one RPC.
+        """
+        agent_dead_limit = self.agent_dead_limit_seconds()
+        self.wait_down_agents(lb_const.AGENT_TYPE_LOADBALANCERV2,
+                              agent_dead_limit)
+        context = ncontext.get_admin_context()
+        try:
+            self._reschedule_down_bindings(context, agent_dead_limit)
+        except Exception:
+            # we want to be thorough and catch whatever is raised
+            # to avoid loop abortion
+            LOG.exception(_LE("Exception encountered during loadbalancer "
+                              "rescheduling."))
+
+    def _reschedule_down_bindings(self, context, agent_dead_limit):
+        # down agent id -> ids of the loadbalancers it hosts
+        down_bindings = {}
+        for binding in self.get_down_loadbalancer_bindings(context,
+                                                           agent_dead_limit):
+            down_bindings.setdefault(binding.agent_id, []).append(
+                binding.loadbalancer_id)
+        for agent_id in list(down_bindings):
+            # we need new context to make sure we use different DB
+            # transaction - otherwise we may fetch same agent record
+            # each time due to REPEATABLE_READ isolation level
+            agent = self._get_agent(ncontext.get_admin_context(), agent_id)
+            if agent.is_active:
+                del down_bindings[agent_id]
+        if not down_bindings:
+            return
+
+        loadbalancer_ids = [lb_id for lb_ids in down_bindings.values()
+                            for lb_id in lb_ids]
+        LOG.warning(_LW("Rescheduling %(count)d loadbalancers from agents "
+                        "%(agents)s because the agents did not report to the "
+                        "server in the last %(dead_time)s seconds."),
+                    {'count': len(loadbalancer_ids),
+                     'agents': ', '.join(down_bindings),
+                     'dead_time': agent_dead_limit})
+        candidates = self.get_lbaas_agent_candidates(
+            self.driver.device_driver,
+            self.get_lbaas_agents(context, active=True))
+        if not candidates:
+            LOG.warning(_LW('No lbaas agent supporting device driver %s, '
+                            'cannot reschedule the loadbalancers'),
+                        self.driver.device_driver)
+            return
+
+        placements = self._place_loadbalancers(context, candidates,
+                                               loadbalancer_ids)
+        with context.session.begin(subtransactions=True):
+            for agent, lb_ids in placements:
+                query = context.session.query(
+                    agent_scheduler_v2.LoadbalancerAgentBinding)
+                query = query.filter(
+                    agent_scheduler_v2.LoadbalancerAgentBinding
+                    .loadbalancer_id.in_(lb_ids),
+                    agent_scheduler_v2.LoadbalancerAgentBinding
+                    .agent_id.in_(list(down_bindings)))
+                query.update({'agent_id': agent['id']},
+                             synchronize_session=False)
+
+        for agent, lb_ids in placements:
+            try:
+                self._adopt_loadbalancers(context, agent, lb_ids)
+            except messaging.MessagingException:
+                # Catch individual notification errors here
+                # so one broken agent doesn't stop the iteration.
+                LOG.exception(_LE("Failed to notify agent %(agent)s of its "
+                                  "rescheduled loadbalancers"),
+                              {'agent': agent['id']})
+
+    def _place_loadbalancers(self, context, candidates, loadbalancer_ids):
+        """Spreads loadbalancers over the candidate agents.
+
+        The placement is left to the configured loadbalancer scheduler.
+
+        :returns: list of (agent, ids of the loadbalancers placed on it)
+        """
+        return self.driver.loadbalancer_scheduler.place(
+            self.driver.plugin, context, candidates, loadbalancer_ids)
+
+    def _adopt_loadbalancers(self, context, agent, loadbalancer_ids):
+        agent_rpc = self.driver.agent_rpc
+        LOG.debug('Loadbalancers %(loadbalancer_ids)s are rescheduled to '
+                  'lbaas agent %(agent_id)s',
+                  {'loadbalancer_ids': loadbalancer_ids,
+                   'agent_id': agent['id']})
+        if agent_rpc.can_adopt_loadbalancers(
+                self.get_configuration_dict(agent)):
+            agent_rpc.adopt_loadbalancers(context, loadbalancer_ids,
+                                          agent['host'])
+            return
+        for loadbalancer in self.db.get_loadbalancers(
+                context, filters={'id': loadbalancer_ids}):
+            agent_rpc.create_loadbalancer(context, loadbalancer,
+                                          agent['host'],
+                                          self.driver.device_driver)
 
     def reschedule_loadbalancer(self, context, loadbalancer_id):
         """Reschedule loadbalancer to a new lbaas agent
@@ -70,7 +70,7 @@ class BaseManagerMixin(object):
                     l7policy.listener = listener
                     l7rules = l7policy.rules
                     for l7rule in l7rules:
-                        l7rule.l7policy = l7policy
+                        l7rule.policy = l7policy
                         self.successful_completion(context, l7rule)
                     redirect_pool = l7policy.redirect_pool
                     if redirect_pool:
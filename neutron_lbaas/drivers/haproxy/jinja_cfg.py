@@ -12,7 +12,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import hashlib
 import os
+import time
 
 import jinja2
 import six
@@ -20,6 +23,8 @@ import six
 from neutron.common import utils as n_utils
 from neutron.plugins.common import constants as plugin_constants
 from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
 
 from neutron_lbaas._i18n import _
 from neutron_lbaas.common import cert_manager
@@ -27,6 +32,8 @@ from neutron_lbaas.common.tls_utils import cert_parser
 from neutron_lbaas.services.loadbalancer import constants
 from neutron_lbaas.services.loadbalancer import data_models
 
+LOG = logging.getLogger(__name__)
+
 CERT_MANAGER_PLUGIN = cert_manager.get_backend()
 
 PROTOCOL_MAP = {
@@ -60,15 +67,47 @@ MEMBER_STATUSES = plugin_constants.ACTIVE_PENDING_STATUSES + (
 
 TEMPLATES_DIR = os.path.abspath(
     os.path.join(os.path.dirname(__file__), 'templates/'))
+PROXIES_TEMPLATE = 'haproxy_proxies.j2'
+SHARED_TEMPLATE = 'haproxy.shared.j2'
 JINJA_ENV = None
 
+# Maximum number of rendered frontend and backend sections kept in memory
+FRAGMENT_CACHE_SIZE = 4096
+# hash of the transformed object -> rendered section
+_fragments = collections.OrderedDict()
+# Maximum number of certificates, parsed certificates and stored PEM files
+# tracked by the certificate cache
+CERT_CACHE_SIZE = 1024
+# Maximum number of compiled expected_codes kept in memory
+EXPECTED_CODES_CACHE_SIZE = 1024
+# expected_codes string -> (http-check expect keyword, pattern)
+_expected_codes = {}
+
 jinja_opts = [
     cfg.StrOpt(
         'jinja_config_template',
         default=os.path.join(
             TEMPLATES_DIR,
             'haproxy.loadbalancer.j2'),
-        help=_('Jinja template file for haproxy configuration'))
+        help=_('Jinja template file for haproxy configuration')),
+    cfg.BoolOpt(
+        'runtime_member_updates',
+        default=False,
+        help=_('Apply member changes through the haproxy stats socket '
+               'instead of reloading haproxy. This gives the admin level '
+               'to the stats socket.')),
+    cfg.IntOpt(
+        'member_slots',
+        default=0,
+        help=_('Number of server slots reserved in each backend for the '
+               'members added without reloading haproxy. Requires '
+               'runtime_member_updates and haproxy 1.8 or later.')),
+    cfg.IntOpt(
+        'cert_cache_ttl',
+        default=300,
+        help=_('Seconds the TLS certificates retrieved from the certificate '
+               'manager are reused to render the configurations. 0 '
+               'retrieves them on every render.'))
 ]
 
 cfg.CONF.register_opts(jinja_opts, 'haproxy')
@@ -83,32 +122,211 @@ def save_config(conf_path, loadbalancer, socket_path, user_group,
     :param socket_path: location of haproxy socket data
     :param user_group: user group
     :param haproxy_base_dir: location of the instances state data
+    :returns: True if the configuration or a certificate changed, False
+              otherwise
     """
+    writes = _cert_cache.writes
     config_str = render_loadbalancer_obj(loadbalancer,
                                          user_group,
                                          socket_path,
                                          haproxy_base_dir)
+    pems_changed = _cert_cache.writes != writes
+    return _replace_config(conf_path, config_str) or pems_changed
+
+
+def save_shared_config(conf_path, name, loadbalancers, socket_path,
+                       user_group):
+    """Convert the logical configurations of load balancers to one HAProxy.
+
+    :param conf_path: location of Haproxy configuration
+    :param name: name of the configuration
+    :param loadbalancers: (load balancer, location of its state data) pairs
+    :param socket_path: location of haproxy socket data
+    :param user_group: user group
+    :returns: True if the configuration or a certificate changed, False
+              otherwise
+    """
+    writes = _cert_cache.writes
+    config_str = render_loadbalancers_obj(name, loadbalancers, user_group,
+                                          socket_path)
+    pems_changed = _cert_cache.writes != writes
+    return _replace_config(conf_path, config_str) or pems_changed
+
+
+def _replace_config(conf_path, config_str):
+    if os.path.exists(conf_path):
+        with open(conf_path) as conf_file:
+            if conf_file.read() == config_str:
+                return False
     n_utils.replace_file(conf_path, config_str)
+    return True
 
 
-def _get_template():
-    """Retrieve Jinja template
+def _get_jinja_env():
+    """Retrieve Jinja environment
 
-    :returns: Jinja template
+    :returns: Jinja environment
     """
     global JINJA_ENV
     if not JINJA_ENV:
-        template_loader = jinja2.FileSystemLoader(
-            searchpath=os.path.dirname(cfg.CONF.haproxy.jinja_config_template))
+        # The default templates stay reachable so that the proxies macros
+        # can be used along with a custom configuration template.
+        template_loader = jinja2.ChoiceLoader([
+            jinja2.FileSystemLoader(searchpath=os.path.dirname(
+                cfg.CONF.haproxy.jinja_config_template)),
+            jinja2.FileSystemLoader(searchpath=TEMPLATES_DIR)])
         JINJA_ENV = jinja2.Environment(
             loader=template_loader, trim_blocks=True, lstrip_blocks=True)
-    return JINJA_ENV.get_template(os.path.basename(
+    return JINJA_ENV
+
+
+def _get_template():
+    """Retrieve Jinja template
+
+    :returns: Jinja template
+    """
+    return _get_jinja_env().get_template(os.path.basename(
         cfg.CONF.haproxy.jinja_config_template))
 
 
+def _render_fragment(macro_name, *args):
+    """Render a section of the configuration with a proxies macro
+
+    Sections are cached by a hash of the macro arguments, so that only the
+    frontends and backends which changed are rendered again.
+
+    :param macro_name: name of the macro in the proxies template
+    :param args: transformed objects passed to the macro
+    :returns: rendered section
+    """
+    key = hashlib.sha1(jsonutils.dumps(
+        [macro_name, args], sort_keys=True).encode('utf-8')).hexdigest()
+    fragment = _fragments.get(key)
+    if fragment is None:
+        macro = getattr(
+            _get_jinja_env().get_template(PROXIES_TEMPLATE).module,
+            macro_name)
+        fragment = six.text_type(macro(constants, *args))
+        if len(_fragments) >= FRAGMENT_CACHE_SIZE:
+            _fragments.popitem(last=False)
+        _fragments[key] = fragment
+    return fragment
+
+
+class CertCache(object):
+    """TLS certificates reused across renders of the configurations.
+
+    Certificates are kept cert_cache_ttl seconds per container ref. The
+    primary CN and private key parsed from a certificate are memoized for
+    as long by a digest of its material, and the stored PEM files by a
+    digest of their content, so a certificate which did not change is
+    neither parsed nor written again. The decrypted private keys are not
+    kept in memory past cert_cache_ttl.
+    """
+
+    def __init__(self, size=CERT_CACHE_SIZE):
+        self.size = size
+        # (project id, container ref) -> (expiration, TLSContainer)
+        self._containers = collections.OrderedDict()
+        # digest of the material -> (expiration, (primary cn, private key))
+        self._parsed = collections.OrderedDict()
+        # path of a PEM file -> digest of its content
+        self._pems = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # PEM files written, a rotated certificate keeps its path so the
+        # configuration does not change when it does
+        self.writes = 0
+
+    def _put(self, entries, key, value):
+        entries.pop(key, None)
+        if len(entries) >= self.size:
+            entries.popitem(last=False)
+        entries[key] = value
+
+    @staticmethod
+    def _expire(entries):
+        # entries are (expiration, value) pairs set with the same ttl and
+        # moved to the end when set, so the oldest expirations come first
+        now = time.time()
+        while entries and next(iter(entries.values()))[0] <= now:
+            entries.popitem(last=False)
+
+    def get(self, cert_mgr, project_id, cert_ref, resource_ref):
+        """Returns the TLSContainer of a container ref."""
+        key = (project_id, cert_ref)
+        self._expire(self._containers)
+        entry = self._containers.get(key)
+        if entry:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        container = _map_cert_tls_container(cert_mgr.get_cert(
+            project_id=project_id, cert_ref=cert_ref,
+            resource_ref=resource_ref, check_only=True))
+        ttl = cfg.CONF.haproxy.cert_cache_ttl
+        if ttl > 0:
+            self._put(self._containers, key, (time.time() + ttl, container))
+        return container
+
+    def parse(self, certificate, private_key, passphrase):
+        """Returns the primary CN and the unencrypted private key."""
+        key = _digest(certificate, private_key, passphrase)
+        self._expire(self._parsed)
+        entry = self._parsed.get(key)
+        if entry:
+            return entry[1]
+        parsed = (_get_primary_cn(certificate),
+                  cert_parser.dump_private_key(private_key, passphrase))
+        ttl = cfg.CONF.haproxy.cert_cache_ttl
+        if ttl > 0:
+            self._put(self._parsed, key, (time.time() + ttl, parsed))
+        return parsed
+
+    def store_pem(self, path, pem):
+        """Writes a PEM file unless it already holds pem.
+
+        :returns: True if the file was written, False otherwise
+        """
+        digest = _digest(pem)
+        if os.path.exists(path):
+            current = self._pems.get(path)
+            if current is None:
+                with open(path) as pem_file:
+                    current = _digest(pem_file.read())
+            if current == digest:
+                return False
+        n_utils.replace_file(path, pem)
+        self._put(self._pems, path, digest)
+        self.writes += 1
+        return True
+
+
+def _digest(*values):
+    """Digest of strings, for the keys of the caches
+
+    :param values: strings or bytes, None is allowed
+    :returns: hexadecimal digest
+    """
+    digest = hashlib.sha1()
+    for value in values:
+        if value is None:
+            value = b''
+        elif not isinstance(value, six.binary_type):
+            value = six.text_type(value).encode('utf-8')
+        digest.update(value)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+_cert_cache = CertCache()
+
+
 def _store_listener_crt(haproxy_base_dir, listener, cert):
     """Store TLS certificate
 
+    The file is only written if its content changed.
+
     :param haproxy_base_dir: location of the instances state data
     :param listener: the listener object
     :param cert: the TLS certificate
@@ -118,7 +336,7 @@ def _store_listener_crt(haproxy_base_dir, listener, cert):
                                    cert.primary_cn)
     # build a string that represents the pem file to be saved
     pem = _build_pem(cert)
-    n_utils.replace_file(cert_path, pem)
+    _cert_cache.store_pem(cert_path, pem)
     return cert_path
 
 
@@ -142,40 +360,36 @@ def _retrieve_crt_path(haproxy_base_dir, listener, primary_cn):
 def _process_tls_certificates(listener):
     """Processes TLS data from the listener.
 
-    Converts and uploads PEM data to the Amphora API
+    Certificates are retrieved through the certificate cache.
 
     :param listener: the listener object
     :returns: TLS_CERT and SNI_CERTS
     """
     cert_mgr = CERT_MANAGER_PLUGIN.CertManager()
+    hits, misses = _cert_cache.hits, _cert_cache.misses
 
     tls_cert = None
     sni_certs = []
-    # Retrieve, map and store default TLS certificate
+    # Retrieve and map default TLS certificate
     if listener.default_tls_container_id:
-        tls_cert = _map_cert_tls_container(
-            cert_mgr.get_cert(
-                project_id=listener.tenant_id,
-                cert_ref=listener.default_tls_container_id,
-                resource_ref=cert_mgr.get_service_url(
-                    listener.loadbalancer_id),
-                check_only=True
-            )
-        )
+        tls_cert = _cert_cache.get(
+            cert_mgr, listener.tenant_id, listener.default_tls_container_id,
+            cert_mgr.get_service_url(listener.loadbalancer_id))
     if listener.sni_containers:
-        # Retrieve, map and store SNI certificates
+        # Retrieve and map SNI certificates
         for sni_cont in listener.sni_containers:
-            cert_container = _map_cert_tls_container(
-                cert_mgr.get_cert(
-                    project_id=listener.tenant_id,
-                    cert_ref=sni_cont.tls_container_id,
-                    resource_ref=cert_mgr.get_service_url(
-                        listener.loadbalancer_id),
-                    check_only=True
-                )
-            )
-            sni_certs.append(cert_container)
-
+            sni_certs.append(_cert_cache.get(
+                cert_mgr, listener.tenant_id, sni_cont.tls_container_id,
+                cert_mgr.get_service_url(listener.loadbalancer_id)))
+
+    if tls_cert or sni_certs:
+        LOG.debug('Certificates of listener %(id)s: %(hits)d cached, '
+                  '%(misses)d retrieved (%(total_hits)d hits, '
+                  '%(total_misses)d misses overall)',
+                  {'id': listener.id, 'hits': _cert_cache.hits - hits,
+                   'misses': _cert_cache.misses - misses,
+                   'total_hits': _cert_cache.hits,
+                   'total_misses': _cert_cache.misses})
     return {'tls_cert': tls_cert, 'sni_certs': sni_certs}
 
 
@@ -195,10 +409,11 @@ def _map_cert_tls_container(cert):
     :returns: mapped TLSContainer object
     """
     certificate = cert.get_certificate()
-    pkey = cert_parser.dump_private_key(cert.get_private_key(),
-                                        cert.get_private_key_passphrase())
+    primary_cn, pkey = _cert_cache.parse(certificate,
+                                         cert.get_private_key(),
+                                         cert.get_private_key_passphrase())
     return data_models.TLSContainer(
-        primary_cn=_get_primary_cn(certificate),
+        primary_cn=primary_cn,
         private_key=pkey,
         certificate=certificate,
         intermediates=cert.get_intermediates())
@@ -231,13 +446,64 @@ def render_loadbalancer_obj(loadbalancer, user_group, socket_path,
     :param haproxy_base_dir:  location of the instances state data
     :returns: rendered load balancer configuration
     """
-    loadbalancer = _transform_loadbalancer(loadbalancer, haproxy_base_dir)
+    loadbalancer, frontends, backends = _render_proxies(loadbalancer,
+                                                        haproxy_base_dir)
+    stats_level = ('admin' if cfg.CONF.haproxy.runtime_member_updates
+                   else 'user')
     return _get_template().render({'loadbalancer': loadbalancer,
+                                   'frontends': frontends,
+                                   'backends': backends,
                                    'user_group': user_group,
-                                   'stats_sock': socket_path},
+                                   'stats_sock': socket_path,
+                                   'stats_level': stats_level},
                                   constants=constants)
 
 
+def render_loadbalancers_obj(name, loadbalancers, user_group, socket_path):
+    """Renders the load balancers served by a single haproxy
+
+    The frontends and backends are named after the listeners and the pools,
+    so the statistics of each load balancer are kept apart.
+
+    :param name: name of the configuration
+    :param loadbalancers: (load balancer, location of its state data) pairs
+    :param user_group: the user group
+    :param socket_path: location of the instances socket data
+    :returns: rendered configuration
+    """
+    rendered = []
+    connection_limit = 0
+    for loadbalancer, haproxy_base_dir in loadbalancers:
+        transformed, frontends, backends = _render_proxies(loadbalancer,
+                                                           haproxy_base_dir)
+        connection_limit += transformed['connection_limit']
+        rendered.append({'id': loadbalancer.id,
+                         'frontends': frontends,
+                         'backends': backends})
+    return _get_jinja_env().get_template(SHARED_TEMPLATE).render(
+        {'name': name,
+         'loadbalancers': rendered,
+         'connection_limit': connection_limit,
+         'user_group': user_group,
+         'stats_sock': socket_path},
+        constants=constants)
+
+
+def _render_proxies(loadbalancer, haproxy_base_dir):
+    """Renders the frontends and the backends of a load balancer
+
+    :returns: the transformed load balancer, its rendered frontends and its
+              rendered backends
+    """
+    loadbalancer = _transform_loadbalancer(loadbalancer, haproxy_base_dir)
+    frontends = [_render_fragment('frontend_macro', listener,
+                                  loadbalancer['vip_address'])
+                 for listener in loadbalancer['listeners']]
+    backends = [_render_fragment('backend_macro', pool)
+                for pool in loadbalancer['pools']]
+    return loadbalancer, frontends, backends
+
+
 def _transform_loadbalancer(loadbalancer, haproxy_base_dir):
     """Transforms load balancer object
 
@@ -323,9 +589,28 @@ def _transform_pool(pool):
     if pool.session_persistence:
         ret_value['session_persistence'] = _transform_session_persistence(
             pool.session_persistence)
+    member_slots = _get_member_slots(pool)
+    if member_slots:
+        ret_value['member_slots'] = member_slots
     return ret_value
 
 
+def _get_member_slots(pool):
+    """Number of server slots to reserve in the backend of a pool
+
+    Servers of the slots cannot get their own persistence cookie, so
+    pools with cookie persistence get no slots.
+
+    :param pool: the pool object
+    :returns: number of slots
+    """
+    if (not cfg.CONF.haproxy.runtime_member_updates or
+            (pool.session_persistence and pool.session_persistence.type ==
+             constants.SESSION_PERSISTENCE_HTTP_COOKIE)):
+        return 0
+    return cfg.CONF.haproxy.member_slots
+
+
 def _transform_session_persistence(persistence):
     """Transforms session persistence object
 
@@ -361,6 +646,7 @@ def _transform_health_monitor(monitor):
     :param monitor: the health monitor object
     :returns: dictionary of transformed health monitor values
     """
+    expect, pattern = _compile_expected_codes(monitor.expected_codes)
     return {
         'id': monitor.id,
         'type': monitor.type,
@@ -369,8 +655,8 @@ def _transform_health_monitor(monitor):
         'max_retries': monitor.max_retries,
         'http_method': monitor.http_method,
         'url_path': monitor.url_path,
-        'expected_codes': '|'.join(
-            _expand_expected_codes(monitor.expected_codes)),
+        'expect': expect,
+        'expected_codes': pattern,
         'admin_state_up': monitor.admin_state_up,
     }
 
@@ -385,23 +671,101 @@ def _include_member(member):
             MEMBER_STATUSES and member.admin_state_up)
 
 
-def _expand_expected_codes(codes):
-    """Expand the expected code string in set of codes
+def _merge_expected_codes(codes):
+    """Merge the codes and ranges of an expected code string
 
     :param codes: string of status codes
-    :returns: list of status codes
+    :returns: sorted list of disjoint (low, high) ranges of codes
     """
-
-    retval = set()
-    for code in codes.replace(',', ' ').split(' '):
+    ranges = []
+    for code in (codes or '').replace(',', ' ').split(' '):
         code = code.strip()
-
         if not code:
             continue
         elif '-' in code:
             low, hi = code.split('-')[:2]
-            retval.update(
-                str(i) for i in six.moves.range(int(low), int(hi) + 1))
+            low, hi = int(low), int(hi)
         else:
-            retval.add(code)
-    return retval
+            low = hi = int(code)
+        if low <= hi:
+            ranges.append((low, hi))
+    merged = []
+    for low, hi in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(hi, merged[-1][1]))
+        else:
+            merged.append((low, hi))
+    return merged
+
+
+def _digit_class(low, hi):
+    """Regular expression matching one digit from low to hi"""
+    if low == hi:
+        return str(low)
+    if hi == low + 1:
+        return '[%d%d]' % (low, hi)
+    return '[%d-%d]' % (low, hi)
+
+
+def _range_patterns(low, hi):
+    """Regular expressions matching the numbers from low to hi
+
+    :param low: lowest number, as a string of digits
+    :param hi: highest number, as a string of the same number of digits
+    :returns: list of patterns, one of which matches each number
+    """
+    if len(low) == 1:
+        return [_digit_class(int(low), int(hi))]
+    if low[0] == hi[0]:
+        return [low[0] + p for p in _range_patterns(low[1:], hi[1:])]
+    width = len(low) - 1
+    first, last = int(low[0]), int(hi[0])
+    patterns = []
+    if low[1:] != '0' * width:
+        patterns.extend(low[0] + p
+                        for p in _range_patterns(low[1:], '9' * width))
+        first += 1
+    tail = []
+    if hi[1:] != '9' * width:
+        tail = [hi[0] + p for p in _range_patterns('0' * width, hi[1:])]
+        last -= 1
+    if first <= last:
+        patterns.append(_digit_class(first, last) + '[0-9]' * width)
+    return patterns + tail
+
+
+def _compile_expected_codes(codes):
+    """Compile an expected code string into an http-check expectation
+
+    The codes and ranges are merged, a single code is matched with
+    'expect status' and anything else with the shortest 'expect rstatus'
+    regular expression built from the ranges. Results are cached by code
+    string.
+
+    :param codes: string of status codes
+    :returns: tuple of the http-check expect keyword and its pattern, the
+              pattern is empty if no code is expected
+    """
+    compiled = _expected_codes.get(codes)
+    if compiled is not None:
+        return compiled
+    ranges = _merge_expected_codes(codes)
+    patterns = []
+    for low, hi in ranges:
+        # the patterns only match numbers with as many digits
+        while low <= hi:
+            width_hi = min(hi, 10 ** len(str(low)) - 1)
+            patterns.extend(_range_patterns(str(low), str(width_hi)))
+            low = width_hi + 1
+    if len(ranges) == 1 and ranges[0][0] == ranges[0][1]:
+        compiled = ('status', patterns[0])
+    elif len(patterns) == 1:
+        compiled = ('rstatus', '^%s$' % patterns[0])
+    elif patterns:
+        compiled = ('rstatus', '^(%s)$' % '|'.join(patterns))
+    else:
+        compiled = ('rstatus', '')
+    if len(_expected_codes) >= EXPECTED_CODES_CACHE_SIZE:
+        _expected_codes.clear()
+    _expected_codes[codes] = compiled
+    return compiled
@@ -13,36 +13,51 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
+import itertools
 import os
 import shutil
 import socket
+import tempfile
+import time
 
+import eventlet
 import netaddr
 from neutron.agent.linux import external_process
 from neutron.agent.linux import ip_lib
 from neutron.common import utils as n_utils
 from neutron.plugins.common import constants
 from neutron_lib import exceptions
+from oslo_concurrency import lockutils
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import excutils
+from oslo_utils import uuidutils
 
-from neutron_lbaas._i18n import _, _LI, _LW
+from neutron_lbaas._i18n import _, _LE, _LI, _LW
 from neutron_lbaas.agent import agent_device_driver
 from neutron_lbaas.drivers.haproxy import jinja_cfg
+from neutron_lbaas.drivers.haproxy import runtime_api
+from neutron_lbaas.drivers.haproxy import stats_parser
 from neutron_lbaas.services.loadbalancer import constants as lb_const
 from neutron_lbaas.services.loadbalancer import data_models
 
 LOG = logging.getLogger(__name__)
 NS_PREFIX = 'qlbaas-'
+POOL_NS_PREFIX = NS_PREFIX + 'pool-'
+SHARED_NS_PREFIX = NS_PREFIX + 'subnet-'
 STATS_TYPE_BACKEND_REQUEST = 2
-STATS_TYPE_BACKEND_RESPONSE = '1'
 STATS_TYPE_SERVER_REQUEST = 4
-STATS_TYPE_SERVER_RESPONSE = '2'
+STATS_READ_CHUNK_SIZE = 65536
+# Seconds the statistics of a shared haproxy are reused for its loadbalancers
+SHARED_STATS_MAX_AGE = 5
+# First routing table of the VIP devices in shared namespaces
+SHARED_ROUTE_TABLE_BASE = 1000
 DRIVER_NAME = 'haproxy_ns'
 HAPROXY_SERVICE_NAME = 'lbaas-ns-haproxy'
 
 STATE_PATH_V2_APPEND = 'v2'
+STATE_PATH_SHARED_APPEND = 'v2-shared'
 
 STATE_PATH_DEFAULT = '$state_path/lbaas'
 USER_GROUP_DEFAULT = 'nogroup'
@@ -66,7 +81,25 @@ OPTS = [
         help=_('When delete and re-add the same vip, send this many '
                'gratuitous ARPs to flush the ARP cache in the Router. '
                'Set it below or equal to 0 to disable this feature.'),
-    )
+    ),
+    cfg.IntOpt(
+        'namespace_pool_size',
+        default=0,
+        help=_('Number of namespaces with their loopback up kept ready for '
+               'the loadbalancers to be created. The namespaces of the '
+               'deleted loadbalancers are scrubbed and returned to the '
+               'pool. Set it to 0 to create one namespace per '
+               'loadbalancer.'),
+    ),
+    cfg.BoolOpt(
+        'shared_process',
+        default=False,
+        help=_('Serve the loadbalancers created on a same subnet with a '
+               'single haproxy process, running in a namespace shared by '
+               'their VIP ports. The members of these loadbalancers are '
+               'always updated by reloading haproxy, which requires '
+               'haproxy 1.8 or later to hand its listening sockets over.'),
+    ),
 ]
 cfg.CONF.register_opts(OPTS, 'haproxy')
 
@@ -75,6 +108,27 @@ def get_ns_name(namespace_id):
     return NS_PREFIX + namespace_id
 
 
+def get_shared_subnet_id(namespace):
+    """Returns the subnet of a shared namespace, None for other ones."""
+    if namespace.startswith(SHARED_NS_PREFIX):
+        return namespace[len(SHARED_NS_PREFIX):]
+
+
+def synchronized_loadbalancer(f):
+    """Serializes the calls of f on a same loadbalancer.
+
+    Each loadbalancer has its own lock, so different loadbalancers can be
+    deployed concurrently. f takes a loadbalancer or its id as first
+    argument.
+    """
+    @functools.wraps(f)
+    def wrapper(self, loadbalancer, *args, **kwargs):
+        loadbalancer_id = getattr(loadbalancer, 'id', loadbalancer)
+        with lockutils.lock('haproxy-driver-%s' % loadbalancer_id):
+            return f(self, loadbalancer, *args, **kwargs)
+    return wrapper
+
+
 class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
 
     def __init__(self, conf, plugin_rpc, process_monitor):
@@ -83,6 +137,9 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
         self.state_path = conf.haproxy.loadbalancer_state_path
         self.state_path = os.path.join(
             self.conf.haproxy.loadbalancer_state_path, STATE_PATH_V2_APPEND)
+        self.shared_state_path = os.path.join(
+            self.conf.haproxy.loadbalancer_state_path,
+            STATE_PATH_SHARED_APPEND)
         try:
             vif_driver_class = n_utils.load_class_by_alias_or_classname(
                 'neutron.interface_drivers',
@@ -95,6 +152,26 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
 
         self.vif_driver = vif_driver_class(conf)
         self.deployed_loadbalancers = {}
+        # loadbalancer_id -> runtime_api.RuntimeState of the running haproxy
+        self._runtime_states = {}
+        # number of changes applied through the stats socket
+        self.reloads_avoided = 0
+        # plug phase -> [count, total seconds, max seconds]
+        self.plug_timings = {}
+        # 'pooled', 'unpooled' or 'shared' -> [count, total seconds, max
+        # seconds] of the creations, until haproxy is started
+        self.create_timings = {}
+        # loadbalancer_id -> namespace taken from the pool or shared
+        self._namespaces = {}
+        # loadbalancer_id -> routing table of its VIP in a shared namespace
+        self._route_tables = {}
+        self._load_namespaces()
+        # idle namespaces of the pool
+        self._namespace_pool = []
+        # socket path of a shared haproxy -> (time, lines of its statistics)
+        self._shared_stats = {}
+        if conf.haproxy.namespace_pool_size > 0:
+            eventlet.spawn_n(self._init_namespace_pool)
         self._loadbalancer = LoadBalancerManager(self)
         self._listener = ListenerManager(self)
         self._pool = PoolManager(self)
@@ -124,30 +201,42 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
     def get_name(self):
         return DRIVER_NAME
 
-    @n_utils.synchronized('haproxy-driver')
+    @synchronized_loadbalancer
     def undeploy_instance(self, loadbalancer_id, **kwargs):
         cleanup_namespace = kwargs.get('cleanup_namespace', False)
         delete_namespace = kwargs.get('delete_namespace', False)
-        namespace = get_ns_name(loadbalancer_id)
-        pid_data = self._get_state_file_path(loadbalancer_id, 'haproxy.pid')
-        pid_path = os.path.split(pid_data)[0]
-        self.process_monitor.unregister(uuid=loadbalancer_id,
-                                        service_name=HAPROXY_SERVICE_NAME)
-        pm = external_process.ProcessManager(uuid=loadbalancer_id,
-                                             namespace=namespace,
-                                             service=HAPROXY_SERVICE_NAME,
-                                             conf=self.conf,
-                                             pids_path=pid_path,
-                                             pid_file=pid_data)
-        pm.disable()
+        namespace = self._get_namespace(loadbalancer_id)
+        subnet_id = get_shared_subnet_id(namespace)
+        if not subnet_id:
+            pid_data = self._get_state_file_path(loadbalancer_id,
+                                                 'haproxy.pid')
+            pid_path = os.path.split(pid_data)[0]
+            self.process_monitor.unregister(uuid=loadbalancer_id,
+                                            service_name=HAPROXY_SERVICE_NAME)
+            self._runtime_states.pop(loadbalancer_id, None)
+            pm = external_process.ProcessManager(uuid=loadbalancer_id,
+                                                 namespace=namespace,
+                                                 service=HAPROXY_SERVICE_NAME,
+                                                 conf=self.conf,
+                                                 pids_path=pid_path,
+                                                 pid_file=pid_data)
+            pm.disable()
         # unplug the ports
+        route_table = self._route_tables.pop(loadbalancer_id, None)
         if loadbalancer_id in self.deployed_loadbalancers:
-            self._unplug(namespace,
-                         self.deployed_loadbalancers[loadbalancer_id].vip_port)
+            loadbalancer = self.deployed_loadbalancers[loadbalancer_id]
+            if route_table is not None:
+                self._execute_ip_batch(
+                    namespace, loadbalancer.vip_address,
+                    ['rule del from %s table %d' % (
+                        netaddr.IPAddress(loadbalancer.vip_address),
+                        route_table)])
+            self._unplug(namespace, loadbalancer.vip_port)
 
         # delete all devices from namespace
         # used when deleting orphans and port is not known for a loadbalancer
-        if cleanup_namespace:
+        # the devices of a shared namespace belong to other loadbalancers
+        if cleanup_namespace and not subnet_id:
             ns = ip_lib.IPWrapper(namespace=namespace)
             for device in ns.get_devices(exclude_loopback=True):
                 self.vif_driver.unplug(device.name, namespace=namespace)
@@ -157,10 +246,17 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
             self._get_state_file_path(loadbalancer_id, ''))
         if os.path.isdir(conf_dir):
             shutil.rmtree(conf_dir)
+        self._namespaces.pop(loadbalancer_id, None)
+        self.deployed_loadbalancers.pop(loadbalancer_id, None)
+
+        # the namespace of a shared haproxy is kept until its last
+        # loadbalancer is removed
+        if subnet_id and self._spawn_shared(subnet_id):
+            self._restore_shared_routes(namespace)
+            return
 
         if delete_namespace:
-            ns = ip_lib.IPWrapper(namespace=namespace)
-            ns.garbage_collect_namespace()
+            self._release_namespace(namespace)
 
     def remove_orphans(self, known_loadbalancer_ids):
         if not os.path.exists(self.state_path):
@@ -170,18 +266,28 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
                    if lb_id not in known_loadbalancer_ids)
         for lb_id in orphans:
             if self.exists(lb_id):
-                self.undeploy_instance(lb_id, cleanup_namespace=True)
+                # a namespace taken from the pool goes back to it
+                pooled = self._get_namespace(lb_id).startswith(POOL_NS_PREFIX)
+                self.undeploy_instance(lb_id, cleanup_namespace=True,
+                                       delete_namespace=pooled)
 
     def get_stats(self, loadbalancer_id):
-        socket_path = self._get_state_file_path(loadbalancer_id,
-                                                'haproxy_stats.sock', False)
+        socket_path = self._get_socket_path(loadbalancer_id)
         if os.path.exists(socket_path):
-            parsed_stats = self._get_stats_from_socket(
-                socket_path,
-                entity_type=(STATS_TYPE_BACKEND_REQUEST |
-                             STATS_TYPE_SERVER_REQUEST))
-            lb_stats = self._get_backend_stats(parsed_stats)
-            lb_stats['members'] = self._get_servers_stats(parsed_stats)
+            entity_type = (STATS_TYPE_BACKEND_REQUEST |
+                           STATS_TYPE_SERVER_REQUEST)
+            if get_shared_subnet_id(self._get_namespace(loadbalancer_id)):
+                lb_stats, servers_stats = self._get_shared_stats(
+                    socket_path, entity_type, loadbalancer_id)
+            else:
+                lb_stats, servers_stats = self._get_stats_from_socket(
+                    socket_path, entity_type=entity_type)
+            runtime_state = self._runtime_states.get(loadbalancer_id)
+            if runtime_state:
+                servers_stats = dict(
+                    (runtime_state.get_member_name(name), stats)
+                    for name, stats in servers_stats.items())
+            lb_stats['members'] = servers_stats
             return lb_stats
         else:
             lb_config = self.plugin_rpc.get_loadbalancer(loadbalancer_id)
@@ -196,7 +302,7 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
                           loadbalancer_id)
             return {}
 
-    @n_utils.synchronized('haproxy-driver')
+    @synchronized_loadbalancer
     def deploy_instance(self, loadbalancer):
         """Deploys loadbalancer if necessary
 
@@ -214,17 +320,55 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
         return True
 
     def update(self, loadbalancer):
+        subnet_id = get_shared_subnet_id(
+            self._get_namespace(loadbalancer.id))
+        if subnet_id:
+            self._spawn(loadbalancer)
+            return
+        if self._update_at_runtime(loadbalancer):
+            return
         pid_path = self._get_state_file_path(loadbalancer.id, 'haproxy.pid')
         extra_args = ['-sf']
         extra_args.extend(p.strip() for p in open(pid_path, 'r'))
         self._spawn(loadbalancer, extra_args)
 
+    def _update_at_runtime(self, loadbalancer):
+        """Applies the changes of members through the stats socket.
+
+        :returns: True if haproxy does not need to be reloaded
+        """
+        runtime_state = self._runtime_states.get(loadbalancer.id)
+        if not runtime_state:
+            return False
+        conf_path = self._get_state_file_path(loadbalancer.id,
+                                              'haproxy.conf')
+        sock_path = self._get_state_file_path(loadbalancer.id,
+                                              'haproxy_stats.sock')
+        config_str = jinja_cfg.render_loadbalancer_obj(
+            loadbalancer, self.conf.haproxy.user_group, sock_path,
+            self._get_state_file_path(loadbalancer.id, ''))
+        commands, new_state = runtime_state.get_commands(config_str)
+        if commands is None:
+            return False
+        if commands:
+            if not runtime_api.send_commands(sock_path, commands):
+                return False
+            self.reloads_avoided += 1
+            LOG.debug('Applied %(count)d changes to loadbalancer %(lb)s '
+                      'without reloading haproxy, %(avoided)d reloads '
+                      'avoided so far',
+                      {'count': len(commands), 'lb': loadbalancer.id,
+                       'avoided': self.reloads_avoided})
+        n_utils.replace_file(conf_path, config_str)
+        self._runtime_states[loadbalancer.id] = new_state
+        self.deployed_loadbalancers[loadbalancer.id] = loadbalancer
+        return True
+
     def exists(self, loadbalancer_id):
-        namespace = get_ns_name(loadbalancer_id)
+        namespace = self._get_namespace(loadbalancer_id)
         root_ns = ip_lib.IPWrapper()
 
-        socket_path = self._get_state_file_path(
-            loadbalancer_id, 'haproxy_stats.sock', False)
+        socket_path = self._get_socket_path(loadbalancer_id)
         if root_ns.netns.exists(namespace) and os.path.exists(socket_path):
             try:
                 s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
@@ -235,10 +379,137 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
         return False
 
     def create(self, loadbalancer):
-        namespace = get_ns_name(loadbalancer.id)
-
-        self._plug(namespace, loadbalancer.vip_port, loadbalancer.vip_address)
+        start = time.time()
+        route_table = None
+        if self.conf.haproxy.shared_process:
+            namespace = SHARED_NS_PREFIX + loadbalancer.vip_subnet_id
+            route_table = self._allocate_route_table(loadbalancer.id)
+            kind = 'shared'
+        else:
+            namespace = self._acquire_namespace(loadbalancer.id)
+            kind = ('unpooled' if namespace == get_ns_name(loadbalancer.id)
+                    else 'pooled')
+
+        self._plug(namespace, loadbalancer.vip_port, loadbalancer.vip_address,
+                   route_table=route_table)
+        if kind == 'shared':
+            # the shared haproxy binds the VIP once it is plugged
+            self._join_shared_namespace(loadbalancer.id, namespace)
         self._spawn(loadbalancer)
+        duration = self._record_timing(self.create_timings, kind, start)
+        LOG.debug('Created loadbalancer %(lb)s in %(duration).3fs, '
+                  'namespace: %(kind)s',
+                  {'lb': loadbalancer.id, 'duration': duration,
+                   'kind': kind})
+
+    def _get_namespace(self, loadbalancer_id):
+        """Returns the namespace of a loadbalancer."""
+        return (self._namespaces.get(loadbalancer_id) or
+                get_ns_name(loadbalancer_id))
+
+    def _load_namespaces(self):
+        """Reads the namespaces taken from the pool or shared.
+
+        Their names, and the routing tables of the VIPs in shared
+        namespaces, are kept in the state directories of the loadbalancers,
+        so that they are found again after a restart of the agent.
+        """
+        if not os.path.isdir(self.state_path):
+            return
+        for loadbalancer_id in os.listdir(self.state_path):
+            ns_path = os.path.join(self.state_path, loadbalancer_id,
+                                   'namespace')
+            if os.path.exists(ns_path):
+                with open(ns_path) as ns_file:
+                    self._namespaces[loadbalancer_id] = (
+                        ns_file.read().strip())
+            table_path = os.path.join(self.state_path, loadbalancer_id,
+                                      'route_table')
+            if os.path.exists(table_path):
+                with open(table_path) as table_file:
+                    self._route_tables[loadbalancer_id] = int(
+                        table_file.read())
+
+    def _allocate_route_table(self, loadbalancer_id):
+        """Returns the routing table of the VIP of a shared loadbalancer."""
+        with lockutils.lock('haproxy-route-tables'):
+            route_table = self._route_tables.get(loadbalancer_id)
+            if route_table is None:
+                used = set(self._route_tables.values())
+                route_table = next(
+                    table for table in itertools.count(SHARED_ROUTE_TABLE_BASE)
+                    if table not in used)
+                n_utils.replace_file(
+                    self._get_state_file_path(loadbalancer_id, 'route_table'),
+                    str(route_table))
+                self._route_tables[loadbalancer_id] = route_table
+            return route_table
+
+    def _acquire_namespace(self, loadbalancer_id):
+        """Takes a namespace from the pool for a new loadbalancer."""
+        try:
+            namespace = self._namespace_pool.pop()
+        except IndexError:
+            return get_ns_name(loadbalancer_id)
+        n_utils.replace_file(
+            self._get_state_file_path(loadbalancer_id, 'namespace'),
+            namespace)
+        self._namespaces[loadbalancer_id] = namespace
+        eventlet.spawn_n(self._fill_namespace_pool)
+        return namespace
+
+    def _join_shared_namespace(self, loadbalancer_id, namespace):
+        """Adds a loadbalancer to the ones served by a shared haproxy."""
+        n_utils.replace_file(
+            self._get_state_file_path(loadbalancer_id, 'namespace'),
+            namespace)
+        self._namespaces[loadbalancer_id] = namespace
+
+    def _release_namespace(self, namespace):
+        """Returns a namespace to the pool, or deletes it."""
+        with lockutils.lock('haproxy-namespace-pool'):
+            if (namespace.startswith(POOL_NS_PREFIX) and
+                    len(self._namespace_pool) <
+                    self.conf.haproxy.namespace_pool_size):
+                self._scrub_namespace(namespace)
+                self._namespace_pool.append(namespace)
+                return
+        ip_lib.IPWrapper(namespace=namespace).garbage_collect_namespace()
+
+    def _scrub_namespace(self, namespace):
+        # the routes and neighbours go away with the devices
+        ns = ip_lib.IPWrapper(namespace=namespace)
+        for device in ns.get_devices(exclude_loopback=True):
+            self.vif_driver.unplug(device.name, namespace=namespace)
+
+    def _init_namespace_pool(self):
+        """Adopts the idle namespaces of a previous run and fills the pool."""
+        used = set(self._namespaces.values())
+        for namespace in ip_lib.IPWrapper.get_namespaces():
+            if namespace.startswith(POOL_NS_PREFIX) and namespace not in used:
+                try:
+                    self._release_namespace(namespace)
+                except Exception:
+                    LOG.exception(_LE('Unable to reuse namespace %s'),
+                                  namespace)
+        self._fill_namespace_pool()
+
+    def _fill_namespace_pool(self):
+        with lockutils.lock('haproxy-namespace-pool'):
+            root_ns = ip_lib.IPWrapper()
+            while (len(self._namespace_pool) <
+                   self.conf.haproxy.namespace_pool_size):
+                namespace = POOL_NS_PREFIX + uuidutils.generate_uuid()
+                try:
+                    # brings the loopback up
+                    root_ns.ensure_namespace(namespace)
+                except Exception:
+                    LOG.exception(_LE('Unable to create namespace %s'),
+                                  namespace)
+                    return
+                self._namespace_pool.append(namespace)
+        LOG.debug('Namespace pool filled with %d namespaces',
+                  len(self._namespace_pool))
 
     def deployable(self, loadbalancer):
         """Returns True if loadbalancer is active and has active listeners."""
@@ -251,59 +522,56 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
         return (bool(acceptable_listeners) and loadbalancer.admin_state_up and
                 loadbalancer.provisioning_status != constants.PENDING_DELETE)
 
+    def _get_socket_path(self, loadbalancer_id):
+        subnet_id = get_shared_subnet_id(
+            self._get_namespace(loadbalancer_id))
+        if subnet_id:
+            return self._get_shared_file_path(
+                subnet_id, 'haproxy_stats.sock', False)
+        return self._get_state_file_path(
+            loadbalancer_id, 'haproxy_stats.sock', False)
+
+    def _get_shared_stats(self, socket_path, entity_type, loadbalancer_id):
+        """Returns the statistics of a loadbalancer of a shared haproxy.
+
+        The statistics of all the loadbalancers are read at once from the
+        socket and reused for SHARED_STATS_MAX_AGE seconds. The ones of the
+        loadbalancer are found by the names of its pools.
+        """
+        with lockutils.lock('haproxy-stats-%s' % socket_path):
+            read_at, lines = self._shared_stats.get(socket_path, (0, None))
+            if time.time() - read_at > SHARED_STATS_MAX_AGE:
+                lines = self._read_stats_from_socket(socket_path,
+                                                     entity_type)
+                self._shared_stats[socket_path] = (time.time(), lines)
+        loadbalancer = self.deployed_loadbalancers.get(loadbalancer_id)
+        proxies = set(pool.id for pool in loadbalancer.pools) if (
+            loadbalancer) else set()
+        return stats_parser.parse_stats(lines, proxies)
+
     def _get_stats_from_socket(self, socket_path, entity_type):
+        return stats_parser.parse_stats(
+            self._read_stats_from_socket(socket_path, entity_type))
+
+    def _read_stats_from_socket(self, socket_path, entity_type):
         try:
             s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
             s.connect(socket_path)
             s.send('show stat -1 %s -1\n' % entity_type)
-            raw_stats = ''
-            chunk_size = 1024
+            # haproxy closes the connection once the whole output is sent,
+            # a short read does not mean the end of the output.
+            chunks = []
             while True:
-                chunk = s.recv(chunk_size)
-                raw_stats += chunk
-                if len(chunk) < chunk_size:
+                chunk = s.recv(STATS_READ_CHUNK_SIZE)
+                if not chunk:
                     break
+                chunks.append(chunk)
+            s.close()
 
-            return self._parse_stats(raw_stats)
+            return ''.join(chunks).splitlines()
         except socket.error as e:
             LOG.warning(_LW('Error while connecting to stats socket: %s'), e)
-            return {}
-
-    def _parse_stats(self, raw_stats):
-        stat_lines = raw_stats.splitlines()
-        if len(stat_lines) < 2:
             return []
-        stat_names = [name.strip('# ') for name in stat_lines[0].split(',')]
-        res_stats = []
-        for raw_values in stat_lines[1:]:
-            if not raw_values:
-                continue
-            stat_values = [value.strip() for value in raw_values.split(',')]
-            res_stats.append(dict(zip(stat_names, stat_values)))
-
-        return res_stats
-
-    def _get_backend_stats(self, parsed_stats):
-        for stats in parsed_stats:
-            if stats.get('type') == STATS_TYPE_BACKEND_RESPONSE:
-                unified_stats = dict((k, stats.get(v, ''))
-                                     for k, v in jinja_cfg.STATS_MAP.items())
-                return unified_stats
-
-        return {}
-
-    def _get_servers_stats(self, parsed_stats):
-        res = {}
-        for stats in parsed_stats:
-            if stats.get('type') == STATS_TYPE_SERVER_RESPONSE:
-                res[stats['svname']] = {
-                    lb_const.STATS_STATUS: (constants.INACTIVE
-                                            if stats['status'] == 'DOWN'
-                                            else constants.ACTIVE),
-                    lb_const.STATS_HEALTH: stats['check_status'],
-                    lb_const.STATS_FAILED_CHECKS: stats['chkfail']
-                }
-        return res
 
     def _get_state_file_path(self, loadbalancer_id, kind,
                              ensure_state_dir=True):
@@ -314,11 +582,37 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
             n_utils.ensure_dir(conf_dir)
         return os.path.join(conf_dir, kind)
 
-    def _plug(self, namespace, port, vip_address, reuse_existing=True):
+    def _get_shared_file_path(self, subnet_id, kind,
+                              ensure_state_dir=True):
+        """Returns the file name of a shared haproxy for a kind of file."""
+        conf_dir = os.path.join(
+            os.path.abspath(os.path.normpath(self.shared_state_path)),
+            subnet_id)
+        if ensure_state_dir:
+            n_utils.ensure_dir(conf_dir)
+        return os.path.join(conf_dir, kind)
+
+    def _record_timing(self, timings, key, start):
+        duration = time.time() - start
+        counters = timings.setdefault(key, [0, 0.0, 0.0])
+        counters[0] += 1
+        counters[1] += duration
+        counters[2] = max(counters[2], duration)
+        return duration
+
+    def _plug(self, namespace, port, vip_address, reuse_existing=True,
+              route_table=None):
+        """Plugs the VIP port of a loadbalancer in its namespace.
+
+        The gratuitous ARPs are sent in the background, so that plugging a
+        namespace does not wait for them. route_table is the routing table
+        of the VIP in a shared namespace, see _add_routes.
+        """
         self.plugin_rpc.plug_vip_port(port.id)
 
         interface_name = self.vif_driver.get_device_name(port)
 
+        start = time.time()
         if ip_lib.device_exists(interface_name,
                                 namespace=namespace):
             if not reuse_existing:
@@ -334,7 +628,10 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
                 namespace=namespace,
                 mtu=port.network.mtu
             )
+        timings = {'vif': self._record_timing(self.plug_timings, 'vif',
+                                              start)}
 
+        start = time.time()
         cidrs = [
             '%s/%s' % (ip.ip_address,
                        netaddr.IPNetwork(ip.subnet.cidr).prefixlen)
@@ -347,16 +644,21 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
         if netaddr.IPAddress(vip_address).version == 6:
             device = ip_lib.IPDevice(interface_name, namespace=namespace)
             device.addr.wait_until_address_ready(vip_address)
+        if route_table is not None:
+            # the devices of a shared namespace are on the same subnet, each
+            # one only answers and announces its own addresses
+            ip_lib.IPWrapper(namespace=namespace).netns.execute(
+                ['sysctl', '-w', 'net.ipv4.conf.all.arp_ignore=1',
+                 'net.ipv4.conf.all.arp_announce=2'])
+        timings['l3'] = self._record_timing(self.plug_timings, 'l3', start)
 
         # Add subnet host routes
-        host_routes = port.fixed_ips[0].subnet.host_routes
-        for host_route in host_routes:
-            if host_route.destination != "0.0.0.0/0":
-                cmd = ['route', 'add', '-net', host_route.destination,
-                       'gw', host_route.nexthop]
-                ip_wrapper = ip_lib.IPWrapper(namespace=namespace)
-                ip_wrapper.netns.execute(cmd, check_exit_code=False)
+        routes_duration = self._add_routes(namespace, port, interface_name,
+                                           vip_address, route_table)
+        if routes_duration is not None:
+            timings['routes'] = routes_duration
 
+        host_routes = port.fixed_ips[0].subnet.host_routes
         gw_ip = port.fixed_ips[0].subnet.gateway_ip
 
         if not gw_ip:
@@ -365,19 +667,102 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
                     gw_ip = host_route.nexthop
                     break
         else:
-            cmd = ['route', 'add', 'default', 'gw', gw_ip]
-            ip_wrapper = ip_lib.IPWrapper(namespace=namespace)
-            ip_wrapper.netns.execute(cmd, check_exit_code=False)
             # When delete and re-add the same vip, we need to
             # send gratuitous ARP to flush the ARP cache in the Router.
             gratuitous_arp = self.conf.haproxy.send_gratuitous_arp
             if gratuitous_arp > 0:
-                for ip in port.fixed_ips:
-                    cmd_arping = ['arping', '-U',
-                                  '-I', interface_name,
-                                  '-c', gratuitous_arp,
-                                  ip.ip_address]
-                    ip_wrapper.netns.execute(cmd_arping, check_exit_code=False)
+                eventlet.spawn_n(self._send_gratuitous_arp, namespace,
+                                 interface_name,
+                                 [ip.ip_address for ip in port.fixed_ips],
+                                 gratuitous_arp)
+
+        LOG.debug('Plugged port %(port)s in %(namespace)s in %(timings)s',
+                  {'port': port.id, 'namespace': namespace,
+                   'timings': ', '.join(
+                       '%s %.3fs' % (phase, timings[phase])
+                       for phase in sorted(timings))})
+
+    def _add_routes(self, namespace, port, interface_name=None,
+                    vip_address=None, route_table=None):
+        """Adds the host routes and the default route of a VIP subnet.
+
+        In a shared namespace, the replies of a VIP must leave through its
+        own device, or the port security of the other VIP ports drops them.
+        The subnet routes are then also added through the device to
+        route_table, which a rule selects for the traffic from the VIP.
+
+        :returns: the seconds taken, None if the subnet has no route
+        """
+        subnet = port.fixed_ips[0].subnet
+        routes = [(netaddr.IPNetwork(host_route.destination),
+                   netaddr.IPAddress(host_route.nexthop))
+                  for host_route in subnet.host_routes
+                  if host_route.destination != "0.0.0.0/0"]
+        if subnet.gateway_ip:
+            routes.append(('default', netaddr.IPAddress(subnet.gateway_ip)))
+        commands = ['route add %s via %s' % route for route in routes]
+        if route_table is not None:
+            commands.append('route add %s dev %s table %d' % (
+                netaddr.IPNetwork(subnet.cidr).cidr, interface_name,
+                route_table))
+            commands.extend('route add %s via %s dev %s table %d' % (
+                route + (interface_name, route_table)) for route in routes)
+            # a rule left for the VIP by a previous loadbalancer goes first
+            vip_address = netaddr.IPAddress(vip_address)
+            commands.extend([
+                'rule del from %s' % vip_address,
+                'rule add from %s table %d' % (vip_address, route_table)])
+        if not commands:
+            return None
+        start = time.time()
+        self._execute_ip_batch(namespace, subnet.cidr, commands)
+        return self._record_timing(self.plug_timings, 'routes', start)
+
+    def _execute_ip_batch(self, namespace, address, commands):
+        """Runs ip commands with a single 'ip -batch' in a namespace.
+
+        The batch file is written here from commands built of parsed
+        addresses only, so it cannot hold any other ip command. The family
+        of the commands is the one of address.
+        """
+        with tempfile.NamedTemporaryFile(mode='w', prefix=namespace + '-',
+                                         suffix='.ip') as batch:
+            batch.writelines(command + '\n' for command in commands)
+            batch.flush()
+            # -force goes on with the next commands if one fails
+            ip_lib.IPWrapper(namespace=namespace).netns.execute(
+                ['ip', '-%d' % netaddr.IPNetwork(address).version, '-force',
+                 '-batch', batch.name], check_exit_code=False)
+
+    def _restore_shared_routes(self, namespace):
+        """Adds the routes of a shared namespace again.
+
+        The loadbalancers of a shared namespace are on the same subnet and
+        share its routes, which go away with the device they were added
+        through when its loadbalancer is removed.
+        """
+        for loadbalancer_id, lb_namespace in sorted(self._namespaces.items()):
+            loadbalancer = self.deployed_loadbalancers.get(loadbalancer_id)
+            if lb_namespace == namespace and loadbalancer:
+                self._add_routes(namespace, loadbalancer.vip_port)
+                return
+
+    def _send_gratuitous_arp(self, namespace, interface_name, addresses,
+                             count):
+        start = time.time()
+        ip_wrapper = ip_lib.IPWrapper(namespace=namespace)
+        for address in addresses:
+            cmd_arping = ['arping', '-U',
+                          '-I', interface_name,
+                          '-c', count,
+                          address]
+            try:
+                ip_wrapper.netns.execute(cmd_arping, check_exit_code=False)
+            except Exception:
+                LOG.warning(_LW('Failed sending gratuitous ARP for %(ip)s '
+                                'in %(namespace)s'),
+                            {'ip': address, 'namespace': namespace})
+        self._record_timing(self.plug_timings, 'arp', start)
 
     def _unplug(self, namespace, port):
         self.plugin_rpc.unplug_vip_port(port.id)
@@ -385,17 +770,23 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
         self.vif_driver.unplug(interface_name, namespace=namespace)
 
     def _spawn(self, loadbalancer, extra_cmd_args=()):
+        subnet_id = get_shared_subnet_id(
+            self._get_namespace(loadbalancer.id))
+        if subnet_id:
+            self.deployed_loadbalancers[loadbalancer.id] = loadbalancer
+            self._spawn_shared(subnet_id)
+            return
         conf_path = self._get_state_file_path(loadbalancer.id,
                                               'haproxy.conf')
         sock_path = self._get_state_file_path(loadbalancer.id,
                                               'haproxy_stats.sock')
         user_group = self.conf.haproxy.user_group
         haproxy_base_dir = self._get_state_file_path(loadbalancer.id, '')
-        jinja_cfg.save_config(conf_path,
-                              loadbalancer,
-                              sock_path,
-                              user_group,
-                              haproxy_base_dir)
+        config_changed = jinja_cfg.save_config(conf_path,
+                                               loadbalancer,
+                                               sock_path,
+                                               user_group,
+                                               haproxy_base_dir)
 
         def callback(pid_path):
             cmd = ['haproxy', '-f', conf_path, '-p', pid_path]
@@ -404,7 +795,7 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
 
         pid_data = self._get_state_file_path(loadbalancer.id, 'haproxy.pid')
         pid_path = os.path.split(pid_data)[0]
-        namespace = get_ns_name(loadbalancer.id)
+        namespace = self._get_namespace(loadbalancer.id)
         pm = external_process.ProcessManager(
             uuid=loadbalancer.id,
             default_cmd_callback=callback,
@@ -414,16 +805,125 @@ class HaproxyNSDriver(agent_device_driver.AgentDeviceDriver):
             pids_path=pid_path,
             pid_file=pid_data,
             custom_reload_callback=callback if extra_cmd_args else None)
+        runtime_updates = self.conf.haproxy.runtime_member_updates
+        # changes may have been applied to a haproxy started before the
+        # agent, it is reloaded to know its state.
+        state_unknown = (runtime_updates and
+                         loadbalancer.id not in self._runtime_states)
+        started = True
         if pm.active:
-            pm.reload_cfg()
+            if config_changed or state_unknown:
+                pm.reload_cfg()
+            else:
+                started = False
+                LOG.debug('Configuration of loadbalancer %s did not change, '
+                          'haproxy is not reloaded', loadbalancer.id)
         else:
             pm.enable()
+        if started and runtime_updates:
+            # the running haproxy now matches the configuration file
+            with open(conf_path) as conf_file:
+                self._runtime_states[loadbalancer.id] = (
+                    runtime_api.RuntimeState(conf_file.read()))
         self.process_monitor.register(uuid=loadbalancer.id,
                                       service_name=HAPROXY_SERVICE_NAME,
                                       monitored_process=pm)
         # remember deployed loadbalancer id
         self.deployed_loadbalancers[loadbalancer.id] = loadbalancer
 
+    def _get_shared_loadbalancers(self, subnet_id):
+        """Returns the deployable loadbalancers in a shared namespace.
+
+        The loadbalancers which were not deployed since the agent started
+        are retrieved from the server, so that a restarted agent does not
+        drop them from the configuration.
+        """
+        namespace = SHARED_NS_PREFIX + subnet_id
+        loadbalancers = []
+        for loadbalancer_id in sorted(
+                loadbalancer_id for loadbalancer_id, lb_namespace
+                in self._namespaces.items() if lb_namespace == namespace):
+            loadbalancer = self.deployed_loadbalancers.get(loadbalancer_id)
+            if loadbalancer is None:
+                try:
+                    loadbalancer = data_models.LoadBalancer.from_dict(
+                        self.plugin_rpc.get_loadbalancer(loadbalancer_id))
+                except Exception:
+                    LOG.exception(_LE('Unable to get loadbalancer %s'),
+                                  loadbalancer_id)
+                    continue
+                self.deployed_loadbalancers[loadbalancer_id] = loadbalancer
+            if self.deployable(loadbalancer):
+                loadbalancers.append(loadbalancer)
+        return loadbalancers
+
+    def _spawn_shared(self, subnet_id):
+        """Configures and reloads the haproxy shared by a subnet.
+
+        haproxy is reloaded with -x and -sf: the new process receives the
+        listening sockets of the old one through its stats socket, so no
+        connection is refused while it starts, and the old process
+        finishes its connections.
+
+        :returns: the number of loadbalancers served by the haproxy
+        """
+        with lockutils.lock('haproxy-subnet-%s' % subnet_id):
+            loadbalancers = self._get_shared_loadbalancers(subnet_id)
+            conf_path = self._get_shared_file_path(
+                subnet_id, 'haproxy.conf', bool(loadbalancers))
+            sock_path = self._get_shared_file_path(
+                subnet_id, 'haproxy_stats.sock', False)
+            pid_data = self._get_shared_file_path(
+                subnet_id, 'haproxy.pid', False)
+            extra_cmd_args = []
+
+            def callback(pid_path):
+                cmd = ['haproxy', '-f', conf_path, '-p', pid_path]
+                cmd.extend(extra_cmd_args)
+                return cmd
+
+            pm = external_process.ProcessManager(
+                uuid=subnet_id,
+                default_cmd_callback=callback,
+                namespace=SHARED_NS_PREFIX + subnet_id,
+                service=HAPROXY_SERVICE_NAME,
+                conf=self.conf,
+                pids_path=os.path.dirname(pid_data),
+                pid_file=pid_data,
+                custom_reload_callback=callback)
+
+            if not loadbalancers:
+                self.process_monitor.unregister(
+                    uuid=subnet_id, service_name=HAPROXY_SERVICE_NAME)
+                pm.disable()
+                self._shared_stats.pop(sock_path, None)
+                conf_dir = os.path.dirname(conf_path)
+                if os.path.isdir(conf_dir):
+                    shutil.rmtree(conf_dir)
+                return 0
+
+            config_changed = jinja_cfg.save_shared_config(
+                conf_path, 'subnet %s' % subnet_id,
+                [(loadbalancer,
+                  self._get_state_file_path(loadbalancer.id, ''))
+                 for loadbalancer in loadbalancers],
+                sock_path, self.conf.haproxy.user_group)
+            if pm.active:
+                if config_changed:
+                    with open(pid_data) as pid_file:
+                        extra_cmd_args.extend(['-x', sock_path, '-sf'])
+                        extra_cmd_args.extend(p.strip() for p in pid_file)
+                    pm.reload_cfg()
+            else:
+                pm.enable()
+            self.process_monitor.register(uuid=subnet_id,
+                                          service_name=HAPROXY_SERVICE_NAME,
+                                          monitored_process=pm)
+            LOG.debug('haproxy of subnet %(subnet)s serves %(count)d '
+                      'loadbalancers', {'subnet': subnet_id,
+                                        'count': len(loadbalancers)})
+            return len(loadbalancers)
+
     def _is_active(self, loadbalancer):
         # haproxy will be unable to start without any active vip
         if (len(loadbalancer.listeners) == 0 or
@@ -0,0 +1,202 @@
+# Copyright 2017 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Member changes applied through the haproxy runtime API.
+
+The configuration rendered for a load balancer is split in two parts: its
+server lines, and everything else. When only the server lines change
+between the running configuration and the new one, the changes are turned
+into commands for the admin stats socket instead of reloading haproxy.
+Members are added in the server-template slots of their backend.
+"""
+
+import collections
+import copy
+import re
+import socket
+
+from oslo_log import log as logging
+
+from neutron_lbaas._i18n import _LW
+
+LOG = logging.getLogger(__name__)
+
+SERVER_RE = re.compile(
+    r'^\s+server (?P<name>\S+) (?P<address>\S+):(?P<port>\d+) '
+    r'weight (?P<weight>\S+)(?P<options>.*)$')
+SERVER_TEMPLATE_RE = re.compile(
+    r'^\s+server-template (?P<prefix>\S+) (?P<count>\d+) \S+ '
+    r'weight \S+ disabled(?P<options>.*)$')
+# Lines of the answers of successful 'set server addr' commands
+SUCCESS_RE = re.compile(r'^(IP changed|no need to change)')
+READ_CHUNK_SIZE = 4096
+
+Server = collections.namedtuple('Server',
+                                ['address', 'port', 'weight', 'options'])
+
+
+class BackendState(object):
+    """Servers of a backend as known by the running haproxy."""
+
+    def __init__(self):
+        # server name -> Server
+        self.servers = {}
+        self.disabled = set()
+        self.free_slots = []
+        self.slot_options = None
+        # member id -> name of the slot serving it
+        self.slot_members = {}
+
+
+class RuntimeState(object):
+    """State of a running haproxy, updated by the runtime commands."""
+
+    def __init__(self, config_str):
+        self.skeleton, self.backends = parse_config(config_str)
+
+    def get_member_name(self, server_name):
+        """Returns the member id served by a server of the running haproxy.
+
+        :param server_name: name of a server or of a slot
+        :returns: the member id
+        """
+        for backend in self.backends.values():
+            for member_id, slot in backend.slot_members.items():
+                if slot == server_name:
+                    return member_id
+        return server_name
+
+    def get_commands(self, config_str):
+        """Computes the commands moving the running haproxy to a config.
+
+        :param config_str: the new configuration
+        :returns: the list of commands and the state once they are applied,
+                  or (None, None) when haproxy needs to be reloaded
+        """
+        skeleton, new_backends = parse_config(config_str)
+        if skeleton != self.skeleton:
+            return None, None
+        state = copy.deepcopy(self)
+        commands = []
+        for backend_name, new_backend in new_backends.items():
+            backend = state.backends[backend_name]
+            backend_commands = _get_backend_commands(backend_name, backend,
+                                                     new_backend.servers)
+            if backend_commands is None:
+                return None, None
+            commands.extend(backend_commands)
+        return commands, state
+
+
+def _get_backend_commands(backend_name, backend, servers):
+    commands = []
+    for member_id, server in servers.items():
+        name = backend.slot_members.get(member_id, member_id)
+        current = backend.servers.get(name)
+        if current is None:
+            # a new member, it takes a free slot
+            if not backend.free_slots or backend.slot_options != (
+                    server.options):
+                return None
+            name = backend.free_slots.pop(0)
+            backend.slot_members[member_id] = name
+            commands.append('set server %s/%s addr %s port %s' % (
+                backend_name, name, server.address, server.port))
+            current = server._replace(weight=None)
+        elif current[:2] != server[:2] or current.options != server.options:
+            return None
+        server_id = '%s/%s' % (backend_name, name)
+        if current.weight != server.weight:
+            commands.append('set weight %s %s' % (server_id, server.weight))
+        if name in backend.disabled:
+            commands.append('enable server %s' % server_id)
+            backend.disabled.discard(name)
+        backend.servers[name] = server
+
+    # members which are gone, their slot is released
+    for member_id, name in list(backend.slot_members.items()):
+        if member_id not in servers:
+            commands.append('disable server %s/%s' % (backend_name, name))
+            backend.disabled.add(name)
+            backend.free_slots.append(name)
+            del backend.slot_members[member_id]
+            del backend.servers[name]
+    wanted = set(backend.slot_members.get(member_id, member_id)
+                 for member_id in servers)
+    for name in set(backend.servers) - wanted - backend.disabled:
+        commands.append('disable server %s/%s' % (backend_name, name))
+        backend.disabled.add(name)
+    return commands
+
+
+def parse_config(config_str):
+    """Splits a configuration into its server lines and the rest.
+
+    :param config_str: a rendered configuration
+    :returns: the configuration without its server lines, and the servers
+              and slots of each backend
+    """
+    skeleton = []
+    backends = collections.OrderedDict()
+    backend = None
+    for line in config_str.splitlines():
+        if line.startswith('backend '):
+            backend = backends[line.split()[1]] = BackendState()
+        elif not line.startswith(' '):
+            backend = None
+        server = SERVER_RE.match(line) if backend else None
+        if server:
+            backend.servers[server.group('name')] = Server(
+                server.group('address'), server.group('port'),
+                server.group('weight'), server.group('options'))
+            continue
+        template = SERVER_TEMPLATE_RE.match(line) if backend else None
+        if template:
+            backend.free_slots = [
+                '%s%d' % (template.group('prefix'), i)
+                for i in range(1, int(template.group('count')) + 1)]
+            backend.slot_options = template.group('options')
+            backend.disabled.update(backend.free_slots)
+        skeleton.append(line)
+    return '\n'.join(skeleton), backends
+
+
+def send_commands(socket_path, commands):
+    """Sends commands to the admin stats socket of haproxy.
+
+    :param socket_path: location of the stats socket
+    :param commands: list of commands
+    :returns: True if all the commands succeeded, False otherwise
+    """
+    try:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(socket_path)
+        s.send('%s\n' % ';'.join(commands))
+        chunks = []
+        while True:
+            chunk = s.recv(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        s.close()
+    except socket.error as e:
+        LOG.warning(_LW('Error while sending commands to haproxy: %s'), e)
+        return False
+    errors = [line for line in ''.join(chunks).splitlines()
+              if line.strip() and not SUCCESS_RE.match(line)]
+    if errors:
+        LOG.warning(_LW('haproxy rejected runtime commands: %s'),
+                    '; '.join(errors))
+        return False
+    return True
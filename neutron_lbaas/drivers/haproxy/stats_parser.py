@@ -0,0 +1,111 @@
+# Copyright 2017 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Parser for the CSV output of the haproxy 'show stat' command."""
+
+from neutron.plugins.common import constants
+
+from neutron_lbaas.drivers.haproxy import jinja_cfg
+from neutron_lbaas.services.loadbalancer import constants as lb_const
+
+STATS_TYPE_BACKEND_RESPONSE = '1'
+STATS_TYPE_SERVER_RESPONSE = '2'
+
+# The header only changes with the haproxy version, a handful of schemas is
+# enough.
+MAX_CACHED_SCHEMAS = 8
+
+_schemas = {}
+
+
+class StatsSchema(object):
+    """Positions of the columns used by the driver in a 'show stat' header.
+
+    Only the columns of jinja_cfg.STATS_MAP and the ones describing the
+    status of the members are kept, the other columns are never looked at.
+    """
+
+    def __init__(self, header):
+        names = [name.strip('# ') for name in header.split(',')]
+        positions = {}
+        for index, name in enumerate(names):
+            positions.setdefault(name, index)
+        self.proxy_index = positions.get('pxname')
+        self.type_index = positions.get('type')
+        self.name_index = positions.get('svname')
+        self.status_index = positions.get('status')
+        self.check_status_index = positions.get('check_status')
+        self.chkfail_index = positions.get('chkfail')
+        self.backend_columns = [(key, positions.get(column))
+                                for key, column in jinja_cfg.STATS_MAP.items()]
+
+
+def get_schema(header):
+    """Returns the schema of a header, parsing it only once."""
+    schema = _schemas.get(header)
+    if schema is None:
+        if len(_schemas) >= MAX_CACHED_SCHEMAS:
+            _schemas.clear()
+        schema = _schemas[header] = StatsSchema(header)
+    return schema
+
+
+def _get_value(values, index):
+    if index is None or index >= len(values):
+        return ''
+    return values[index].strip()
+
+
+def parse_stats(lines, proxies=None):
+    """Returns the backend and the servers statistics found in lines.
+
+    lines is an iterable over the lines of the 'show stat' output, header
+    first. The backend statistics are the ones of the first backend, keyed
+    like jinja_cfg.STATS_MAP. The servers statistics are keyed by server
+    name. Both are computed in a single pass over the lines. If proxies is
+    given, only the rows of the backends named in proxies are kept.
+    """
+    lines = iter(lines)
+    header = next(lines, None)
+    if not header:
+        return {}, {}
+    schema = get_schema(header)
+
+    backend_stats = None
+    servers_stats = {}
+    for line in lines:
+        if not line:
+            continue
+        values = line.split(',')
+        if (proxies is not None and
+                _get_value(values, schema.proxy_index) not in proxies):
+            continue
+        row_type = _get_value(values, schema.type_index)
+        if row_type == STATS_TYPE_SERVER_RESPONSE:
+            status = _get_value(values, schema.status_index)
+            servers_stats[_get_value(values, schema.name_index)] = {
+                lb_const.STATS_STATUS: (constants.INACTIVE
+                                        if status == 'DOWN'
+                                        else constants.ACTIVE),
+                lb_const.STATS_HEALTH: _get_value(
+                    values, schema.check_status_index),
+                lb_const.STATS_FAILED_CHECKS: _get_value(
+                    values, schema.chkfail_index)
+            }
+        elif (row_type == STATS_TYPE_BACKEND_RESPONSE and
+                backend_stats is None):
+            backend_stats = dict((key, _get_value(values, index))
+                                 for key, index in schema.backend_columns)
+
+    return backend_stats or {}, servers_stats
@@ -192,8 +192,10 @@ class NetScalerLoadBalancerDriverV2(driver_base.LoadBalancerBaseDriver):
 
     def _update_status_tree_in_db(self, lb_id, loadbalancer_statuses):
         track_loadbalancer = {"track": False}
-        db_lb = self.plugin.db.get_loadbalancer(self.admin_ctx,
-                                                lb_id)
+        # only the statuses of the tree are needed to track the operations,
+        # the graph is modified below so it must not be the cached one
+        db_lb = self.plugin.db.get_loadbalancer_status_graph(
+            self.admin_ctx, lb_id, use_cache=False)
 
         if (not loadbalancer_statuses and
                 db_lb.provisioning_status == constants.PENDING_DELETE):
@@ -222,6 +224,7 @@ class NetScalerLoadBalancerDriverV2(driver_base.LoadBalancerBaseDriver):
 
             if not db_pool:
                 continue
+            db_pool.loadbalancer = db_lb
             db_pool.listener = db_listener
 
             status_pools = status_listener['pools']
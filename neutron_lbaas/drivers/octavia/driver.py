@@ -11,27 +11,34 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
-from datetime import datetime
+import bisect
+import collections
 from functools import wraps
-import threading
 import time
 
-from neutron import context as ncontext
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
 from oslo_service import service
 from oslo_utils import excutils
 import requests
+from requests import adapters
 
 from neutron_lbaas._i18n import _
 from neutron_lbaas.common import keystone
 from neutron_lbaas.drivers import driver_base
+from neutron_lbaas.drivers.octavia import event_handler
 from neutron_lbaas.drivers.octavia import octavia_messaging_consumer
+from neutron_lbaas.drivers.octavia import status_poller
 from neutron_lbaas.services.loadbalancer import constants
 
 LOG = logging.getLogger(__name__)
 VERSION = "1.0.1"
+# Seconds before its expiration a Keystone token is renewed
+TOKEN_STALE_SECONDS = 60
+# Upper bounds in seconds of the buckets of the request latency histograms
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
 
 OPTS = [
     cfg.StrOpt(
@@ -51,6 +58,59 @@ OPTS = [
         help=_('Time to stop polling octavia when a status of an entity does '
                'not change.')
     ),
+    cfg.IntOpt(
+        'request_poll_max_interval',
+        default=12,
+        help=_('Maximum interval in seconds between two polls of a load '
+               'balancer. The interval starts at request_poll_interval and '
+               'doubles each time the load balancer is found busy.')
+    ),
+    cfg.BoolOpt(
+        'event_driven_completion',
+        default=False,
+        help=_('Poll Octavia for the operations sent to it when it streams '
+               'the new status of their load balancer. Octavia is otherwise '
+               'only polled every event_poll_interval seconds, in case an '
+               'event gets lost.')
+    ),
+    cfg.IntOpt(
+        'event_poll_interval',
+        default=30,
+        help=_('Interval in seconds to poll octavia when the operations are '
+               'completed from the streamed events.')
+    ),
+    cfg.FloatOpt(
+        'event_flush_interval',
+        default=0.5,
+        help=_('Seconds during which the events streamed by Octavia are '
+               'coalesced before being stored in a single transaction. 0 '
+               'stores every event right away.')
+    ),
+    cfg.IntOpt(
+        'request_pool_size',
+        default=10,
+        help=_('Maximum number of connections to Octavia kept open for '
+               'reuse.')
+    ),
+    cfg.IntOpt(
+        'request_max_retries',
+        default=3,
+        help=_('Number of times a request is retried when Octavia answers '
+               'that the load balancer is busy (409) or with a server '
+               'error. Server errors are only retried for GET, PUT and '
+               'DELETE.')
+    ),
+    cfg.FloatOpt(
+        'request_retry_backoff',
+        default=0.5,
+        help=_('Seconds to wait before the first retry of a request, the '
+               'delay doubles with each retry.')
+    ),
+    cfg.BoolOpt(
+        'request_compression',
+        default=True,
+        help=_('Accept gzip compressed responses from Octavia.')
+    ),
     cfg.BoolOpt(
         'allocates_vip',
         default=False,
@@ -62,39 +122,6 @@ OPTS = [
 cfg.CONF.register_opts(OPTS, 'octavia')
 
 
-def thread_op(manager, entity, delete=False, lb_create=False):
-    context = ncontext.get_admin_context()
-    poll_interval = cfg.CONF.octavia.request_poll_interval
-    poll_timeout = cfg.CONF.octavia.request_poll_timeout
-    start_dt = datetime.now()
-    prov_status = None
-    while (datetime.now() - start_dt).seconds < poll_timeout:
-        octavia_lb = manager.driver.load_balancer.get(entity.root_loadbalancer)
-        prov_status = octavia_lb.get('provisioning_status')
-        LOG.debug("Octavia reports load balancer {0} has provisioning status "
-                  "of {1}".format(entity.root_loadbalancer.id, prov_status))
-        if prov_status == 'ACTIVE' or prov_status == 'DELETED':
-            kwargs = {'delete': delete}
-            if manager.driver.allocates_vip and lb_create:
-                kwargs['lb_create'] = lb_create
-                # TODO(blogan): drop fk constraint on vip_port_id to ports
-                # table because the port can't be removed unless the load
-                # balancer has been deleted.  Until then we won't populate the
-                # vip_port_id field.
-                # entity.vip_port_id = octavia_lb.get('vip').get('port_id')
-                entity.vip_address = octavia_lb.get('vip').get('ip_address')
-            manager.successful_completion(context, entity, **kwargs)
-            return
-        elif prov_status == 'ERROR':
-            manager.failed_completion(context, entity)
-            return
-        time.sleep(poll_interval)
-    LOG.debug("Timeout has expired for load balancer {0} to complete an "
-              "operation.  The last reported status was "
-              "{1}".format(entity.root_loadbalancer.id, prov_status))
-    manager.failed_completion(context, entity)
-
-
 # A decorator for wrapping driver operations, which will automatically
 # set the neutron object's status based on whether it sees an exception
 
@@ -106,12 +133,8 @@ def async_op(func):
                      isinstance(args[0], LoadBalancerManager))
         try:
             r = func(*args, **kwargs)
-            thread = threading.Thread(target=thread_op,
-                                      args=(args[0], args[2]),
-                                      kwargs={'delete': d,
-                                              'lb_create': lb_create})
-            thread.setDaemon(True)
-            thread.start()
+            args[0].driver.status_poller.register(
+                args[0], args[2], delete=d, lb_create=lb_create)
             return r
         except Exception:
             with excutils.save_and_reraise_exception():
@@ -120,30 +143,80 @@ def async_op(func):
 
 
 class OctaviaRequest(object):
+    """Client of the Octavia API.
+
+    The requests go through a pooled session, so connections to Octavia are
+    kept alive and reused. The Keystone token is kept until it is about to
+    expire. Requests rejected because a load balancer is busy (409) or
+    because of a server error are retried with an exponential backoff;
+    server errors only for the idempotent methods.
+    """
 
     def __init__(self, base_url, auth_session):
         self.base_url = base_url
         self.auth_session = auth_session
+        self._access = None
+        self.session = requests.Session()
+        adapter = adapters.HTTPAdapter(
+            pool_maxsize=cfg.CONF.octavia.request_pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if not cfg.CONF.octavia.request_compression:
+            self.session.headers['Accept-Encoding'] = 'identity'
+        # method -> number of requests per latency bucket
+        self.latency_histogram = collections.defaultdict(
+            lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+
+    def _get_token(self):
+        access = self._access
+        if access is None or access.will_expire_soon(TOKEN_STALE_SECONDS):
+            access = self._access = self.auth_session.auth.get_access(
+                self.auth_session)
+        return access.auth_token
+
+    def _record_latency(self, method, latency):
+        self.latency_histogram[method][
+            bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def _should_retry(self, method, status_code):
+        if status_code == 409:
+            return True
+        return status_code >= 500 and method in IDEMPOTENT_METHODS
 
     def request(self, method, url, args=None, headers=None):
         if args:
             args = jsonutils.dumps(args)
 
-        if not headers or not headers.get('X-Auth-Token'):
-            headers = headers or {
-                'Content-type': 'application/json',
-            }
-            headers['X-Auth-Token'] = self.auth_session.get_token()
-
-        LOG.debug("url = %s", '%s%s' % (self.base_url, str(url)))
+        token_from_caller = bool(headers and headers.get('X-Auth-Token'))
+        headers = dict(headers or {'Content-type': 'application/json'})
+        url = '%s%s' % (self.base_url, str(url))
+        LOG.debug("url = %s", url)
         LOG.debug("args = %s", args)
-        r = requests.request(method,
-                             '%s%s' % (self.base_url, str(url)),
-                             data=args,
-                             headers=headers)
-        LOG.debug("Octavia Response Code: {0}".format(r.status_code))
-        LOG.debug("Octavia Response Body: {0}".format(r.content))
-        LOG.debug("Octavia Response Headers: {0}".format(r.headers))
+        retries = cfg.CONF.octavia.request_max_retries
+        token_refreshed = False
+        attempt = 0
+        while True:
+            if not token_from_caller:
+                headers['X-Auth-Token'] = self._get_token()
+            start = time.time()
+            r = self.session.request(method, url, data=args, headers=headers)
+            latency = time.time() - start
+            self._record_latency(method, latency)
+            LOG.debug("Octavia %(method)s %(url)s: %(code)s in "
+                      "%(latency).3fs",
+                      {'method': method, 'url': url, 'code': r.status_code,
+                       'latency': latency})
+            if (r.status_code == 401 and not token_from_caller and
+                    not token_refreshed):
+                # the token was revoked before its expiration
+                self._access = None
+                token_refreshed = True
+                continue
+            if attempt >= retries or not self._should_retry(method,
+                                                            r.status_code):
+                break
+            time.sleep(cfg.CONF.octavia.request_retry_backoff * 2 ** attempt)
+            attempt += 1
         if method != 'DELETE':
             return r.json()
 
@@ -174,6 +247,8 @@ class OctaviaDriver(driver_base.LoadBalancerBaseDriver):
         self.health_monitor = HealthMonitorManager(self)
         self.l7policy = L7PolicyManager(self)
         self.l7rule = L7RuleManager(self)
+        self.status_poller = status_poller.StatusPoller(self)
+        self.event_handler = event_handler.StreamedEventHandler(self)
         self.octavia_consumer = octavia_messaging_consumer.OctaviaConsumer(
             self)
         service.launch(cfg.CONF, self.octavia_consumer)
@@ -183,6 +258,9 @@ class OctaviaDriver(driver_base.LoadBalancerBaseDriver):
     def allocates_vip(self):
         return self.load_balancer.allocates_vip
 
+    def handle_streamed_event(self, container):
+        self.event_handler.handle(container)
+
 
 class LoadBalancerManager(driver_base.BaseLoadBalancerManager):
 
@@ -0,0 +1,119 @@
+# Copyright 2017 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Storage of the events streamed by Octavia.
+
+Status events are coalesced per object during event_flush_interval and
+written in a single transaction. Listener statistics are stored per
+listener in lbaas_listener_statistics and summed per load balancer when the
+statistics are read.
+"""
+
+import collections
+import threading
+
+from neutron import context as ncontext
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from neutron_lbaas._i18n import _LE
+from neutron_lbaas.common import exceptions
+from neutron_lbaas.drivers import driver_base
+from neutron_lbaas.services.loadbalancer import constants
+
+LOG = logging.getLogger(__name__)
+
+
+class StreamedEventHandler(object):
+    """Buffers the events streamed by Octavia and stores them in batches."""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self._lock = threading.Lock()
+        # (model, id) -> [provisioning_status, operating_status]
+        self._statuses = collections.OrderedDict()
+        # listener id -> statistics received since the last flush
+        self._listener_stats = {}
+        self._flush_scheduled = False
+
+    def handle(self, container):
+        """Queues a streamed event to be stored with the next flush."""
+        info_type = container.info_type
+        payload = container.info_payload
+        if info_type == constants.LISTENER_STATS_EVENT:
+            with self._lock:
+                self._listener_stats[container.info_id] = payload
+        elif info_type in driver_base.LoadBalancerBaseDriver.model_map:
+            model = driver_base.LoadBalancerBaseDriver.model_map[info_type]
+            provisioning_status = payload.get('provisioning_status')
+            with self._lock:
+                status = self._statuses.setdefault(
+                    (model, container.info_id), [None, None])
+                if provisioning_status:
+                    status[0] = provisioning_status
+                if payload.get('operating_status'):
+                    status[1] = payload['operating_status']
+            if info_type == constants.LOADBALANCER_EVENT:
+                self.driver.status_poller.notify(container.info_id,
+                                                 provisioning_status)
+        else:
+            raise exceptions.ModelMapException(target_name=info_type)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        window = cfg.CONF.octavia.event_flush_interval
+        if not window:
+            self.flush()
+            return
+        with self._lock:
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        timer = threading.Timer(window, self._flush_later)
+        timer.setDaemon(True)
+        timer.start()
+
+    def _flush_later(self):
+        try:
+            self.flush()
+        except Exception:
+            LOG.exception(_LE('Unable to store the events streamed by '
+                              'Octavia'))
+
+    def flush(self):
+        """Stores the queued events."""
+        with self._lock:
+            statuses, self._statuses = (self._statuses,
+                                        collections.OrderedDict())
+            listener_stats, self._listener_stats = self._listener_stats, {}
+            self._flush_scheduled = False
+        if not statuses and not listener_stats:
+            return
+        context = ncontext.get_admin_context()
+        if statuses:
+            not_found = self.driver.plugin.db.update_statuses(
+                context, [key + tuple(status)
+                          for key, status in statuses.items()])
+            for model, id in not_found:
+                LOG.debug('Cannot update the status of %(name)s %(id)s, it '
+                          'was deleted', {'name': model.NAME, 'id': id})
+        if listener_stats:
+            self._store_listener_stats(context, listener_stats)
+
+    def _store_listener_stats(self, context, listener_stats):
+        not_found = self.driver.plugin.db.update_listeners_stats(
+            context, listener_stats)
+        for listener_id in not_found:
+            LOG.debug('Cannot store the statistics of listener %s, it was '
+                      'deleted', listener_id)
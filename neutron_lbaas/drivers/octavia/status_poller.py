@@ -0,0 +1,239 @@
+# Copyright 2017 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Completion of the operations sent to Octavia.
+
+Octavia reports the progress of an operation through the provisioning
+status of the root load balancer. The poller keeps the pending operations
+of each load balancer and resolves all of them from a single GET of that
+load balancer per polling interval. A load balancer is polled right away
+when Octavia streams a final status for it. With event_driven_completion,
+the polling interval is only a slow safety net for lost events.
+"""
+
+import collections
+import threading
+import time
+
+from neutron import context as ncontext
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from neutron_lbaas._i18n import _LE
+
+LOG = logging.getLogger(__name__)
+
+# Factor applied to the polling interval of a load balancer each time it is
+# found busy.
+BACKOFF_FACTOR = 2
+# Provisioning statuses of a load balancer which is done with its operations
+FINAL_STATUSES = ('ACTIVE', 'DELETED', 'ERROR')
+
+# registered is the time the operation was accepted by Octavia, a GET
+# started before then may return the status of a previous operation.
+PendingOperation = collections.namedtuple(
+    'PendingOperation', ['manager', 'entity', 'delete', 'lb_create',
+                         'deadline', 'registered'])
+
+
+class LoadBalancerPoll(object):
+    """The pending operations of a load balancer and when to poll it."""
+
+    def __init__(self, loadbalancer, next_poll, interval):
+        self.loadbalancer = loadbalancer
+        self.operations = []
+        self.next_poll = next_poll
+        self.interval = interval
+
+
+class StatusPoller(object):
+    """Polls Octavia for the operations in progress, one GET per LB."""
+
+    def __init__(self, driver):
+        self.driver = driver
+        # load balancer id -> LoadBalancerPoll
+        self._polls = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        # seconds taken by the last GET of a load balancer
+        self.poll_latency = None
+
+    @property
+    def queue_depth(self):
+        """Number of operations waiting for Octavia."""
+        with self._lock:
+            return sum(len(poll.operations) for poll in self._polls.values())
+
+    def register(self, manager, entity, delete=False, lb_create=False):
+        """Waits for an operation on entity to complete in Octavia.
+
+        The manager is told about the outcome with successful_completion or
+        failed_completion once the root load balancer of entity is no longer
+        busy, or once request_poll_timeout expires.
+        """
+        now = time.time()
+        loadbalancer = entity.root_loadbalancer
+        operation = PendingOperation(
+            manager, entity, delete, lb_create,
+            now + cfg.CONF.octavia.request_poll_timeout, now)
+        first_poll, interval = self._get_schedule(now)
+        with self._lock:
+            poll = self._polls.get(loadbalancer.id)
+            if poll is None:
+                poll = self._polls[loadbalancer.id] = LoadBalancerPoll(
+                    loadbalancer, first_poll, interval)
+            poll.operations.append(operation)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.setDaemon(True)
+                self._thread.start()
+        self._wakeup.set()
+
+    @staticmethod
+    def _get_schedule(now):
+        """Returns the first poll and the interval for new operations."""
+        if cfg.CONF.octavia.event_driven_completion:
+            interval = cfg.CONF.octavia.event_poll_interval
+            return now + interval, interval
+        return now, cfg.CONF.octavia.request_poll_interval
+
+    def notify(self, lb_id, provisioning_status):
+        """Polls a load balancer for which Octavia streamed a final status.
+
+        The streamed events are not timestamped, so an event may predate an
+        operation registered since. Instead of resolving the operations, it
+        brings the next poll forward, which only completes the operations
+        registered before its GET.
+        """
+        if provisioning_status not in FINAL_STATUSES:
+            return
+        with self._lock:
+            poll = self._polls.get(lb_id)
+            if poll is None:
+                return
+            poll.next_poll = 0
+        LOG.debug("Octavia streamed provisioning status %(status)s for load "
+                  "balancer %(lb)s", {'status': provisioning_status,
+                                      'lb': lb_id})
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                delay = self.poll()
+            except Exception:
+                LOG.exception(_LE('Unexpected error while polling Octavia'))
+                delay = cfg.CONF.octavia.request_poll_interval
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def poll(self, now=None):
+        """Polls the load balancers which are due.
+
+        :returns: the seconds until the next poll is due, or None if no
+                  operation is pending
+        """
+        now = now or time.time()
+        with self._lock:
+            due = [poll for poll in self._polls.values()
+                   if poll.next_poll <= now]
+        for poll in due:
+            self._poll(poll, now)
+        with self._lock:
+            if not self._polls:
+                return None
+            next_poll = min(poll.next_poll for poll in self._polls.values())
+        return max(next_poll - time.time(), 0)
+
+    def _poll(self, poll, now):
+        lb_id = poll.loadbalancer.id
+        start = time.time()
+        try:
+            octavia_lb = self.driver.load_balancer.get(poll.loadbalancer)
+        except Exception:
+            LOG.exception(_LE('Unable to get load balancer %s from Octavia'),
+                          lb_id)
+            octavia_lb = {}
+        self.poll_latency = time.time() - start
+        prov_status = octavia_lb.get('provisioning_status')
+        LOG.debug("Octavia reports load balancer %(lb)s has provisioning "
+                  "status of %(status)s (%(latency).3fs, %(depth)d pending "
+                  "operations)",
+                  {'lb': lb_id, 'status': prov_status,
+                   'latency': self.poll_latency,
+                   'depth': len(poll.operations)})
+
+        with self._lock:
+            if self._polls.get(lb_id) is not poll:
+                # resolved by a streamed event meanwhile
+                return
+            if prov_status in FINAL_STATUSES:
+                # the operations registered during the GET are not
+                # reflected by its response
+                expired = []
+                completed = [op for op in poll.operations
+                             if op.registered <= start]
+                poll.operations = [op for op in poll.operations
+                                   if op.registered > start]
+                if poll.operations:
+                    poll.next_poll, poll.interval = self._get_schedule(now)
+                else:
+                    del self._polls[lb_id]
+            else:
+                completed = []
+                expired = [op for op in poll.operations if op.deadline <= now]
+                poll.operations = [op for op in poll.operations
+                                   if op.deadline > now]
+                if poll.operations:
+                    poll.next_poll = now + poll.interval
+                    poll.interval = min(
+                        poll.interval * BACKOFF_FACTOR,
+                        max(cfg.CONF.octavia.request_poll_max_interval,
+                            poll.interval))
+                else:
+                    del self._polls[lb_id]
+
+        if expired:
+            LOG.debug("Timeout has expired for load balancer %(lb)s to "
+                      "complete %(count)d operations. The last reported "
+                      "status was %(status)s",
+                      {'lb': lb_id, 'count': len(expired),
+                       'status': prov_status})
+        context = ncontext.get_admin_context()
+        for operation in completed:
+            self._complete(context, operation, octavia_lb,
+                           prov_status != 'ERROR')
+        for operation in expired:
+            self._complete(context, operation, octavia_lb, False)
+
+    def _complete(self, context, operation, octavia_lb, success):
+        manager, entity = operation.manager, operation.entity
+        try:
+            if not success:
+                manager.failed_completion(context, entity)
+                return
+            kwargs = {'delete': operation.delete}
+            if manager.driver.allocates_vip and operation.lb_create:
+                kwargs['lb_create'] = operation.lb_create
+                # TODO(blogan): drop fk constraint on vip_port_id to ports
+                # table because the port can't be removed unless the load
+                # balancer has been deleted.  Until then we won't populate the
+                # vip_port_id field.
+                # entity.vip_port_id = octavia_lb.get('vip').get('port_id')
+                entity.vip_address = octavia_lb.get('vip').get('ip_address')
+            manager.successful_completion(context, entity, **kwargs)
+        except Exception:
+            LOG.exception(_LE('Unable to complete an operation on %s'),
+                          entity.id)
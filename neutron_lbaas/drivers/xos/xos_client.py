@@ -1,24 +1,104 @@
+import collections
+import copy
+import re
+import threading
+import time
+
 import requests
+from requests import adapters
 
+from neutron_lbaas._i18n import _
 from neutron_lbaas.common.exceptions import LbaasException
-from oslo_log import helpers as log_helpers
+from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_serialization import base64
 from oslo_serialization import jsonutils
 
 LOG = logging.getLogger(__name__)
 
+OPTS = [
+    cfg.IntOpt(
+        'request_pool_size',
+        default=10,
+        help=_('Maximum number of connections to XOS kept open for reuse.'),
+    ),
+    cfg.FloatOpt(
+        'request_connect_timeout',
+        default=5,
+        help=_('Seconds to wait for a connection to XOS.'),
+    ),
+    cfg.FloatOpt(
+        'request_read_timeout',
+        default=30,
+        help=_('Seconds to wait for XOS to answer a request.'),
+    ),
+    cfg.IntOpt(
+        'request_max_retries',
+        default=3,
+        help=_('Number of times a GET, PUT or DELETE request is retried when '
+               'XOS cannot be reached or answers with a server error.'),
+    ),
+    cfg.FloatOpt(
+        'request_retry_backoff',
+        default=0.5,
+        help=_('Seconds to wait before the first retry of a request, the '
+               'delay doubles with each retry.'),
+    ),
+]
+
+cfg.CONF.register_opts(OPTS, 'xos')
+
+IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
+# Number of GET bodies kept per client for revalidation
+CACHE_SIZE = 256
+# Path segments holding an id, they are left out of the latency counters
+ID_SEGMENT_RE = re.compile(r'/[^/]*\d[^/]*(?=/|$)')
+
+# endpoint -> requests.Session shared by the clients of that endpoint
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_session(endpoint):
+    with _sessions_lock:
+        session = _sessions.get(endpoint)
+        if session is None:
+            session = _sessions[endpoint] = requests.Session()
+            adapter = adapters.HTTPAdapter(
+                pool_maxsize=cfg.CONF.xos.request_pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        return session
+
+
 class XOSClient(object):
+    """Client of the XOS REST API.
+
+    The clients of an endpoint share a pooled session, so connections to
+    XOS are kept alive and reused. Idempotent requests are retried with an
+    exponential backoff when XOS cannot be reached or fails, and the bodies
+    of GET requests are revalidated with their ETag or Last-Modified header.
+    """
 
     def __init__(self, endpoint=None, base_url=None, user=None, password=None):
         if not (endpoint or user or password or base_url):
-            LbaasException('XOS client failed: missing arguments')
+            raise LbaasException('XOS client failed: missing arguments')
 
         self.base_url = endpoint + base_url
         self.auth = base64.encode_as_text('%s:%s' % (user, password))
         self.auth = self.auth.replace('\n', '')
-        LOG.debug('XOS client initialized, endpoint:%s %s:%s',
-                  self.base_url, user, password)
+        self.session = _get_session(endpoint)
+        # url -> (validator headers, body) of the last GET, least recently
+        # used first. The bodies are copied in and out of the cache, so the
+        # callers may change the bodies they get.
+        self._cache = collections.OrderedDict()
+        # 'METHOD endpoint' -> [requests, errors, total seconds, max seconds]
+        self.latency = {}
+        # the client is shared by the threads of the driver, the lock
+        # guards the cache and the latency counters
+        self._lock = threading.Lock()
+        LOG.debug('XOS client initialized, endpoint:%s user:%s',
+                  self.base_url, user)
 
     def get(self, url):
         return self._request('GET', url)
@@ -32,24 +112,89 @@ class XOSClient(object):
     def delete(self, url):
         self._request('DELETE', url)
 
-    @log_helpers.log_method_call
+    def _record_latency(self, method, url, latency, failed):
+        key = '%s %s' % (method, ID_SEGMENT_RE.sub('/{id}',
+                                                   url.split('?', 1)[0]))
+        with self._lock:
+            counters = self.latency.setdefault(key, [0, 0, 0.0, 0.0])
+            counters[0] += 1
+            counters[1] += int(failed)
+            counters[2] += latency
+            counters[3] = max(counters[3], latency)
+
+    def _send(self, method, url, data, headers):
+        retries = cfg.CONF.xos.request_max_retries if (
+            method in IDEMPOTENT_METHODS) else 0
+        timeout = (cfg.CONF.xos.request_connect_timeout,
+                   cfg.CONF.xos.request_read_timeout)
+        attempt = 0
+        while True:
+            start = time.time()
+            r = None
+            try:
+                r = self.session.request(method,
+                                         '%s%s' % (self.base_url, url),
+                                         data=data, headers=headers,
+                                         timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= retries:
+                    self._record_latency(method, url, time.time() - start,
+                                         True)
+                    raise
+            latency = time.time() - start
+            failed = r is None or r.status_code >= 500
+            self._record_latency(method, url, latency, failed)
+            LOG.debug('XOS %(method)s %(url)s: %(code)s in %(latency).3fs',
+                      {'method': method, 'url': url,
+                       'code': r.status_code if r is not None else None,
+                       'latency': latency})
+            if attempt >= retries or not failed:
+                return r
+            time.sleep(cfg.CONF.xos.request_retry_backoff * 2 ** attempt)
+            attempt += 1
+
     def _request(self, method, url, data=None, headers=None):
+        url = str(url)
         if data:
             data = jsonutils.dumps(data)
 
-        if not headers:
-            headers = {'Content-type': 'application/json'}
+        headers = dict(headers or {'Content-type': 'application/json'})
         headers['Authorization'] = 'Basic %s' % self.auth
 
-        r = requests.request(method,
-                            '%s%s' % (self.base_url, str(url)),
-                            data=data,
-                            headers=headers)
+        with self._lock:
+            cached = self._cache.pop(url, None) if method == 'GET' else None
+            if cached:
+                self._cache[url] = cached
+                headers.update(cached[0])
+            elif method != 'GET':
+                # the cached bodies of the resource and its collection are
+                # stale
+                for cached_url in list(self._cache):
+                    if cached_url.startswith(url) or url.startswith(
+                            cached_url.split('?', 1)[0]):
+                        self._cache.pop(cached_url, None)
+
+        r = self._send(method, url, data, headers)
 
         if method == 'DELETE' and r.status_code == 404:
             return
+        if cached and r.status_code == 304:
+            return copy.deepcopy(cached[1])
 
         if not r.ok:
             r.raise_for_status()
-        return r.json() if r.status_code != 204 else {}
-
+        body = r.json() if r.status_code != 204 else {}
+        if method == 'GET':
+            validators = {}
+            if r.headers.get('ETag'):
+                validators['If-None-Match'] = r.headers['ETag']
+            if r.headers.get('Last-Modified'):
+                validators['If-Modified-Since'] = r.headers['Last-Modified']
+            if validators:
+                cached = (validators, copy.deepcopy(body))
+                with self._lock:
+                    self._cache.pop(url, None)
+                    if len(self._cache) >= CACHE_SIZE:
+                        self._cache.popitem(last=False)
+                    self._cache[url] = cached
+        return body
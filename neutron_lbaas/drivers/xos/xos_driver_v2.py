@@ -1,10 +1,8 @@
-from datetime import datetime
-import threading
-import time
-
+from neutron_lbaas._i18n import _
 from neutron_lbaas.drivers import driver_base
 from neutron_lbaas.drivers.xos import xos_client
 from neutron_lbaas.drivers.xos import xos_network
+from neutron_lbaas.drivers.xos import xos_reconciler
 
 from oslo_config import cfg
 from oslo_log import log as logging
@@ -66,6 +64,7 @@ class XOSDriver(driver_base.LoadBalancerBaseDriver):
         self.pool = PoolManager(self)
         self.member = MemberManager(self)
         self.health_monitor = HealthMonitorManager(self)
+        self.reconciler = xos_reconciler.XOSReconciler(self)
         LOG.info('XOS LBaaS driver initialized')
 
     @property
@@ -116,12 +115,26 @@ class LoadBalancerManager(driver_base.BaseLoadBalancerManager):
         LOG.debug("returning loadbalancer args: %s", args)
         return args
 
-    def _get_vip_port_id(self, context, vip_subnet_id, vip_address):
-        filters = {'fixed_ips': {'ip_address': [vip_address],
-                                 'subnet_id': [vip_subnet_id]}}
-        vip_ports = self.driver.plugin.db._core_plugin.get_ports(context, filters=filters)
-        vip_port = vip_ports[0] if vip_ports and len(vip_ports) == 1 else None
-        return vip_port.get('id') if vip_port else None
+    def get_vip_port_ids(self, context, vips):
+        """Finds the ports of VIPs with a single port query.
+
+        :param vips: list of (subnet id, ip address)
+        :returns: dict of (subnet id, ip address) -> port id
+        """
+        filters = {'fixed_ips': {
+            'ip_address': list(set(vip[1] for vip in vips)),
+            'subnet_id': list(set(vip[0] for vip in vips))}}
+        ports = self.driver.plugin.db._core_plugin.get_ports(
+            context, filters=filters, fields=['id', 'fixed_ips'])
+        wanted = set(vips)
+        port_ids = {}
+        for port in ports:
+            for ip in port['fixed_ips']:
+                vip = (ip['subnet_id'], ip['ip_address'])
+                if vip in wanted:
+                    # an address shared by several ports is ambiguous
+                    port_ids[vip] = None if vip in port_ids else port['id']
+        return port_ids
 
     def _ensure_xos_network(self, context, lb):
         s = self.driver.plugin.db._core_plugin.get_subnet(context, lb.vip_subnet_id)
@@ -133,31 +146,6 @@ class LoadBalancerManager(driver_base.BaseLoadBalancerManager):
                                          gateway_ip=s.get('gateway_ip'))
         return self.driver.xos_network.create(xos_net)
 
-    def _thread_op(self, context, lb, xos_lb_id):
-        poll_interval = cfg.CONF.xos.request_poll_interval
-        poll_timeout = cfg.CONF.xos.request_poll_timeout
-
-        start_dt = datetime.now()
-        while (datetime.now() - start_dt).seconds < poll_timeout:
-            r = self.driver.load_balancer.get(xos_lb_id)
-            xos_lb = r.get('loadbalancer')
-            vip_address = xos_lb.get('vip_address')
-         
-            if self.driver.allocates_vip and vip_address and vip_address != '0.0.0.0':
-                lb.vip_port_id = \
-                    self._get_vip_port_id(context,
-                                          lb.vip_subnet_id,
-                                          vip_address)
-                lb.vip_address = vip_address
-                kwargs = {'lb_create': True}
-                self.successful_completion(context, lb, **kwargs)
-                return
-            time.sleep(poll_interval)
-
-        LOG.debug("Timeout has expired for load balancer {0} to complete an "
-                  "operation.".format(lb.id))
-        self.failed_completion(context, lb)
-
     def create_and_allocate_vip(self, context, lb):
         self.create(context, lb)
 
@@ -168,10 +156,7 @@ class LoadBalancerManager(driver_base.BaseLoadBalancerManager):
         self.driver.plugin.db.update_loadbalancer(
             context, lb.id, {'description': xos_lb_id})
 
-        thread = threading.Thread(target=self._thread_op,
-                                  args=(context, lb, xos_lb_id))
-        thread.setDaemon(True)
-        thread.start()
+        self.driver.reconciler.register(lb, xos_lb_id)
         LOG.info("created xos loadbalancer :%s", lb.name)
 
     def delete(self, context, lb):
@@ -194,6 +179,20 @@ class LoadBalancerManager(driver_base.BaseLoadBalancerManager):
     def get(self, xos_lb_id):
         return self.driver.client.get(self._url(xos_lb_id))
 
+    def list(self):
+        """Lists the XOS load balancers.
+
+        XOS wraps the list in 'loadbalancers' as it wraps a single load
+        balancer in 'loadbalancer'.
+
+        :raises ValueError: if XOS answers with anything else
+        """
+        r = self.driver.client.get(self._url())
+        xos_lbs = r.get('loadbalancers') if isinstance(r, dict) else None
+        if not isinstance(xos_lbs, list):
+            raise ValueError('Unexpected XOS load balancer list: %s' % r)
+        return xos_lbs
+
     def delete_pool(self, lb, xos_pool_id):
         xos_lb_id = lb.description
         xos_lb = self.get(xos_lb_id).get('loadbalancer')
@@ -1,3 +1,7 @@
+import threading
+import time
+
+from neutron_lbaas._i18n import _
 from neutron_lbaas.drivers.xos import xos_client
 
 from oslo_config import cfg
@@ -37,6 +41,12 @@ OPTS = [
         default=1,
         help=_('Network template ID for Kuryr type network.')
     ),
+    cfg.IntOpt(
+        'network_cache_ttl',
+        default=300,
+        help=_('Seconds an XOS network and its slice are remembered after '
+               'they were found or created. 0 disables the cache.')
+    ),
 ]
 
 cfg.CONF.register_opts(OPTS, 'xos')
@@ -58,6 +68,12 @@ class XOSNetwork(object):
 
 
 class XOSNetworkManager(object):
+    """Ensures the XOS networks of the VIPs and their slices exist.
+
+    The networks known to exist are cached for network_cache_ttl seconds,
+    keyed by (network name, owner slice). Concurrent creates for the same
+    network wait for the first one instead of querying XOS.
+    """
 
     def __init__(self):
         self.client = xos_client.XOSClient(
@@ -66,11 +82,54 @@ class XOSNetworkManager(object):
             cfg.CONF.xos.user,
             cfg.CONF.xos.password
         )
+        # (network name, slice name) -> expiration time
+        self._cache = {}
+        # (network name, slice name) -> lock of the create in progress
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     def create(self, xos_net):
+        slice_name = '%s_%s' % (cfg.CONF.xos.site_name, xos_net.name)
+        key = (xos_net.name, slice_name)
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        try:
+            with lock:
+                with self._lock:
+                    hit = self._cache.get(key, 0) > time.time()
+                    if hit:
+                        self.cache_hits += 1
+                    else:
+                        self.cache_misses += 1
+                if not hit:
+                    self._create(xos_net, slice_name)
+                    ttl = cfg.CONF.xos.network_cache_ttl
+                    if ttl > 0:
+                        with self._lock:
+                            self._cache[key] = time.time() + ttl
+        finally:
+            # the waiters hold the lock already, a failed create is retried
+            # by them
+            with self._lock:
+                self._locks.pop(key, None)
+        LOG.debug('XOS network %(name)s of slice %(slice)s exists, network '
+                  'cache hits: %(hits)d, misses: %(misses)d',
+                  {'name': xos_net.name, 'slice': slice_name,
+                   'hits': self.cache_hits, 'misses': self.cache_misses})
+        return slice_name
+
+    def invalidate(self, net_name=None):
+        """Forgets the cached networks named net_name, or all of them."""
+        with self._lock:
+            for key in list(self._cache):
+                if net_name is None or key[0] == net_name:
+                    del self._cache[key]
+
+    def _create(self, xos_net, slice_name):
         endpoint = '%sapi/core' % cfg.CONF.xos.endpoint
 
-        slice_name = '%s_%s' % (cfg.CONF.xos.site_name, xos_net.name)
         slice_id = self._get_slice(slice_name)
         if not slice_id:
             slice_args = {
@@ -102,8 +161,6 @@ class XOSNetworkManager(object):
             r = self.client.post('api/core/networks/', network_args)
             LOG.info('created xos network %s', r)
 
-        return slice_name
-
     def _get_slice(self, slice_name):
         r = self.client.get('api/core/slices/?name=%s' % slice_name)
         return r[0].get('id') if len(r) == 1 else None
@@ -114,4 +171,4 @@ class XOSNetworkManager(object):
 
     def delete(self, net_name):
         # need xos specific id to remove
-        pass
+        self.invalidate(net_name)
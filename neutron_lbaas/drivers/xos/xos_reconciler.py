@@ -0,0 +1,140 @@
+import collections
+import threading
+import time
+
+from neutron import context as ncontext
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from neutron_lbaas._i18n import _LE
+
+
+LOG = logging.getLogger(__name__)
+
+PendingLoadBalancer = collections.namedtuple(
+    'PendingLoadBalancer', ['loadbalancer', 'registered', 'deadline'])
+
+
+class XOSReconciler(object):
+    """Completes the load balancers waiting for XOS to allocate a VIP.
+
+    All the pending load balancers are resolved from a single list of the
+    XOS load balancers per request_poll_interval, and their VIP ports from a
+    single port query. They are retrieved one by one when XOS cannot list
+    them.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        # xos load balancer id -> PendingLoadBalancer
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        # seconds between the creation and the completion of the last load
+        # balancer resolved
+        self.lag = None
+
+    @property
+    def pending(self):
+        """Number of load balancers waiting for XOS."""
+        with self._lock:
+            return len(self._pending)
+
+    def register(self, lb, xos_lb_id):
+        now = time.time()
+        with self._lock:
+            self._pending[xos_lb_id] = PendingLoadBalancer(
+                lb, now, now + cfg.CONF.xos.request_poll_timeout)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.setDaemon(True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            delay = cfg.CONF.xos.request_poll_interval
+            try:
+                if self.reconcile() is None:
+                    delay = None
+            except Exception:
+                LOG.exception(_LE('Unexpected error while reconciling XOS '
+                                  'load balancers'))
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def _get_xos_loadbalancers(self, pending):
+        manager = self.driver.load_balancer
+        try:
+            return manager.list()
+        except Exception:
+            LOG.exception(_LE('Unable to list the XOS load balancers, '
+                              'getting the pending ones one by one'))
+        xos_lbs = []
+        for xos_lb_id in pending:
+            try:
+                xos_lbs.append(manager.get(xos_lb_id)['loadbalancer'])
+            except Exception:
+                LOG.exception(_LE('Unable to get XOS load balancer %s'),
+                              xos_lb_id)
+        return xos_lbs
+
+    def reconcile(self, now=None):
+        """Resolves the pending load balancers from one list of XOS.
+
+        :returns: the number of load balancers still pending, or None if
+                  there are none
+        """
+        now = now or time.time()
+        with self._lock:
+            pending = dict(self._pending)
+        if not pending:
+            return None
+
+        vips = {}
+        for xos_lb in self._get_xos_loadbalancers(pending):
+            xos_lb_id = xos_lb.get('loadbalancer_id')
+            vip_address = xos_lb.get('vip_address')
+            if (xos_lb_id in pending and self.driver.allocates_vip and
+                    vip_address and vip_address != '0.0.0.0'):
+                vips[xos_lb_id] = vip_address
+        expired = [xos_lb_id for xos_lb_id, p in pending.items()
+                   if xos_lb_id not in vips and p.deadline <= now]
+
+        with self._lock:
+            for xos_lb_id in list(vips) + expired:
+                self._pending.pop(xos_lb_id, None)
+            remaining = len(self._pending)
+
+        context = ncontext.get_admin_context()
+        manager = self.driver.load_balancer
+        if vips:
+            port_ids = manager.get_vip_port_ids(
+                context, [(pending[xos_lb_id].loadbalancer.vip_subnet_id,
+                           vip_address)
+                          for xos_lb_id, vip_address in vips.items()])
+        for xos_lb_id, vip_address in vips.items():
+            lb = pending[xos_lb_id].loadbalancer
+            lb.vip_port_id = port_ids.get((lb.vip_subnet_id, vip_address))
+            lb.vip_address = vip_address
+            self.lag = time.time() - pending[xos_lb_id].registered
+            try:
+                manager.successful_completion(context, lb, lb_create=True)
+            except Exception:
+                LOG.exception(_LE('Unable to complete load balancer %s'),
+                              lb.id)
+        for xos_lb_id in expired:
+            lb = pending[xos_lb_id].loadbalancer
+            LOG.debug("Timeout has expired for load balancer %s to complete "
+                      "an operation.", lb.id)
+            try:
+                manager.failed_completion(context, lb)
+            except Exception:
+                LOG.exception(_LE('Unable to fail load balancer %s'), lb.id)
+        if vips or expired:
+            LOG.debug('Reconciled %(done)d XOS load balancers, %(left)d '
+                      'pending, lag %(lag)s',
+                      {'done': len(vips) + len(expired), 'left': remaining,
+                       'lag': self.lag})
+        return remaining or None
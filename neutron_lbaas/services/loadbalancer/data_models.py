@@ -29,6 +29,7 @@ from neutron.db.models import servicetype as servicetype_db
 from neutron.db import models_v2
 from neutron_lib.db import model_base
 import six
+import sqlalchemy as sa
 from sqlalchemy.ext import orderinglist
 from sqlalchemy.orm import collections
 
@@ -42,21 +43,62 @@ class BaseDataModel(object):
     # implementation. That would require handling custom default values though.
     fields = []
 
+    # Subclasses holding large numbers of instances declare their fields as
+    # __slots__ so that instances do not carry a per instance __dict__.
+    __slots__ = ()
+
+    def _get_attr_names(self):
+        cls = self.__class__
+        names = _SLOT_NAMES.get(cls)
+        if names is None:
+            names = []
+            for klass in reversed(cls.__mro__):
+                names.extend(slot for slot in vars(klass).get('__slots__', ())
+                             if not slot.startswith('_'))
+            _SLOT_NAMES[cls] = names
+        if hasattr(self, '__dict__'):
+            return names + list(self.__dict__)
+        return names
+
     def to_dict(self, **kwargs):
+        return self._to_dict({}, kwargs)
+
+    def _to_dict(self, calling_classes, filters):
+        # Data models may reference each other in cycles (a listener points
+        # to its load balancer which lists the listener again), so stop
+        # descending once a class has been seen twice on the current path.
+        # calling_classes counts the classes on that path and is shared by
+        # the whole walk instead of being copied at every hop.
+        cls = self.__class__
+        calling_classes[cls] = calling_classes.get(cls, 0) + 1
+        try:
+            return self._to_dict_attrs(calling_classes, filters)
+        finally:
+            calling_classes[cls] -= 1
+
+    def _to_dict_attrs(self, calling_classes, filters):
         ret = {}
-        for attr in self.__dict__:
-            if attr.startswith('_') or not kwargs.get(attr, True):
+        for attr in self._get_attr_names():
+            if attr.startswith('_') or not filters.get(attr, True):
+                continue
+            try:
+                value = getattr(self, attr)
+            except AttributeError:
+                # Unset slot
                 continue
-            value = self.__dict__[attr]
-            if isinstance(getattr(self, attr), list):
+            if isinstance(value, list):
                 ret[attr] = []
                 for item in value:
                     if isinstance(item, BaseDataModel):
-                        ret[attr].append(item.to_dict())
+                        if calling_classes.get(item.__class__, 0) < 2:
+                            ret[attr].append(
+                                item._to_dict(calling_classes, {}))
                     else:
                         ret[attr] = item
-            elif isinstance(getattr(self, attr), BaseDataModel):
-                ret[attr] = value.to_dict()
+            elif isinstance(value, BaseDataModel):
+                ret[attr] = None
+                if calling_classes.get(value.__class__, 0) < 2:
+                    ret[attr] = value._to_dict(calling_classes, {})
             elif six.PY2 and isinstance(value, six.text_type):
                 ret[attr.encode('utf8')] = value.encode('utf8')
             else:
@@ -73,49 +115,74 @@ class BaseDataModel(object):
         return cls(**fields)
 
     @classmethod
-    def from_sqlalchemy_model(cls, sa_model, calling_classes=None):
-        calling_classes = calling_classes or []
-        attr_mapping = vars(cls).get("attr_mapping")
-        instance = cls()
-        for attr_name in cls.fields:
-            if attr_name.startswith('_'):
-                continue
-            if attr_mapping and attr_name in attr_mapping.keys():
-                attr = getattr(sa_model, attr_mapping[attr_name])
-            elif hasattr(sa_model, attr_name):
-                attr = getattr(sa_model, attr_name)
-            else:
-                continue
-            # Handles M:1 or 1:1 relationships
-            if isinstance(attr, model_base.BASEV2):
-                if hasattr(instance, attr_name):
-                    data_class = SA_MODEL_TO_DATA_MODEL_MAP[attr.__class__]
-                    # Don't recurse down object classes too far. If we have
-                    # seen the same object class more than twice, we are
-                    # probably in a loop.
-                    if data_class and calling_classes.count(data_class) < 2:
-                        setattr(instance, attr_name,
-                                data_class.from_sqlalchemy_model(
-                                    attr,
-                                    calling_classes=calling_classes + [cls]))
-            # Handles 1:M or N:M relationships
-            elif (isinstance(attr, collections.InstrumentedList) or
-                 isinstance(attr, orderinglist.OrderingList)):
-                for item in attr:
+    def from_sqlalchemy_model(cls, sa_model):
+        """Converts sa_model and everything reachable from it.
+
+        Every SQLAlchemy object is converted exactly once: objects reached
+        again through another relationship (a pool seen as a load balancer
+        pool, a listener default pool and an L7 redirect pool) resolve to
+        the same data model instance, and reference cycles are wired up by
+        reference.  The graph is walked with an explicit stack so its depth
+        does not matter.
+        """
+        converted = {}
+        pending = []
+
+        def _convert(data_class, sa_obj):
+            # SQLAlchemy keeps a single object per row in a session, so the
+            # object identity is used as the identity map key.  The SQLAlchemy
+            # object is kept in the map so its id cannot be reused meanwhile.
+            key = (data_class, id(sa_obj))
+            if key not in converted:
+                instance = data_class()
+                converted[key] = (sa_obj, instance)
+                pending.append((instance, sa_obj))
+            return converted[key][1]
+
+        root = _convert(cls, sa_model)
+        while pending:
+            instance, sa_obj = pending.pop()
+            attr_mapping = vars(instance.__class__).get("attr_mapping")
+            for attr_name in instance.fields:
+                if attr_name.startswith('_'):
+                    continue
+                if attr_mapping and attr_name in attr_mapping:
+                    attr = getattr(sa_obj, attr_mapping[attr_name])
+                elif hasattr(sa_obj, attr_name):
+                    attr = getattr(sa_obj, attr_name)
+                else:
+                    continue
+                # Handles M:1 or 1:1 relationships
+                if isinstance(attr, model_base.BASEV2):
                     if hasattr(instance, attr_name):
-                        data_class = SA_MODEL_TO_DATA_MODEL_MAP[item.__class__]
-                        # Don't recurse down object classes too far. If we have
-                        # seen the same object class more than twice, we are
-                        # probably in a loop.
-                        if (data_class and
-                            calling_classes.count(data_class) < 2):
-                            attr_list = getattr(instance, attr_name) or []
-                            attr_list.append(data_class.from_sqlalchemy_model(
-                                item, calling_classes=calling_classes + [cls]))
-                            setattr(instance, attr_name, attr_list)
-            # This isn't a relationship so it must be a "primitive"
-            else:
-                setattr(instance, attr_name, attr)
+                        data_class = SA_MODEL_TO_DATA_MODEL_MAP[
+                            attr.__class__]
+                        setattr(instance, attr_name,
+                                _convert(data_class, attr))
+                # Handles 1:M or N:M relationships
+                elif (isinstance(attr, collections.InstrumentedList) or
+                      isinstance(attr, orderinglist.OrderingList)):
+                    if hasattr(instance, attr_name) and attr:
+                        setattr(instance, attr_name, [
+                            _convert(SA_MODEL_TO_DATA_MODEL_MAP[
+                                item.__class__], item)
+                            for item in attr])
+                # This isn't a relationship so it must be a "primitive"
+                else:
+                    setattr(instance, attr_name, attr)
+        return root
+
+    @classmethod
+    def from_sqlalchemy_columns(cls, sa_model):
+        """Instantiates a data model from the column values of sa_model.
+
+        Relationships are not followed, so no lazy loads are triggered.  This
+        is meant for callers that load related rows themselves and wire the
+        resulting data models together.
+        """
+        instance = cls()
+        for attr_name in _get_column_fields(cls, sa_model.__class__):
+            setattr(instance, attr_name, getattr(sa_model, attr_name))
         return instance
 
     @property
@@ -139,6 +206,22 @@ class BaseDataModel(object):
         return lb
 
 
+_SLOT_NAMES = {}
+_COLUMN_FIELDS = {}
+
+
+def _get_column_fields(data_class, sa_class):
+    """Returns the fields of data_class that are plain columns of sa_class."""
+    key = (data_class, sa_class)
+    if key not in _COLUMN_FIELDS:
+        mapper = sa.inspect(sa_class)
+        columns = set(mapper.column_attrs.keys())
+        columns.update(mapper.synonyms.keys())
+        _COLUMN_FIELDS[key] = [field for field in data_class.fields
+                               if field in columns]
+    return _COLUMN_FIELDS[key]
+
+
 # NOTE(brandon-logan) AllocationPool, HostRoute, Subnet, IPAllocation, Port,
 # and ProviderResourceAssociation are defined here because there aren't any
 # data_models defined in core neutron or neutron services.  Instead of jumping
@@ -336,6 +419,7 @@ class HealthMonitor(BaseDataModel):
               'http_method', 'url_path', 'expected_codes',
               'provisioning_status', 'admin_state_up', 'pool', 'name',
               'max_retries_down']
+    __slots__ = fields
 
     def __init__(self, id=None, tenant_id=None, type=None, delay=None,
                  timeout=None, max_retries=None, http_method=None,
@@ -389,6 +473,7 @@ class Pool(BaseDataModel):
               'provisioning_status', 'members', 'healthmonitor',
               'session_persistence', 'loadbalancer_id', 'loadbalancer',
               'listener', 'listeners', 'l7_policies']
+    __slots__ = fields + ['sessionpersistence']
 
     # Map deprecated attribute names to new ones.
     attr_mapping = {'sessionpersistence': 'session_persistence'}
@@ -429,7 +514,8 @@ class Pool(BaseDataModel):
         ret_dict = super(Pool, self).to_dict(
             provisioning_status=False, operating_status=False,
             healthmonitor=False, session_persistence=False,
-            loadbalancer_id=False, loadbalancer=False, listener_id=False)
+            loadbalancer_id=False, loadbalancer=False, listener_id=False,
+            members=False, listeners=False, l7_policies=False)
         ret_dict['loadbalancers'] = []
         if self.loadbalancer:
             ret_dict['loadbalancers'].append({'id': self.loadbalancer.id})
@@ -480,6 +566,7 @@ class Member(BaseDataModel):
     fields = ['id', 'tenant_id', 'pool_id', 'address', 'protocol_port',
               'weight', 'admin_state_up', 'subnet_id', 'operating_status',
               'provisioning_status', 'pool', 'name']
+    __slots__ = fields
 
     def __init__(self, id=None, tenant_id=None, pool_id=None, address=None,
                  protocol_port=None, weight=None, admin_state_up=None,
@@ -517,6 +604,7 @@ class Member(BaseDataModel):
 class SNI(BaseDataModel):
 
     fields = ['listener_id', 'tls_container_id', 'position', 'listener']
+    __slots__ = fields
 
     def __init__(self, listener_id=None, tls_container_id=None,
                  position=None, listener=None):
@@ -552,6 +640,7 @@ class L7Rule(BaseDataModel):
     fields = ['id', 'tenant_id', 'l7policy_id', 'type', 'compare_type',
               'invert', 'key', 'value', 'provisioning_status',
               'admin_state_up', 'policy']
+    __slots__ = fields
 
     def __init__(self, id=None, tenant_id=None,
                  l7policy_id=None, type=None, compare_type=None, invert=None,
@@ -595,6 +684,7 @@ class L7Policy(BaseDataModel):
               'action', 'redirect_pool_id', 'redirect_url', 'position',
               'admin_state_up', 'provisioning_status', 'listener', 'rules',
               'redirect_pool']
+    __slots__ = fields
 
     def __init__(self, id=None, tenant_id=None, name=None, description=None,
                  listener_id=None, action=None, redirect_pool_id=None,
@@ -622,7 +712,7 @@ class L7Policy(BaseDataModel):
     def to_api_dict(self):
         ret_dict = super(L7Policy, self).to_dict(
             listener=False, listener_id=True,
-            provisioning_status=False, redirect_pool=False)
+            provisioning_status=False, redirect_pool=False, rules=False)
         ret_dict['listeners'] = []
         if self.listener:
             ret_dict['listeners'].append({'id': self.listener.id})
@@ -652,6 +742,7 @@ class Listener(BaseDataModel):
               'sni_containers', 'protocol_port', 'connection_limit',
               'admin_state_up', 'provisioning_status', 'operating_status',
               'default_pool', 'loadbalancer', 'l7_policies']
+    __slots__ = fields
 
     def __init__(self, id=None, tenant_id=None, name=None, description=None,
                  default_pool_id=None, loadbalancer_id=None, protocol=None,
@@ -685,7 +776,8 @@ class Listener(BaseDataModel):
         ret_dict = super(Listener, self).to_dict(
             loadbalancer=False, loadbalancer_id=False, default_pool=False,
             operating_status=False, provisioning_status=False,
-            sni_containers=False, default_tls_container=False)
+            sni_containers=False, default_tls_container=False,
+            l7_policies=False)
         # NOTE(blogan): Returning a list to future proof for M:N objects
         # that are not yet implemented.
         ret_dict['loadbalancers'] = []
@@ -694,7 +786,6 @@ class Listener(BaseDataModel):
         ret_dict['sni_container_refs'] = [container.tls_container_id
                                           for container in self.sni_containers]
         ret_dict['default_tls_container_ref'] = self.default_tls_container_id
-        del ret_dict['l7_policies']
         ret_dict['l7policies'] = [{'id': l7_policy.id}
             for l7_policy in self.l7_policies]
         return ret_dict
@@ -722,6 +813,7 @@ class LoadBalancer(BaseDataModel):
               'vip_port_id', 'vip_address', 'provisioning_status',
               'operating_status', 'admin_state_up', 'vip_port', 'stats',
               'provider', 'listeners', 'pools', 'flavor_id']
+    __slots__ = fields
 
     def __init__(self, id=None, tenant_id=None, name=None, description=None,
                  vip_subnet_id=None, vip_port_id=None, vip_address=None,
@@ -813,10 +905,9 @@ class LoadBalancer(BaseDataModel):
 
     def to_api_dict(self, full_graph=False):
         ret_dict = super(LoadBalancer, self).to_dict(
-            vip_port=False, stats=False, listeners=False)
+            vip_port=False, stats=False, listeners=False, pools=False)
         if full_graph:
             ret_dict['listeners'] = self._construct_full_graph_api_dict()
-            del ret_dict['pools']
         else:
             ret_dict['listeners'] = [{'id': listener.id}
                                      for listener in self.listeners]
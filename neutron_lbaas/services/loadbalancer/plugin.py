@@ -186,8 +186,8 @@ class LoadBalancerPluginv2(loadbalancerv2.LoadBalancerPluginBaseV2,
 
     def _handle_driver_error(self, context, db_entity):
         lb_id = db_entity.root_loadbalancer.id
-        self.db.update_status(context, models.LoadBalancer, lb_id,
-                              constants.ERROR)
+        self.db.set_statuses(context, models.LoadBalancer, [lb_id],
+                             provisioning_status=constants.ERROR)
 
     def _validate_session_persistence_info(self, sp_info):
         """Performs sanity check on session persistence info.
@@ -1103,11 +1103,13 @@ class LoadBalancerPluginv2(loadbalancerv2.LoadBalancerPluginBaseV2,
 
     def statuses(self, context, loadbalancer_id):
         OS = "operating_status"
-        lb = self.db.get_loadbalancer(context, loadbalancer_id)
+        lb = self.db.get_loadbalancer_status_graph(context, loadbalancer_id)
         if not lb.admin_state_up:
             return {"statuses": self._disable_entity_and_children(lb)}
         lb_status = self._default_status(lb, listeners=[], pools=[])
         statuses = {"statuses": {"loadbalancer": lb_status}}
+        # ids of the pools already in lb_status["pools"]
+        lb_pool_ids = set()
         if self._is_degraded(lb):
             self._set_degraded(lb_status)
         for curr_listener in lb.listeners:
@@ -1154,84 +1156,58 @@ class LoadBalancerPluginv2(loadbalancerv2.LoadBalancerPluginBaseV2,
                     self._disable_entity_and_children(
                         curr_listener.default_pool))
                 continue
-            pool_status = self._default_status(curr_listener.default_pool,
-                                              members=[], healthmonitor={})
+            pool_status = self._pool_status(curr_listener.default_pool,
+                                            listener_status, lb_status)
             listener_status["pools"].append(pool_status)
-            if (pool_status["id"] not in
-                [ps["id"] for ps in lb_status["pools"]]):
+            if pool_status["id"] not in lb_pool_ids:
+                lb_pool_ids.add(pool_status["id"])
                 lb_status["pools"].append(pool_status)
-            if self._is_degraded(curr_listener.default_pool):
-                self._set_degraded(listener_status, lb_status)
-            members = curr_listener.default_pool.members
-            for curr_member in members:
-                if not curr_member.admin_state_up:
-                    pool_status["members"].append(
-                        self._disable_entity_and_children(curr_member))
-                    continue
-                member_opts = {"address": curr_member.address,
-                               "protocol_port": curr_member.protocol_port}
-                member_status = self._default_status(curr_member,
-                                                     **member_opts)
-                pool_status["members"].append(member_status)
-                if self._is_degraded(curr_member):
-                    self._set_degraded(pool_status, listener_status,
-                                       lb_status)
-            healthmonitor = curr_listener.default_pool.healthmonitor
-            if healthmonitor:
-                if not healthmonitor.admin_state_up:
-                    dhm = self._disable_entity_and_children(healthmonitor)
-                    hm_status = dhm
-                else:
-                    hm_status = self._default_status(healthmonitor,
-                                exclude=[OS], type=healthmonitor.type)
-                    if self._is_degraded(healthmonitor, exclude=[OS]):
-                        self._set_degraded(pool_status, listener_status,
-                                           lb_status)
-            else:
-                hm_status = {}
-            pool_status["healthmonitor"] = hm_status
 
         # Needed for pools not associated with a listener
         for curr_pool in lb.pools:
-            if curr_pool.id in [ps["id"] for ps in lb_status["pools"]]:
+            if curr_pool.id in lb_pool_ids:
                 continue
             if not curr_pool.admin_state_up:
                 lb_status["pools"].append(
                     self._disable_entity_and_children(curr_pool))
                 continue
-            pool_status = self._default_status(curr_pool, members=[],
-                                               healthmonitor={})
-            lb_status["pools"].append(pool_status)
-            if self._is_degraded(curr_pool):
-                self._set_degraded(lb_status)
-            members = curr_pool.members
-            for curr_member in members:
-                if not curr_member.admin_state_up:
-                    pool_status["members"].append(
-                        self._disable_entity_and_children(curr_member))
-                    continue
-                member_opts = {"address": curr_member.address,
-                               "protocol_port": curr_member.protocol_port}
-                member_status = self._default_status(curr_member,
-                                                     **member_opts)
-                pool_status["members"].append(member_status)
-                if self._is_degraded(curr_member):
-                    self._set_degraded(pool_status, lb_status)
-            healthmonitor = curr_pool.healthmonitor
-            if healthmonitor:
-                if not healthmonitor.admin_state_up:
-                    dhm = self._disable_entity_and_children(healthmonitor)
-                    pool_status["healthmonitor"] = dhm
-                else:
-                    hm_status = self._default_status(healthmonitor,
-                                exclude=[OS], type=healthmonitor.type)
-                    if self._is_degraded(healthmonitor, exclude=[OS]):
-                        self._set_degraded(pool_status, listener_status,
-                                           lb_status)
+            lb_status["pools"].append(self._pool_status(curr_pool,
+                                                        lb_status))
+        return statuses
+
+    def _pool_status(self, pool, *parents):
+        """Builds the status tree of an enabled pool.
+
+        A degraded pool degrades its parents, a degraded member or health
+        monitor degrades the pool and its parents.
+        """
+        OS = "operating_status"
+        pool_status = self._default_status(pool, members=[],
+                                           healthmonitor={})
+        if self._is_degraded(pool):
+            self._set_degraded(*parents)
+        for curr_member in pool.members:
+            if not curr_member.admin_state_up:
+                pool_status["members"].append(
+                    self._disable_entity_and_children(curr_member))
+                continue
+            member_opts = {"address": curr_member.address,
+                           "protocol_port": curr_member.protocol_port}
+            member_status = self._default_status(curr_member, **member_opts)
+            pool_status["members"].append(member_status)
+            if self._is_degraded(curr_member):
+                self._set_degraded(pool_status, *parents)
+        healthmonitor = pool.healthmonitor
+        if healthmonitor:
+            if not healthmonitor.admin_state_up:
+                hm_status = self._disable_entity_and_children(healthmonitor)
             else:
-                hm_status = {}
+                hm_status = self._default_status(
+                    healthmonitor, exclude=[OS], type=healthmonitor.type)
+                if self._is_degraded(healthmonitor, exclude=[OS]):
+                    self._set_degraded(pool_status, *parents)
             pool_status["healthmonitor"] = hm_status
-        return statuses
+        return pool_status
 
     def _set_degraded(self, *objects):
         for obj in objects:
@@ -14,7 +14,9 @@
 #    under the License.
 
 import copy
+
 import mock
+import oslo_messaging
 
 from neutron_lbaas.agent import agent_api as api
 from neutron_lbaas.tests import base
@@ -57,6 +59,31 @@ class TestApiCache(base.BaseTestCase):
         self._test_method('get_loadbalancer',
                           loadbalancer_id='loadbalancer_id')
 
+    def test_get_loadbalancers_for_agent(self):
+        with mock.patch.object(self.api.client, 'call') as rpc_mock, \
+                mock.patch.object(self.api.client, 'prepare') as prepare_mock:
+            prepare_mock.return_value = self.api.client
+            rpc_mock.return_value = [{'id': 'id1'}]
+            self.assertEqual([{'id': 'id1'}],
+                             self.api.get_loadbalancers_for_agent(
+                                 ['id1'], revisions={'id1': 'rev'}))
+
+        prepare_mock.assert_called_once_with(version='1.3')
+        rpc_mock.assert_called_once_with(mock.sentinel.context,
+                                         'get_loadbalancers_for_agent',
+                                         loadbalancer_ids=['id1'],
+                                         revisions={'id1': 'rev'})
+
+    def test_get_loadbalancers_for_agent_unsupported(self):
+        with mock.patch.object(self.api.client, 'call') as rpc_mock, \
+                mock.patch.object(self.api.client, 'prepare') as prepare_mock:
+            prepare_mock.return_value = self.api.client
+            rpc_mock.side_effect = oslo_messaging.RemoteError('NoSuchMethod')
+            self.assertIsNone(self.api.get_loadbalancers_for_agent(['id1']))
+            self.assertIsNone(self.api.get_loadbalancers_for_agent(['id1']))
+
+        self.assertEqual(1, rpc_mock.call_count)
+
     def test_loadbalancer_destroyed(self):
         self._test_method('loadbalancer_destroyed',
                           loadbalancer_id='loadbalancer_id')
@@ -79,3 +106,113 @@ class TestApiCache(base.BaseTestCase):
     def test_update_loadbalancer_stats(self):
         self._test_method('update_loadbalancer_stats', loadbalancer_id='id',
                           stats='stats')
+
+    def test_update_statuses_bulk(self):
+        with mock.patch.object(self.api.client, 'call') as rpc_mock, \
+                mock.patch.object(self.api.client, 'prepare') as prepare_mock:
+            prepare_mock.return_value = self.api.client
+            self.api.update_statuses_bulk(['status'])
+
+        prepare_mock.assert_called_once_with(version='1.1')
+        rpc_mock.assert_called_once_with(mock.sentinel.context,
+                                         'update_statuses_bulk',
+                                         statuses=['status'])
+
+    def test_update_loadbalancers_stats(self):
+        with mock.patch.object(self.api.client, 'call') as rpc_mock, \
+                mock.patch.object(self.api.client, 'prepare') as prepare_mock:
+            prepare_mock.return_value = self.api.client
+            self.api.update_loadbalancers_stats({'id': 'stats'})
+
+        prepare_mock.assert_called_once_with(version='1.2')
+        rpc_mock.assert_called_once_with(mock.sentinel.context,
+                                         'update_loadbalancers_stats',
+                                         stats={'id': 'stats'})
+
+    def test_update_loadbalancers_stats_fallback(self):
+        with mock.patch.object(self.api.client, 'call') as rpc_mock, \
+                mock.patch.object(self.api.client, 'prepare') as prepare_mock:
+            prepare_mock.return_value = self.api.client
+            rpc_mock.side_effect = [
+                oslo_messaging.RemoteError('UnsupportedVersion'), None, None]
+            self.api.update_loadbalancers_stats({'id': 'stats'})
+            self.api.update_loadbalancers_stats({'id': 'stats'})
+
+        rpc_mock.assert_called_with(mock.sentinel.context,
+                                    'update_loadbalancer_stats',
+                                    loadbalancer_id='id', stats='stats')
+        self.assertEqual(3, rpc_mock.call_count)
+
+
+class TestStatusUpdateBuffer(base.BaseTestCase):
+    def setUp(self):
+        super(TestStatusUpdateBuffer, self).setUp()
+
+        self.api = api.LbaasAgentApi('topic', mock.sentinel.context, 'host',
+                                     status_update_window=1)
+        self.spawn_after = mock.patch.object(api.eventlet,
+                                             'spawn_after').start()
+        self.bulk = mock.patch.object(self.api,
+                                      'update_statuses_bulk').start()
+        self.update_status = mock.patch.object(self.api,
+                                               'update_status').start()
+
+    def test_statuses_are_coalesced_per_object(self):
+        self.api.queue_status_update('member', 'm1',
+                                     provisioning_status='ACTIVE')
+        self.api.queue_status_update('loadbalancer', 'lb1',
+                                     provisioning_status='ACTIVE')
+        self.api.queue_status_update('member', 'm1',
+                                     operating_status='ONLINE')
+        self.api.queue_status_update('loadbalancer', 'lb1',
+                                     provisioning_status='ERROR')
+        self.assertFalse(self.bulk.called)
+        self.assertEqual(1, self.spawn_after.call_count)
+
+        self.api.flush_status_updates()
+
+        self.bulk.assert_called_once_with([
+            {'obj_type': 'member', 'obj_id': 'm1',
+             'provisioning_status': 'ACTIVE', 'operating_status': 'ONLINE'},
+            {'obj_type': 'loadbalancer', 'obj_id': 'lb1',
+             'provisioning_status': 'ERROR', 'operating_status': None}])
+        self.api.flush_status_updates()
+        self.assertEqual(1, self.bulk.call_count)
+
+    def test_no_window_sends_right_away(self):
+        self.api.status_update_window = 0
+        self.api.queue_status_update('member', 'm1',
+                                     provisioning_status='ACTIVE')
+        self.assertEqual(1, self.bulk.call_count)
+        self.assertFalse(self.spawn_after.called)
+
+    def test_fallback_to_update_status(self):
+        self.bulk.side_effect = oslo_messaging.RemoteError(
+            'UnsupportedVersion')
+        self.api.queue_status_update('member', 'm1',
+                                     provisioning_status='ACTIVE')
+        self.api.flush_status_updates()
+        self.api.queue_status_update('member', 'm2',
+                                     provisioning_status='ACTIVE')
+        self.api.flush_status_updates()
+
+        self.assertEqual(1, self.bulk.call_count)
+        self.update_status.assert_has_calls([
+            mock.call(obj_type='member', obj_id='m1',
+                      provisioning_status='ACTIVE', operating_status=None),
+            mock.call(obj_type='member', obj_id='m2',
+                      provisioning_status='ACTIVE', operating_status=None)])
+
+    def test_failed_flush_requeues_statuses(self):
+        self.bulk.side_effect = [oslo_messaging.MessagingTimeout, None]
+        self.api.queue_status_update('member', 'm1',
+                                     provisioning_status='ACTIVE')
+        self.assertRaises(oslo_messaging.MessagingTimeout,
+                          self.api.flush_status_updates)
+        self.api.queue_status_update('member', 'm1',
+                                     operating_status='ONLINE')
+        self.api.flush_status_updates()
+
+        self.bulk.assert_called_with([
+            {'obj_type': 'member', 'obj_id': 'm1',
+             'provisioning_status': 'ACTIVE', 'operating_status': 'ONLINE'}])
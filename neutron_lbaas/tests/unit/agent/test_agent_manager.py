@@ -29,6 +29,8 @@ class TestManager(base.BaseTestCase):
 
         mock_conf = mock.Mock()
         mock_conf.device_driver = ['devdriver']
+        mock_conf.stats_concurrency = 2
+        mock_conf.resync_concurrency = 1
 
         self.mock_importer = mock.patch.object(manager, 'importutils').start()
 
@@ -56,6 +58,10 @@ class TestManager(base.BaseTestCase):
             self.mgr.initialize_service_hook(mock.Mock())
             sync.assert_called_once_with()
 
+    def test_report_rpc_version(self):
+        self.assertEqual(
+            '1.1', self.mgr.agent_state['configurations']['rpc_version'])
+
     def test_periodic_resync_needs_sync(self):
         with mock.patch.object(self.mgr, 'sync_state') as sync:
             self.mgr.needs_resync = True
@@ -70,10 +76,28 @@ class TestManager(base.BaseTestCase):
 
     def test_collect_stats(self):
         self.mgr.collect_stats(mock.Mock())
-        self.rpc_mock.update_loadbalancer_stats.assert_has_calls([
-            mock.call('1', mock.ANY),
-            mock.call('2', mock.ANY)
-        ], any_order=True)
+        self.rpc_mock.update_loadbalancers_stats.assert_called_once_with(
+            {'1': mock.ANY, '2': mock.ANY})
+        configurations = self.mgr.agent_state['configurations']
+        self.assertIn('stats_cycle_time', configurations)
+
+    def test_collect_stats_sends_changed_stats_only(self):
+        stats = {'1': {'bytes_in': 1}, '2': {'bytes_in': 2}}
+        self.driver_mock.loadbalancer.get_stats.side_effect = stats.get
+        self.mgr.collect_stats(mock.Mock())
+        self.rpc_mock.update_loadbalancers_stats.assert_called_once_with(
+            stats)
+
+        self.rpc_mock.update_loadbalancers_stats.reset_mock()
+        stats['2'] = {'bytes_in': 3}
+        self.mgr.collect_stats(mock.Mock())
+        self.rpc_mock.update_loadbalancers_stats.assert_called_once_with(
+            {'2': {'bytes_in': 3}})
+        self.assertIn('stats_lag', self.mgr.agent_state['configurations'])
+
+        self.rpc_mock.update_loadbalancers_stats.reset_mock()
+        self.mgr.collect_stats(mock.Mock())
+        self.assertFalse(self.rpc_mock.update_loadbalancers_stats.called)
 
     def test_collect_stats_exception(self):
         self.driver_mock.loadbalancer.get_stats.side_effect = Exception
@@ -89,13 +113,14 @@ class TestManager(base.BaseTestCase):
                 mock.patch.object(self.mgr, '_destroy_loadbalancer') as \
                 destroy:
             self.rpc_mock.get_ready_devices.return_value = ready
+            self.rpc_mock.get_loadbalancers_for_agent.return_value = None
 
             self.mgr.sync_state()
 
             self.assertEqual(len(reloaded), len(reload.mock_calls))
             self.assertEqual(len(destroyed), len(destroy.mock_calls))
 
-            reload.assert_has_calls([mock.call(i) for i in reloaded],
+            reload.assert_has_calls([mock.call(i, None) for i in reloaded],
                                     any_order=True)
             destroy.assert_has_calls([mock.call(i) for i in destroyed],
                                      any_order=True)
@@ -115,6 +140,63 @@ class TestManager(base.BaseTestCase):
         self.mgr.instance_mapping = {'1': 'devdriver'}
         self._sync_state_helper(['2'], ['2'], ['1'])
 
+    def test_sync_state_bulk(self):
+        lbs = [{'id': '1', 'provisioning_status': constants.ACTIVE},
+               {'id': '2', 'provisioning_status': constants.PENDING_UPDATE},
+               {'id': '3', 'provisioning_status': constants.PENDING_CREATE}]
+        self.rpc_mock.get_ready_devices.return_value = ['1', '2', '3']
+        self.rpc_mock.get_loadbalancers_for_agent.return_value = lbs
+        with mock.patch.object(self.mgr, '_reload_loadbalancer') as reload:
+            self.mgr.sync_state()
+
+        self.assertEqual(1, self.rpc_mock.get_loadbalancers_for_agent.
+                         call_count)
+        self.assertFalse(self.rpc_mock.get_loadbalancer.called)
+        self.assertEqual([mock.call('3', lbs[2]), mock.call('2', lbs[1]),
+                          mock.call('1', lbs[0])], reload.call_args_list)
+        configurations = self.mgr.agent_state['configurations']
+        self.assertEqual(3, configurations['resync_total'])
+        self.assertEqual(3, configurations['resync_done'])
+        self.assertIn('resync_duration', configurations)
+
+    def test_sync_state_skips_unchanged(self):
+        lb = data_models.LoadBalancer(id='1').to_dict()
+        lb['provider'] = {'device_driver': 'devdriver'}
+        lb['revision'] = 'rev1'
+        self.rpc_mock.get_ready_devices.return_value = ['1']
+        self.rpc_mock.get_loadbalancers_for_agent.return_value = [lb]
+
+        self.mgr.sync_state()
+
+        self.rpc_mock.get_loadbalancers_for_agent.assert_called_once_with(
+            ['1'], revisions={})
+        self.assertEqual(1, self.driver_mock.deploy_instance.call_count)
+
+        self.rpc_mock.get_loadbalancers_for_agent.reset_mock()
+        self.rpc_mock.get_loadbalancers_for_agent.return_value = [
+            {'id': '1', 'revision': 'rev1', 'unchanged': True}]
+
+        self.mgr.sync_state()
+
+        self.rpc_mock.get_loadbalancers_for_agent.assert_called_once_with(
+            ['1'], revisions={'1': 'rev1'})
+        self.assertEqual(1, self.driver_mock.deploy_instance.call_count)
+        configurations = self.mgr.agent_state['configurations']
+        self.assertEqual(1, configurations['resync_unchanged'])
+        self.assertEqual(0, configurations['resync_total'])
+
+    @mock.patch.object(manager, 'RESYNC_BATCH_SIZE', 2)
+    def test_sync_state_bulk_batches(self):
+        self.rpc_mock.get_ready_devices.return_value = ['1', '2', '3']
+        self.rpc_mock.get_loadbalancers_for_agent.side_effect = (
+            lambda ids, revisions: [{'id': i} for i in ids])
+        with mock.patch.object(self.mgr, '_reload_loadbalancer') as reload:
+            self.mgr.sync_state()
+
+        self.assertEqual(2, self.rpc_mock.get_loadbalancers_for_agent.
+                         call_count)
+        self.assertEqual(3, reload.call_count)
+
     def test_sync_state_exception(self):
         self.rpc_mock.get_ready_devices.side_effect = Exception
 
@@ -139,6 +221,16 @@ class TestManager(base.BaseTestCase):
         self.assertIn(lb['id'], self.mgr.instance_mapping)
         self.rpc_mock.loadbalancer_deployed.assert_called_once_with(lb_id)
 
+    def test_reload_loadbalancer_prefetched(self):
+        lb = data_models.LoadBalancer(id='1').to_dict()
+        lb['provider'] = {'device_driver': 'devdriver'}
+
+        self.mgr._reload_loadbalancer('1', lb)
+
+        self.assertFalse(self.rpc_mock.get_loadbalancer.called)
+        self.assertEqual(1, self.driver_mock.deploy_instance.call_count)
+        self.rpc_mock.loadbalancer_deployed.assert_called_once_with('1')
+
     def test_reload_loadbalancer_driver_not_found(self):
         lb = data_models.LoadBalancer(id='1').to_dict()
         lb['provider'] = {'device_driver': 'unknowndriver'}
@@ -219,13 +311,13 @@ class TestManager(base.BaseTestCase):
         self.update_statuses_patcher.stop()
         lb = data_models.LoadBalancer(id='1')
         self.mgr._update_statuses(lb)
-        self.rpc_mock.update_status.assert_called_once_with(
+        self.rpc_mock.queue_status_update.assert_called_once_with(
             'loadbalancer', lb.id, provisioning_status=constants.ACTIVE,
             operating_status=lb_const.ONLINE)
 
-        self.rpc_mock.update_status.reset_mock()
+        self.rpc_mock.queue_status_update.reset_mock()
         self.mgr._update_statuses(lb, error=True)
-        self.rpc_mock.update_status.assert_called_once_with(
+        self.rpc_mock.queue_status_update.assert_called_once_with(
             'loadbalancer', lb.id, provisioning_status=constants.ERROR,
             operating_status=lb_const.OFFLINE)
 
@@ -235,25 +327,25 @@ class TestManager(base.BaseTestCase):
         lb = data_models.LoadBalancer(id='1', listeners=[listener])
         listener.loadbalancer = lb
         self.mgr._update_statuses(listener)
-        self.assertEqual(2, self.rpc_mock.update_status.call_count)
+        self.assertEqual(2, self.rpc_mock.queue_status_update.call_count)
         calls = [mock.call('listener', listener.id,
                            provisioning_status=constants.ACTIVE,
                            operating_status=lb_const.ONLINE),
                  mock.call('loadbalancer', lb.id,
                            provisioning_status=constants.ACTIVE,
                            operating_status=None)]
-        self.rpc_mock.update_status.assert_has_calls(calls)
+        self.rpc_mock.queue_status_update.assert_has_calls(calls)
 
-        self.rpc_mock.update_status.reset_mock()
+        self.rpc_mock.queue_status_update.reset_mock()
         self.mgr._update_statuses(listener, error=True)
-        self.assertEqual(2, self.rpc_mock.update_status.call_count)
+        self.assertEqual(2, self.rpc_mock.queue_status_update.call_count)
         calls = [mock.call('listener', listener.id,
                            provisioning_status=constants.ERROR,
                            operating_status=lb_const.OFFLINE),
                  mock.call('loadbalancer', lb.id,
                            provisioning_status=constants.ACTIVE,
                            operating_status=None)]
-        self.rpc_mock.update_status.assert_has_calls(calls)
+        self.rpc_mock.queue_status_update.assert_has_calls(calls)
 
     def test_update_statuses_pool(self):
         self.update_statuses_patcher.stop()
@@ -263,25 +355,25 @@ class TestManager(base.BaseTestCase):
         listener.loadbalancer = lb
         pool.loadbalancer = lb
         self.mgr._update_statuses(pool)
-        self.assertEqual(2, self.rpc_mock.update_status.call_count)
+        self.assertEqual(2, self.rpc_mock.queue_status_update.call_count)
         calls = [mock.call('pool', pool.id,
                            provisioning_status=constants.ACTIVE,
                            operating_status=lb_const.ONLINE),
                  mock.call('loadbalancer', lb.id,
                            provisioning_status=constants.ACTIVE,
                            operating_status=None)]
-        self.rpc_mock.update_status.assert_has_calls(calls)
+        self.rpc_mock.queue_status_update.assert_has_calls(calls)
 
-        self.rpc_mock.update_status.reset_mock()
+        self.rpc_mock.queue_status_update.reset_mock()
         self.mgr._update_statuses(pool, error=True)
-        self.assertEqual(2, self.rpc_mock.update_status.call_count)
+        self.assertEqual(2, self.rpc_mock.queue_status_update.call_count)
         calls = [mock.call('pool', pool.id,
                            provisioning_status=constants.ERROR,
                            operating_status=lb_const.OFFLINE),
                  mock.call('loadbalancer', lb.id,
                            provisioning_status=constants.ACTIVE,
                            operating_status=None)]
-        self.rpc_mock.update_status.assert_has_calls(calls)
+        self.rpc_mock.queue_status_update.assert_has_calls(calls)
 
     def test_update_statuses_member(self):
         self.update_statuses_patcher.stop()
@@ -293,25 +385,25 @@ class TestManager(base.BaseTestCase):
         listener.loadbalancer = lb
         pool.loadbalancer = lb
         self.mgr._update_statuses(member)
-        self.assertEqual(2, self.rpc_mock.update_status.call_count)
+        self.assertEqual(2, self.rpc_mock.queue_status_update.call_count)
         calls = [mock.call('member', member.id,
                            provisioning_status=constants.ACTIVE,
                            operating_status=lb_const.ONLINE),
                  mock.call('loadbalancer', lb.id,
                            provisioning_status=constants.ACTIVE,
                            operating_status=None)]
-        self.rpc_mock.update_status.assert_has_calls(calls)
+        self.rpc_mock.queue_status_update.assert_has_calls(calls)
 
-        self.rpc_mock.update_status.reset_mock()
+        self.rpc_mock.queue_status_update.reset_mock()
         self.mgr._update_statuses(member, error=True)
-        self.assertEqual(2, self.rpc_mock.update_status.call_count)
+        self.assertEqual(2, self.rpc_mock.queue_status_update.call_count)
         calls = [mock.call('member', member.id,
                            provisioning_status=constants.ERROR,
                            operating_status=lb_const.OFFLINE),
                  mock.call('loadbalancer', lb.id,
                            provisioning_status=constants.ACTIVE,
                            operating_status=None)]
-        self.rpc_mock.update_status.assert_has_calls(calls)
+        self.rpc_mock.queue_status_update.assert_has_calls(calls)
 
     def test_update_statuses_healthmonitor(self):
         self.update_statuses_patcher.stop()
@@ -323,25 +415,25 @@ class TestManager(base.BaseTestCase):
         listener.loadbalancer = lb
         pool.loadbalancer = lb
         self.mgr._update_statuses(hm)
-        self.assertEqual(2, self.rpc_mock.update_status.call_count)
+        self.assertEqual(2, self.rpc_mock.queue_status_update.call_count)
         calls = [mock.call('healthmonitor', hm.id,
                            provisioning_status=constants.ACTIVE,
                            operating_status=None),
                  mock.call('loadbalancer', lb.id,
                            provisioning_status=constants.ACTIVE,
                            operating_status=None)]
-        self.rpc_mock.update_status.assert_has_calls(calls)
+        self.rpc_mock.queue_status_update.assert_has_calls(calls)
 
-        self.rpc_mock.update_status.reset_mock()
+        self.rpc_mock.queue_status_update.reset_mock()
         self.mgr._update_statuses(hm, error=True)
-        self.assertEqual(2, self.rpc_mock.update_status.call_count)
+        self.assertEqual(2, self.rpc_mock.queue_status_update.call_count)
         calls = [mock.call('healthmonitor', hm.id,
                            provisioning_status=constants.ERROR,
                            operating_status=None),
                  mock.call('loadbalancer', lb.id,
                            provisioning_status=constants.ACTIVE,
                            operating_status=None)]
-        self.rpc_mock.update_status.assert_has_calls(calls)
+        self.rpc_mock.queue_status_update.assert_has_calls(calls)
 
     @mock.patch.object(data_models.LoadBalancer, 'from_dict')
     def test_create_loadbalancer(self, mlb):
@@ -355,6 +447,29 @@ class TestManager(base.BaseTestCase):
             loadbalancer)
         self.update_statuses.assert_called_once_with(loadbalancer)
 
+    def test_adopt_loadbalancers(self):
+        with mock.patch('eventlet.spawn_n') as spawn_n:
+            self.mgr.adopt_loadbalancers(mock.Mock(), ['1', '2'])
+        spawn_n.assert_called_once_with(self.mgr._adopt_loadbalancers,
+                                        ['1', '2'])
+
+        self.rpc_mock.get_loadbalancers_for_agent.return_value = [
+            {'id': '1'}, {'id': '2'}]
+        configurations = self.mgr.agent_state['configurations']
+        configurations['resync_total'] = 5
+        with mock.patch.object(self.mgr, '_reload_loadbalancer') as reload:
+            self.mgr._adopt_loadbalancers(['1', '2'])
+        self.assertEqual(2, reload.call_count)
+        self.assertEqual(2, configurations['adopt_done'])
+        # the counters of the periodic resync are left alone
+        self.assertEqual(5, configurations['resync_total'])
+
+    def test_adopt_loadbalancers_failed(self):
+        self.rpc_mock.get_loadbalancers_for_agent.side_effect = Exception
+        self.mgr.needs_resync = False
+        self.mgr._adopt_loadbalancers(['1', '2'])
+        self.assertTrue(self.mgr.needs_resync)
+
     @mock.patch.object(data_models.LoadBalancer, 'from_dict')
     def test_create_loadbalancer_failed(self, mlb):
         loadbalancer = data_models.LoadBalancer(id='1')
@@ -20,6 +20,7 @@ import mock
 from neutron.api import extensions
 from neutron.common import config
 from neutron import context
+from neutron.db import api as db_api
 import neutron.db.l3_db  # noqa
 from neutron.plugins.common import constants
 from neutron.tests.unit.db import test_db_base_plugin_v2
@@ -29,6 +30,7 @@ from neutron_lib.plugins import directory
 from oslo_config import cfg
 from oslo_utils import uuidutils
 import six
+from sqlalchemy import event as sa_event
 import testtools
 import webob.exc
 
@@ -1931,6 +1933,33 @@ class LbaasListenerTests(ListenerTestBase):
             for k in expected_values:
                 self.assertEqual(expected_values[k], listener_list[0][k])
 
+    def test_update_listeners_stats(self):
+        ctx = context.get_admin_context()
+        stats = {lb_const.STATS_IN_BYTES: 10,
+                 lb_const.STATS_OUT_BYTES: 20,
+                 lb_const.STATS_ACTIVE_CONNECTIONS: 1,
+                 lb_const.STATS_TOTAL_CONNECTIONS: 5}
+        with self.listener(loadbalancer_id=self.lb_id,
+                           protocol_port=80) as listener1:
+            with self.listener(loadbalancer_id=self.lb_id,
+                               protocol_port=81) as listener2:
+                listener1_id = listener1['listener']['id']
+                listener2_id = listener2['listener']['id']
+                not_found = self.plugin.db.update_listeners_stats(
+                    ctx, {listener1_id: stats, listener2_id: stats,
+                          'unknown': stats})
+                self.assertEqual(['unknown'], not_found)
+                self.plugin.db.update_listeners_stats(
+                    ctx, {listener2_id: dict(
+                        stats, **{lb_const.STATS_IN_BYTES: 30})})
+
+                resp, body = self._get_loadbalancer_stats_api(self.lb_id)
+                self.assertEqual({'stats': {
+                    lb_const.STATS_IN_BYTES: 40,
+                    lb_const.STATS_OUT_BYTES: 40,
+                    lb_const.STATS_ACTIVE_CONNECTIONS: 2,
+                    lb_const.STATS_TOTAL_CONNECTIONS: 10}}, body)
+
     def test_list_listeners_with_sort_emulated(self):
         with self.listener(name='listener1', protocol_port=81,
                            loadbalancer_id=self.lb_id) as listener1:
@@ -4262,6 +4291,153 @@ class LbaasStatusesTest(MemberTestBase):
         self._assertNotDegraded(self._traverse_statuses(statuses,
             listener='listener_HTTPS'))
 
+    def test_get_loadbalancer_graph(self):
+        ctx = context.get_admin_context()
+        lb_dict = self._create_new_populated_loadbalancer()
+        lb = self.plugin.db.get_loadbalancer_graph(ctx, lb_dict['id'])
+        self.assertEqual('test_loadbalancer', lb.name)
+        self.assertIs(lb, lb.stats.loadbalancer)
+        self.assertEqual('lbaas', lb.provider.provider_name)
+        self.assertEqual(lb.vip_port_id, lb.vip_port.id)
+        self.assertEqual(sorted(l['id'] for l in lb_dict['listeners']),
+                         sorted(l.id for l in lb.listeners))
+        self.assertEqual(sorted(p['id'] for p in lb_dict['pools']),
+                         sorted(p.id for p in lb.pools))
+        for listener in lb.listeners:
+            self.assertIs(lb, listener.loadbalancer)
+            self.assertIn(listener.default_pool, lb.pools)
+            self.assertIs(listener, listener.default_pool.listener)
+        for pool_dict in lb_dict['pools']:
+            pool = [p for p in lb.pools if p.id == pool_dict['id']][0]
+            self.assertEqual(pool_dict['health_monitor']['id'],
+                             pool.healthmonitor.id)
+            self.assertIs(pool, pool.healthmonitor.pool)
+            self.assertEqual(sorted(m['id'] for m in pool_dict['members']),
+                             sorted(m.id for m in pool.members))
+            for member in pool.members:
+                self.assertIs(pool, member.pool)
+
+    def test_get_loadbalancer_graph_not_found(self):
+        ctx = context.get_admin_context()
+        self.assertRaises(loadbalancerv2.EntityNotFound,
+                          self.plugin.db.get_loadbalancer_graph,
+                          ctx, uuidutils.generate_uuid())
+
+    def test_get_loadbalancer_status_graph(self):
+        ctx = context.get_admin_context()
+        lb_dict = self._create_new_populated_loadbalancer()
+        lb = self.plugin.db.get_loadbalancer_status_graph(ctx, lb_dict['id'])
+        self.assertEqual('test_loadbalancer', lb.name)
+        self.assertEqual(sorted(l['id'] for l in lb_dict['listeners']),
+                         sorted(l.id for l in lb.listeners))
+        for listener in lb.listeners:
+            self.assertIn(listener.default_pool, lb.pools)
+        self.assertIs(lb, self.plugin.db.get_loadbalancer_status_graph(
+            ctx, lb_dict['id']))
+
+        member_id = lb.pools[0].members[0].id
+        self.plugin.db.update_status(ctx, models.MemberV2, member_id,
+                                     operating_status=lb_const.OFFLINE)
+        lb = self.plugin.db.get_loadbalancer_status_graph(ctx, lb_dict['id'])
+        members = [m for p in lb.pools for m in p.members
+                   if m.id == member_id]
+        self.assertEqual(lb_const.OFFLINE, members[0].operating_status)
+
+    def test_get_loadbalancer_status_graph_without_cache(self):
+        ctx = context.get_admin_context()
+        lb_dict = self._create_new_populated_loadbalancer()
+        lb = self.plugin.db.get_loadbalancer_status_graph(ctx, lb_dict['id'])
+        own_lb = self.plugin.db.get_loadbalancer_status_graph(
+            ctx, lb_dict['id'], use_cache=False)
+        self.assertIsNot(lb, own_lb)
+        self.assertEqual(lb.listeners[0].id, own_lb.listeners[0].id)
+        self.assertIs(lb, self.plugin.db.get_loadbalancer_status_graph(
+            ctx, lb_dict['id']))
+
+    def test_get_loadbalancer_status_graph_read_before_commit(self):
+        ctx = context.get_admin_context()
+        lb_dict = self._create_new_populated_loadbalancer()
+        member_id = lb_dict['pools'][0]['members'][0]['id']
+        with ctx.session.begin():
+            self.plugin.db.set_statuses(ctx, models.MemberV2, [member_id],
+                                        operating_status=lb_const.OFFLINE)
+            # a reader that does not see the write yet
+            stale = self.plugin.db.get_loadbalancer_status_graph(
+                context.get_admin_context(), lb_dict['id'])
+            self.assertIs(stale, self.plugin.db.get_loadbalancer_status_graph(
+                ctx, lb_dict['id']))
+        lb = self.plugin.db.get_loadbalancer_status_graph(ctx, lb_dict['id'])
+        self.assertIsNot(stale, lb)
+        members = [m for p in lb.pools for m in p.members
+                   if m.id == member_id]
+        self.assertEqual(lb_const.OFFLINE, members[0].operating_status)
+
+    def test_get_loadbalancer_status_graph_not_found(self):
+        ctx = context.get_admin_context()
+        self.assertRaises(loadbalancerv2.EntityNotFound,
+                          self.plugin.db.get_loadbalancer_status_graph,
+                          ctx, uuidutils.generate_uuid())
+
+    def test_get_loadbalancers_query_count_is_constant(self):
+        ctx = context.get_admin_context()
+        statements = []
+
+        def _count(*args, **kwargs):
+            statements.append(args)
+
+        engine = db_api.context_manager.writer.get_engine()
+        self._create_new_populated_loadbalancer()
+        sa_event.listen(engine, 'after_cursor_execute', _count)
+        self.addCleanup(sa_event.remove, engine, 'after_cursor_execute',
+                        _count)
+        self.assertEqual(1, len(self.plugin.db.get_loadbalancers(ctx)))
+        one_lb_statements = len(statements)
+
+        self._create_new_populated_loadbalancer()
+        del statements[:]
+        self.assertEqual(2, len(self.plugin.db.get_loadbalancers(ctx)))
+        self.assertEqual(one_lb_statements, len(statements))
+
+    def test_status_updates_statement_count(self):
+        ctx = context.get_admin_context()
+        statements = []
+
+        def _count(*args, **kwargs):
+            statements.append(args)
+
+        engine = db_api.context_manager.writer.get_engine()
+        lb_dict = self._create_new_populated_loadbalancer()
+        self.plugin.db.update_loadbalancer_provisioning_status(
+            ctx, lb_dict['id'])
+        member_id = lb_dict['pools'][0]['members'][0]['id']
+        sa_event.listen(engine, 'after_cursor_execute', _count)
+        self.addCleanup(sa_event.remove, engine, 'after_cursor_execute',
+                        _count)
+
+        # one SELECT of the matching ids and one UPDATE per status change
+        self.plugin.db.update_status(ctx, models.MemberV2, member_id,
+                                     provisioning_status=constants.ACTIVE,
+                                     operating_status=lb_const.OFFLINE)
+        self.assertEqual(2, len(statements))
+
+        # the root load balancer id is read with a single query
+        del statements[:]
+        self.plugin.db.test_and_set_status(
+            ctx, models.MemberV2, member_id, constants.PENDING_UPDATE)
+        self.assertEqual(5, len(statements))
+        statuses = self.plugin.db.get_provisioning_statuses(
+            ctx, models.LoadBalancer, [lb_dict['id']])
+        self.assertEqual({lb_dict['id']: constants.PENDING_UPDATE}, statuses)
+
+        self.assertRaises(loadbalancerv2.StateInvalid,
+                          self.plugin.db.test_and_set_status,
+                          ctx, models.MemberV2, member_id,
+                          constants.PENDING_UPDATE)
+        self.assertRaises(loadbalancerv2.EntityNotFound,
+                          self.plugin.db.test_and_set_status,
+                          ctx, models.MemberV2, uuidutils.generate_uuid(),
+                          constants.PENDING_UPDATE)
+
     def _assertOnline(self, obj):
         OS = "operating_status"
         if OS in obj:
@@ -4377,3 +4553,50 @@ class LbaasStatusesTest(MemberTestBase):
                 members.append({'id': member['member']['id']})
         self.lbs_to_clean.append(lb_dict)
         return lb_dict
+
+
+class TestStatusGraphCache(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestStatusGraphCache, self).setUp()
+        self.cache = loadbalancer_dbv2.StatusGraphCache()
+
+    def _put(self, lb_id, entity_ids=()):
+        graph = mock.Mock()
+        self.cache.put(lb_id, None, graph, [lb_id] + list(entity_ids),
+                       self.cache.generation)
+        return graph
+
+    def test_expired_graphs_are_dropped(self):
+        with mock.patch('time.time', return_value=1000):
+            graph = self._put('lb1', ['member1'])
+            self.assertIs(graph, self.cache.get('lb1', None))
+        with mock.patch('time.time', return_value=1000 +
+                        loadbalancer_dbv2.STATUS_GRAPH_CACHE_TTL):
+            self.assertIsNone(self.cache.get('lb1', None))
+        self.assertEqual({}, self.cache._graphs)
+        self.assertEqual({}, self.cache._owners)
+
+    @mock.patch.object(loadbalancer_dbv2, 'STATUS_GRAPH_CACHE_SIZE', 2)
+    def test_cache_is_bounded(self):
+        for lb_id in ('lb1', 'lb2', 'lb3'):
+            self._put(lb_id, [lb_id + '-member'])
+        self.assertEqual(['lb2', 'lb3'], list(self.cache._graphs))
+        self.assertNotIn('lb1-member', self.cache._owners)
+
+    def test_invalidate_after_commit(self):
+        session = mock.Mock(info={})
+        self._put('lb1', ['member1'])
+        with mock.patch.object(loadbalancer_dbv2.event, 'listen') as listen:
+            self.cache.invalidate('member1', session)
+            self.cache.invalidate('member2', session)
+        listen.assert_called_once_with(session, 'after_commit',
+                                       self.cache._after_commit, once=True)
+        self.assertIsNone(self.cache.get('lb1', None))
+
+        # a graph read before the commit is dropped once it commits
+        graph = self._put('lb1', ['member1'])
+        self.assertIs(graph, self.cache.get('lb1', None))
+        self.cache._after_commit(session)
+        self.assertIsNone(self.cache.get('lb1', None))
+        self.assertEqual({}, session.info)
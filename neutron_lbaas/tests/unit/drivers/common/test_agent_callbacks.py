@@ -19,6 +19,7 @@ from neutron import context
 from neutron.plugins.common import constants
 from neutron.tests.unit import testlib_api
 from neutron_lib.api.definitions import portbindings
+from neutron_lib import exceptions as n_exc
 from oslo_utils import uuidutils
 from six import moves
 
@@ -163,6 +164,78 @@ class TestLoadBalancerCallbacks(
             del expected_lb['stats']
             self.assertEqual(expected_lb, load_balancer)
 
+    def test_get_loadbalancers_for_agent(self):
+        with self.loadbalancer() as loadbalancer:
+            ctx = context.get_admin_context()
+            lb_id = loadbalancer['loadbalancer']['id']
+            self.plugin_instance.db.update_loadbalancer_provisioning_status(
+                ctx, lb_id)
+            expected_lb = self.callbacks.get_loadbalancer(ctx, lb_id)
+            revision = agent_callbacks.get_revision(expected_lb)
+            expected_lb['revision'] = revision
+
+            load_balancers = self.callbacks.get_loadbalancers_for_agent(
+                ctx, [lb_id, uuidutils.generate_uuid()])
+            self.assertEqual([expected_lb], load_balancers)
+
+            load_balancers = self.callbacks.get_loadbalancers_for_agent(
+                ctx, [lb_id], revisions={lb_id: revision})
+            self.assertEqual([{'id': lb_id, 'revision': revision,
+                               'unchanged': True}], load_balancers)
+
+    def test_get_revision_ignores_operating_statuses(self):
+        lb_dict = {'id': 'lb1', 'provisioning_status': constants.ACTIVE,
+                   'operating_status': lb_const.ONLINE,
+                   'listeners': [{'id': 'listener1',
+                                  'operating_status': lb_const.ONLINE}]}
+        revision = agent_callbacks.get_revision(lb_dict)
+
+        lb_dict['operating_status'] = lb_const.DEGRADED
+        lb_dict['listeners'][0]['operating_status'] = lb_const.OFFLINE
+        self.assertEqual(revision, agent_callbacks.get_revision(lb_dict))
+
+        # the drivers render depending on the provisioning statuses
+        lb_dict['listeners'][0]['provisioning_status'] = (
+            constants.PENDING_DELETE)
+        self.assertNotEqual(revision, agent_callbacks.get_revision(lb_dict))
+
+    def test_get_loadbalancers_for_agent_by_host(self):
+        with self.loadbalancer() as loadbalancer:
+            ctx = context.get_admin_context()
+            lb_id = loadbalancer['loadbalancer']['id']
+            self.plugin_instance.db.update_loadbalancer_provisioning_status(
+                ctx, lb_id)
+            with mock.patch.object(self.callbacks, 'get_ready_devices',
+                                   return_value=[lb_id]) as ready:
+                load_balancers = self.callbacks.get_loadbalancers_for_agent(
+                    ctx, host='host')
+
+            ready.assert_called_once_with(ctx, host='host')
+            self.assertEqual([lb_id], [lb['id'] for lb in load_balancers])
+
+    def test_get_loadbalancers_for_agent_batches_lookups(self):
+        with self.loadbalancer() as lb1, self.loadbalancer() as lb2:
+            ctx = context.get_admin_context()
+            lb_ids = [lb1['loadbalancer']['id'], lb2['loadbalancer']['id']]
+            for lb_id in lb_ids:
+                (self.plugin_instance.db
+                 .update_loadbalancer_provisioning_status(ctx, lb_id))
+            core = self.plugin_instance.db._core_plugin
+            with mock.patch.object(core, 'get_subnets',
+                                   wraps=core.get_subnets) as get_subnets, \
+                    mock.patch.object(core, 'get_networks',
+                                      wraps=core.get_networks) as \
+                    get_networks:
+                load_balancers = self.callbacks.get_loadbalancers_for_agent(
+                    ctx, lb_ids)
+
+            self.assertEqual(1, get_subnets.call_count)
+            self.assertEqual(1, get_networks.call_count)
+            self.assertEqual(2, len(load_balancers))
+            for lb in load_balancers:
+                self.assertIn('subnet', lb['vip_port']['fixed_ips'][0])
+                self.assertIn('network', lb['vip_port'])
+
     def _update_port_test_helper(self, expected, func, **kwargs):
         core = self.plugin_instance.db._core_plugin
 
@@ -294,3 +367,50 @@ class TestLoadBalancerCallbacks(
                                          loadbalancer_id,
                                          provisioning_status=constants.ACTIVE)
             self.assertTrue(mock_log.warning.called)
+
+    def test_update_statuses_bulk(self):
+        with self.loadbalancer(no_delete=True) as loadbalancer:
+            lb_id = loadbalancer['loadbalancer']['id']
+            self.plugin_instance.db.update_status(
+                context.get_admin_context(), db_models.LoadBalancer, lb_id,
+                constants.ACTIVE)
+            with self.listener(loadbalancer_id=lb_id,
+                               no_delete=True) as listener:
+                listener_id = listener['listener']['id']
+                ctx = context.get_admin_context()
+                with mock.patch.object(agent_callbacks, 'LOG') as mock_log:
+                    self.callbacks.update_statuses_bulk(ctx, statuses=[
+                        {'obj_type': 'loadbalancer', 'obj_id': lb_id,
+                         'provisioning_status': constants.ACTIVE,
+                         'operating_status': lb_const.ONLINE},
+                        {'obj_type': 'listener', 'obj_id': listener_id,
+                         'provisioning_status': constants.ACTIVE,
+                         'operating_status': None},
+                        {'obj_type': 'member', 'obj_id': 'deleted_member',
+                         'provisioning_status': constants.ACTIVE,
+                         'operating_status': None}])
+                    self.assertEqual(1, mock_log.warning.call_count)
+                l = self.plugin_instance.db.get_loadbalancer(ctx, lb_id)
+                self.assertEqual(constants.ACTIVE, l.provisioning_status)
+                self.assertEqual(lb_const.ONLINE, l.operating_status)
+                ll = self.plugin_instance.db.get_listener(ctx, listener_id)
+                self.assertEqual(constants.ACTIVE, ll.provisioning_status)
+
+    def test_update_loadbalancers_stats(self):
+        with self.loadbalancer(no_delete=True) as loadbalancer:
+            lb_id = loadbalancer['loadbalancer']['id']
+            ctx = context.get_admin_context()
+            self.callbacks.update_loadbalancers_stats(ctx, stats={
+                lb_id: {lb_const.STATS_IN_BYTES: 10,
+                        lb_const.STATS_OUT_BYTES: 20},
+                'deleted_lb': {lb_const.STATS_IN_BYTES: 30}})
+            stats = self.plugin_instance.db.stats(ctx, lb_id)
+            self.assertEqual(10, stats.bytes_in)
+            self.assertEqual(20, stats.bytes_out)
+
+    def test_update_statuses_bulk_unknown_type(self):
+        self.assertRaises(n_exc.Invalid,
+                          self.callbacks.update_statuses_bulk,
+                          context.get_admin_context(),
+                          statuses=[{'obj_type': 'foo', 'obj_id': 'id',
+                                     'provisioning_status': 'ACTIVE'}])
@@ -21,6 +21,7 @@ from neutron.db import servicetype_db as st_db
 from neutron.plugins.common import constants
 from neutron.tests.common import helpers
 
+from neutron_lbaas import agent_scheduler
 from neutron_lbaas.common import exceptions
 from neutron_lbaas.db.loadbalancer import models
 from neutron_lbaas.drivers.common import agent_driver_base
@@ -95,6 +96,27 @@ class TestLoadBalancerAgentApi(base.BaseTestCase):
         self._call_test_helper('create_loadbalancer', {'loadbalancer': 'test',
                                                        'driver_name': 'dummy'})
 
+    def test_adopt_loadbalancers(self):
+        with mock.patch.object(self.api.client, 'cast') as rpc_mock, \
+                mock.patch.object(self.api.client, 'prepare') as prepare_mock:
+            prepare_mock.return_value = self.api.client
+            self.api.adopt_loadbalancers(mock.sentinel.context, ['1', '2'],
+                                         'host')
+        prepare_mock.assert_called_once_with(server='host', version='1.1')
+        rpc_mock.assert_called_once_with(mock.sentinel.context,
+                                         'adopt_loadbalancers',
+                                         loadbalancer_ids=['1', '2'])
+
+    def test_can_adopt_loadbalancers(self):
+        self.assertTrue(self.api.can_adopt_loadbalancers(
+            {'rpc_version': '1.1'}))
+        self.assertTrue(self.api.can_adopt_loadbalancers(
+            {'rpc_version': '2.0'}))
+        self.assertFalse(self.api.can_adopt_loadbalancers(
+            {'rpc_version': '1.0'}))
+        self.assertFalse(self.api.can_adopt_loadbalancers(
+            {'device_drivers': ['haproxy_ns']}))
+
     def test_update_loadbalancer(self):
         self._call_test_helper('update_loadbalancer', {
             'old_loadbalancer': 'test', 'loadbalancer': 'test'})
@@ -599,21 +621,51 @@ class TestLoadBalancerManager(test_agent_scheduler.
             'neutron_lbaas.agent_scheduler.ChanceScheduler')
 
     def test_reschedule_lbaas_from_down_agents(self):
-        with mock.patch(
-            'neutron_lbaas.drivers.common.agent_driver_base.'
-            'LoadBalancerManager.reschedule_resources_from_down_agents'
-        ) as mock_reschedule_resources:
+        with mock.patch.object(
+            self.load_balancer, '_reschedule_down_bindings',
+            side_effect=Exception
+        ) as mock_reschedule:
+            # errors are logged, not raised to the periodic task
             self.load_balancer.reschedule_lbaas_from_down_agents()
-            self.assertTrue(mock_reschedule_resources.called)
-            mock_reschedule_resources.assert_called_once_with(
-                agent_type=lb_const.AGENT_TYPE_LOADBALANCERV2,
-                get_down_bindings=(self.load_balancer.
-                                   get_down_loadbalancer_bindings),
-                agent_id_attr='agent_id',
-                resource_id_attr='loadbalancer_id',
-                resource_name='loadbalancer',
-                reschedule_resource=self.load_balancer.reschedule_loadbalancer,
-                rescheduling_failed=exceptions.LoadbalancerReschedulingFailed)
+            self.assertTrue(mock_reschedule.called)
+
+    def test_place_loadbalancers(self):
+        agents = [{'id': 'agent1', 'host': 'hostb'},
+                  {'id': 'agent2', 'host': 'hosta'}]
+        self.loadbalancer_scheduler = agent_scheduler.LeastLoadedScheduler()
+        with mock.patch.object(self.plugin.db, 'get_lbaas_agents_load',
+                               return_value={'agent1': 0, 'agent2': 2}):
+            placements = self.load_balancer._place_loadbalancers(
+                self.adminContext, agents, ['lb1', 'lb2', 'lb3', 'lb4'])
+        self.assertEqual({'agent1': ['lb1', 'lb2', 'lb4'], 'agent2': ['lb3']},
+                         dict((agent['id'], lb_ids)
+                              for agent, lb_ids in placements))
+
+    def test_place_loadbalancers_uses_the_scheduler(self):
+        self.loadbalancer_scheduler = mock.Mock()
+        placements = self.load_balancer._place_loadbalancers(
+            self.adminContext, ['agents'], ['lb1'])
+        self.loadbalancer_scheduler.place.assert_called_once_with(
+            self.plugin, self.adminContext, ['agents'], ['lb1'])
+        self.assertEqual(self.loadbalancer_scheduler.place.return_value,
+                         placements)
+
+    def test_adopt_loadbalancers_old_agents(self):
+        self._register_agent_states(lbaas_agents=True)
+        agent = self.load_balancer.get_lbaas_agents(self.adminContext)[0]
+        with mock.patch.object(self.agent_rpc,
+                               'create_loadbalancer') as mock_create, \
+                mock.patch.object(self.agent_rpc,
+                                  'adopt_loadbalancers') as mock_adopt, \
+                mock.patch.object(self.load_balancer.db, 'get_loadbalancers',
+                                  return_value=['lb1', 'lb2']):
+            self.load_balancer._adopt_loadbalancers(
+                self.adminContext, agent, ['1', '2'])
+        # the registered agents do not report an rpc_version
+        self.assertFalse(mock_adopt.called)
+        mock_create.assert_has_calls([
+            mock.call(self.adminContext, 'lb1', agent['host'], 'haproxy_ns'),
+            mock.call(self.adminContext, 'lb2', agent['host'], 'haproxy_ns')])
 
     def test_loadbalancer_reschedule_from_dead_lbaas_agent(self):
         self._register_agent_states(lbaas_agents=True)
@@ -625,10 +677,15 @@ class TestLoadBalancerManager(test_agent_scheduler.
                 loadbalancer_data['id'])
             self.assertIsNotNone(original_agent)
             helpers.kill_agent(original_agent['agent']['id'])
-            self.load_balancer.reschedule_lbaas_from_down_agents()
+            with mock.patch.object(self.agent_rpc,
+                                   'adopt_loadbalancers') as mock_adopt:
+                self.load_balancer.reschedule_lbaas_from_down_agents()
             rescheduled_agent = self._get_lbaas_agent_hosting_loadbalancer(
                 loadbalancer_data['id'])
             self.assertNotEqual(original_agent, rescheduled_agent)
+            mock_adopt.assert_called_once_with(
+                mock.ANY, [loadbalancer_data['id']],
+                rescheduled_agent['agent']['host'])
 
     def test_reschedule_loadbalancer_succeeded(self):
         self._register_agent_states(lbaas_agents=True)
@@ -19,8 +19,7 @@ RET_PERSISTENCE = {
     'type': 'HTTP_COOKIE',
     'cookie_name': 'HTTP_COOKIE'}
 
-HASHSEED_ORDERED_CODES = list({'404', '405', '500'})
-PIPED_CODES = '|'.join(HASHSEED_ORDERED_CODES)
+EXPECTED_CODES = '^(40[45]|500)$'
 
 RET_MONITOR = {
     'id': 'sample_monitor_id_1',
@@ -30,7 +29,8 @@ RET_MONITOR = {
     'max_retries': 3,
     'http_method': 'GET',
     'url_path': '/index.html',
-    'expected_codes': PIPED_CODES,
+    'expect': 'rstatus',
+    'expected_codes': EXPECTED_CODES,
     'admin_state_up': True}
 
 RET_MEMBER_1 = {
@@ -13,9 +13,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import re
+
 import mock
 
 from neutron.tests import base
+from oslo_config import cfg
 
 from neutron_lbaas.common.cert_manager import cert_manager
 from neutron_lbaas.common.tls_utils import cert_parser
@@ -26,6 +29,12 @@ from neutron_lbaas.tests.unit.drivers.haproxy.\
 
 
 class TestHaproxyCfg(base.BaseTestCase):
+    def setUp(self):
+        super(TestHaproxyCfg, self).setUp()
+        mock.patch.object(jinja_cfg, '_cert_cache',
+                          jinja_cfg.CertCache()).start()
+        mock.patch.object(jinja_cfg, '_expected_codes', {}).start()
+
     def test_save_config(self):
         with mock.patch('neutron_lbaas.drivers.haproxy.'
                         'jinja_cfg.render_loadbalancer_obj') as r_t, \
@@ -42,6 +51,100 @@ class TestHaproxyCfg(base.BaseTestCase):
             replace.assert_called_once_with('test_conf_path',
                                             'fake_rendered_template')
 
+    def test_save_config_unchanged(self):
+        with mock.patch('neutron_lbaas.drivers.haproxy.'
+                        'jinja_cfg.render_loadbalancer_obj') as r_t, \
+                mock.patch('neutron.common.utils.replace_file') as replace, \
+                mock.patch('os.path.exists') as path_exists, \
+                mock.patch('six.moves.builtins.open',
+                           mock.mock_open(read_data='fake_rendered_template')):
+            r_t.return_value = 'fake_rendered_template'
+            path_exists.return_value = True
+            changed = jinja_cfg.save_config('test_conf_path', mock.Mock(),
+                                            'test_sock_path', 'nogroup',
+                                            'fake_state_path')
+            self.assertFalse(changed)
+            self.assertFalse(replace.called)
+
+            r_t.return_value = 'new_rendered_template'
+            changed = jinja_cfg.save_config('test_conf_path', mock.Mock(),
+                                            'test_sock_path', 'nogroup',
+                                            'fake_state_path')
+            self.assertTrue(changed)
+            replace.assert_called_once_with('test_conf_path',
+                                            'new_rendered_template')
+
+    def test_save_config_certificate_rotated(self):
+        def render(*args):
+            jinja_cfg._cert_cache.store_pem('fake_pem_path', 'new_pem')
+            return 'fake_rendered_template'
+
+        with mock.patch('neutron_lbaas.drivers.haproxy.'
+                        'jinja_cfg.render_loadbalancer_obj') as r_t, \
+                mock.patch('neutron.common.utils.replace_file') as replace, \
+                mock.patch('os.path.exists') as path_exists, \
+                mock.patch('six.moves.builtins.open',
+                           mock.mock_open(read_data='fake_rendered_template')):
+            r_t.side_effect = render
+            path_exists.return_value = True
+            changed = jinja_cfg.save_config('test_conf_path', mock.Mock(),
+                                            'test_sock_path', 'nogroup',
+                                            'fake_state_path')
+            self.assertTrue(changed)
+            replace.assert_called_once_with('fake_pem_path', 'new_pem')
+
+    def test_save_shared_config(self):
+        with mock.patch('neutron_lbaas.drivers.haproxy.'
+                        'jinja_cfg.render_loadbalancers_obj') as r_t, \
+                mock.patch('neutron.common.utils.replace_file') as replace:
+            r_t.return_value = 'fake_rendered_template'
+            loadbalancers = [(mock.Mock(), 'fake_state_path')]
+            self.assertTrue(jinja_cfg.save_shared_config(
+                'test_conf_path', 'subnet subnet1', loadbalancers,
+                'test_sock_path', 'nogroup'))
+            r_t.assert_called_once_with('subnet subnet1', loadbalancers,
+                                        'nogroup', 'test_sock_path')
+            replace.assert_called_once_with('test_conf_path',
+                                            'fake_rendered_template')
+
+    def test_render_loadbalancers_obj(self):
+        lb1 = sample_configs.sample_loadbalancer_tuple()
+        lb2 = lb1._replace(id='sample_loadbalancer_id_2', name='test-lb-2',
+                           vip_address='10.0.0.3')
+        rendered_obj = jinja_cfg.render_loadbalancers_obj(
+            'subnet subnet1', [(lb1, '/v2/lb1'), (lb2, '/v2/lb2')], 'nogroup',
+            '/sock_path')
+        single = jinja_cfg.render_loadbalancer_obj(lb1, 'nogroup',
+                                                   '/sock_path', '/v2/lb1')
+        head, proxies = single.split('\n\nfrontend ', 1)
+        proxies = 'frontend ' + proxies
+        self.assertEqual(
+            head.replace('test-lb', 'subnet subnet1').replace(
+                'maxconn 98\n    stats', 'maxconn 196\n    stats').replace(
+                'level user', 'level user expose-fd listeners') +
+            '\n\n# Loadbalancer sample_loadbalancer_id_1\n' +
+            proxies +
+            '# Loadbalancer sample_loadbalancer_id_2\n' +
+            proxies.replace('10.0.0.2:80', '10.0.0.3:80'),
+            rendered_obj)
+        # the tenant controlled names are not rendered
+        self.assertNotIn('test-lb-2', rendered_obj)
+
+    def test_render_fragments_are_cached(self):
+        lb = sample_configs.sample_loadbalancer_tuple()
+        jinja_cfg._fragments.clear()
+        rendered_obj = jinja_cfg.render_loadbalancer_obj(
+            lb, 'nogroup', '/sock_path', '/v2')
+        self.assertEqual(2, len(jinja_cfg._fragments))
+
+        with mock.patch.object(jinja_cfg, '_get_jinja_env',
+                               wraps=jinja_cfg._get_jinja_env) as get_env:
+            self.assertEqual(rendered_obj, jinja_cfg.render_loadbalancer_obj(
+                lb, 'nogroup', '/sock_path', '/v2'))
+            # only the main template is looked up, no fragment is rendered
+            self.assertEqual(1, get_env.call_count)
+        self.assertEqual(2, len(jinja_cfg._fragments))
+
     def test_get_template(self):
         template = jinja_cfg._get_template()
         self.assertEqual('haproxy.loadbalancer.j2', template.name)
@@ -72,7 +175,7 @@ class TestHaproxyCfg(base.BaseTestCase):
               "    server sample_member_id_2 10.0.0.98:82"
               " weight 13 check inter 30s fall 3 cookie "
               "sample_member_id_2\n\n"
-              % sample_configs.PIPED_CODES)
+              % sample_configs.EXPECTED_CODES)
         with mock.patch('os.makedirs'):
             with mock.patch('os.listdir'):
                 with mock.patch.object(jinja_cfg, 'n_utils'):
@@ -116,7 +219,7 @@ class TestHaproxyCfg(base.BaseTestCase):
               "weight 13 check inter 30s fall 3 cookie sample_member_id_1\n"
               "    server sample_member_id_2 10.0.0.98:82 "
               "weight 13 check inter 30s fall 3 cookie sample_member_id_2\n\n"
-              % sample_configs.PIPED_CODES)
+              % sample_configs.EXPECTED_CODES)
         with mock.patch('os.makedirs'):
             with mock.patch('neutron.common.utils.replace_file'):
                 with mock.patch('os.listdir'):
@@ -148,7 +251,7 @@ class TestHaproxyCfg(base.BaseTestCase):
               "weight 13 check inter 30s fall 3 cookie sample_member_id_1\n"
               "    server sample_member_id_2 10.0.0.98:82 "
               "weight 13 check inter 30s fall 3 cookie sample_member_id_2\n\n"
-              % sample_configs.PIPED_CODES)
+              % sample_configs.EXPECTED_CODES)
         rendered_obj = jinja_cfg.render_loadbalancer_obj(
             sample_configs.sample_loadbalancer_tuple(),
             'nogroup', '/sock_path', '/v2')
@@ -175,7 +278,7 @@ class TestHaproxyCfg(base.BaseTestCase):
               "weight 13 check inter 30s fall 3 cookie sample_member_id_1\n"
               "    server sample_member_id_2 10.0.0.98:82 "
               "weight 13 check inter 30s fall 3 cookie sample_member_id_2\n\n"
-              % sample_configs.PIPED_CODES)
+              % sample_configs.EXPECTED_CODES)
         rendered_obj = jinja_cfg.render_loadbalancer_obj(
             sample_configs.sample_loadbalancer_tuple(proto='HTTPS'),
             'nogroup', '/sock_path', '/v2')
@@ -265,7 +368,7 @@ class TestHaproxyCfg(base.BaseTestCase):
               "weight 13 check inter 30s fall 3\n"
               "    server sample_member_id_2 10.0.0.98:82 "
               "weight 13 check inter 30s fall 3\n\n"
-              % sample_configs.PIPED_CODES)
+              % sample_configs.EXPECTED_CODES)
         rendered_obj = jinja_cfg.render_loadbalancer_obj(
             sample_configs.sample_loadbalancer_tuple(
                 persistence_type='SOURCE_IP'),
@@ -289,7 +392,7 @@ class TestHaproxyCfg(base.BaseTestCase):
                       "weight 13 check inter 30s fall 3\n"
                       "    server sample_member_id_2 10.0.0.98:82 "
                       "weight 13 check inter 30s fall 3\n\n"
-                      % sample_configs.PIPED_CODES)
+                      % sample_configs.EXPECTED_CODES)
                 rendered_obj = jinja_cfg.render_loadbalancer_obj(
                     sample_configs.sample_loadbalancer_tuple(
                         persistence_type='APP_COOKIE'),
@@ -366,6 +469,84 @@ class TestHaproxyCfg(base.BaseTestCase):
                                   tls)]
             store_cert.call_args_list == calls_ac
 
+    def test_store_listener_crt_unchanged(self):
+        l = sample_configs.sample_listener_tuple(tls=True, sni=True)
+        with mock.patch('os.makedirs'), \
+                mock.patch('os.path.exists') as path_exists, \
+                mock.patch('neutron.common.utils.replace_file') as replace:
+            path_exists.return_value = False
+            jinja_cfg._store_listener_crt(
+                '/v2/loadbalancers', l, l.default_tls_container)
+            self.assertEqual(1, replace.call_count)
+
+            path_exists.return_value = True
+            jinja_cfg._store_listener_crt(
+                '/v2/loadbalancers', l, l.default_tls_container)
+            self.assertEqual(1, replace.call_count)
+
+            jinja_cfg._store_listener_crt(
+                '/v2/loadbalancers', l,
+                l.default_tls_container._replace(certificate='imaNewCert'))
+            self.assertEqual(2, replace.call_count)
+
+    def test_store_listener_crt_existing_file(self):
+        l = sample_configs.sample_listener_tuple(tls=True, sni=True)
+        pem = jinja_cfg._build_pem(l.default_tls_container)
+        with mock.patch('os.makedirs'), \
+                mock.patch('os.path.exists') as path_exists, \
+                mock.patch('six.moves.builtins.open',
+                           mock.mock_open(read_data=pem)), \
+                mock.patch('neutron.common.utils.replace_file') as replace:
+            path_exists.return_value = True
+            jinja_cfg._store_listener_crt(
+                '/v2/loadbalancers', l, l.default_tls_container)
+            self.assertFalse(replace.called)
+
+    def test_cert_cache(self):
+        cert = mock.Mock(spec=cert_manager.Cert)
+        cert.get_certificate.return_value = 'imaCert'
+        cert.get_private_key.return_value = 'imaPrivateKey'
+        cert.get_private_key_passphrase.return_value = None
+        cert.get_intermediates.return_value = []
+        cert_mgr = mock.Mock(spec=cert_manager.CertManager)
+        cert_mgr.get_cert.return_value = cert
+        cache = jinja_cfg._cert_cache
+        ttl = cfg.CONF.haproxy.cert_cache_ttl
+
+        with mock.patch.object(cert_parser, 'get_host_names') as cp, \
+                mock.patch.object(cert_parser, 'dump_private_key') as dp, \
+                mock.patch('time.time') as now:
+            cp.return_value = {'cn': 'fakeCN'}
+            dp.return_value = 'imaPrivateKey'
+            now.return_value = 1000
+            for i in range(3):
+                tls = cache.get(cert_mgr, 'tenant', 'cont_id_1', 'lb_url')
+                self.assertEqual('fakeCN', tls.primary_cn)
+            self.assertEqual(1, cert_mgr.get_cert.call_count)
+            self.assertEqual((2, 1), (cache.hits, cache.misses))
+
+            # the same certificate is parsed once for every container
+            cache.get(cert_mgr, 'tenant', 'cont_id_2', 'lb_url')
+            self.assertEqual(2, cert_mgr.get_cert.call_count)
+            self.assertEqual(1, cp.call_count)
+            self.assertEqual(1, dp.call_count)
+
+            # an expired certificate is retrieved and parsed again, the
+            # decrypted private keys are not kept past the ttl
+            now.return_value = 1000 + ttl
+            cache.get(cert_mgr, 'tenant', 'cont_id_1', 'lb_url')
+            self.assertEqual(3, cert_mgr.get_cert.call_count)
+            self.assertEqual(2, dp.call_count)
+            self.assertEqual(1, len(cache._containers))
+            self.assertEqual(1, len(cache._parsed))
+            self.assertEqual((2, 3), (cache.hits, cache.misses))
+
+            now.return_value += ttl
+            cache._expire(cache._containers)
+            cache._expire(cache._parsed)
+            self.assertFalse(cache._containers)
+            self.assertFalse(cache._parsed)
+
     def test_get_primary_cn(self):
         cert = mock.MagicMock()
 
@@ -474,30 +655,70 @@ class TestHaproxyCfg(base.BaseTestCase):
                                                admin_state_up=False))
         self.assertFalse(ret)
 
-    def test_expand_expected_codes(self):
+    def test_merge_expected_codes(self):
         exp_codes = ''
-        self.assertEqual(set([]), jinja_cfg._expand_expected_codes(exp_codes))
+        self.assertEqual([], jinja_cfg._merge_expected_codes(exp_codes))
         exp_codes = '200'
-        self.assertEqual(set(['200']),
-                         jinja_cfg._expand_expected_codes(exp_codes))
+        self.assertEqual([(200, 200)],
+                         jinja_cfg._merge_expected_codes(exp_codes))
         exp_codes = '200, 201'
-        self.assertEqual(set(['200', '201']),
-                         jinja_cfg._expand_expected_codes(exp_codes))
+        self.assertEqual([(200, 201)],
+                         jinja_cfg._merge_expected_codes(exp_codes))
         exp_codes = '200, 201,202'
-        self.assertEqual(set(['200', '201', '202']),
-                         jinja_cfg._expand_expected_codes(exp_codes))
+        self.assertEqual([(200, 202)],
+                         jinja_cfg._merge_expected_codes(exp_codes))
         exp_codes = '200-202'
-        self.assertEqual(set(['200', '201', '202']),
-                         jinja_cfg._expand_expected_codes(exp_codes))
+        self.assertEqual([(200, 202)],
+                         jinja_cfg._merge_expected_codes(exp_codes))
         exp_codes = '200-202, 205'
-        self.assertEqual(set(['200', '201', '202', '205']),
-                         jinja_cfg._expand_expected_codes(exp_codes))
+        self.assertEqual([(200, 202), (205, 205)],
+                         jinja_cfg._merge_expected_codes(exp_codes))
         exp_codes = '200, 201-203'
-        self.assertEqual(set(['200', '201', '202', '203']),
-                         jinja_cfg._expand_expected_codes(exp_codes))
+        self.assertEqual([(200, 203)],
+                         jinja_cfg._merge_expected_codes(exp_codes))
         exp_codes = '200, 201-203, 205'
-        self.assertEqual(set(['200', '201', '202', '203', '205']),
-                         jinja_cfg._expand_expected_codes(exp_codes))
+        self.assertEqual([(200, 203), (205, 205)],
+                         jinja_cfg._merge_expected_codes(exp_codes))
         exp_codes = '201-200, 205'
-        self.assertEqual(set(['205']),
-                         jinja_cfg._expand_expected_codes(exp_codes))
+        self.assertEqual([(205, 205)],
+                         jinja_cfg._merge_expected_codes(exp_codes))
+        exp_codes = '300-399, 200-310'
+        self.assertEqual([(200, 399)],
+                         jinja_cfg._merge_expected_codes(exp_codes))
+
+    def test_compile_expected_codes(self):
+        self.assertEqual(('rstatus', ''),
+                         jinja_cfg._compile_expected_codes(''))
+        self.assertEqual(('status', '200'),
+                         jinja_cfg._compile_expected_codes('200'))
+        self.assertEqual(('status', '200'),
+                         jinja_cfg._compile_expected_codes('200-200, 200'))
+        self.assertEqual(('rstatus', '^[23][0-9][0-9]$'),
+                         jinja_cfg._compile_expected_codes('200-299, 300-399'))
+        self.assertEqual(('rstatus', '^(20[0-2]|205)$'),
+                         jinja_cfg._compile_expected_codes('200-202, 205'))
+        self.assertEqual(
+            ('rstatus', '^(20[4-9]|2[1-9][0-9]|3[0-8][0-9]|39[0-8])$'),
+            jinja_cfg._compile_expected_codes('204-398'))
+
+    def test_compile_expected_codes_matches(self):
+        for codes in ('100-599', '201-203, 299-401, 404', '99-100, 500'):
+            expected = set()
+            for code in codes.replace(',', ' ').split():
+                low, _sep, hi = code.partition('-')
+                expected.update(range(int(low), int(hi or low) + 1))
+            regex = re.compile(jinja_cfg._compile_expected_codes(codes)[1])
+            self.assertEqual(expected, set(
+                code for code in range(1000) if regex.search(str(code))))
+
+    def test_compile_expected_codes_size(self):
+        # every code of the range joined with '|' took 1999 characters
+        self.assertEqual('^[1-5][0-9][0-9]$',
+                         jinja_cfg._compile_expected_codes('100-599')[1])
+
+    def test_compile_expected_codes_cached(self):
+        with mock.patch.object(jinja_cfg, '_merge_expected_codes',
+                               wraps=jinja_cfg._merge_expected_codes) as m:
+            jinja_cfg._compile_expected_codes('200-209, 301')
+            jinja_cfg._compile_expected_codes('200-209, 301')
+            self.assertEqual(1, m.call_count)
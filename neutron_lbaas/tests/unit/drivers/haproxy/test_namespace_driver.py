@@ -17,6 +17,7 @@ import collections
 import socket
 
 import mock
+import netaddr
 from neutron.agent.linux import external_process
 from neutron.plugins.common import constants
 from neutron_lib import exceptions
@@ -37,6 +38,9 @@ class TestHaproxyNSDriver(base.BaseTestCase):
         conf.interface_driver = 'intdriver'
         conf.haproxy.user_group = 'test_group'
         conf.haproxy.send_gratuitous_arp = 3
+        conf.haproxy.runtime_member_updates = False
+        conf.haproxy.namespace_pool_size = 0
+        conf.haproxy.shared_process = False
         self.conf = conf
         self.rpc_mock = mock.Mock()
         self.ensure_dir = mock.patch.object(fileutils, 'ensure_tree').start()
@@ -51,6 +55,8 @@ class TestHaproxyNSDriver(base.BaseTestCase):
         self.vif_driver = mock.Mock()
         self.driver.vif_driver = self.vif_driver
         self._build_mock_data_models()
+        # contents of the ip batch files of the routes
+        self.batches = []
 
     def _build_mock_data_models(self):
         host_route = data_models.HostRoute(destination='0.0.0.0/0',
@@ -65,7 +71,8 @@ class TestHaproxyNSDriver(base.BaseTestCase):
                                 fixed_ips=[fixed_ip])
         self.lb = data_models.LoadBalancer(id='lb1', listeners=[],
                                            vip_port=port,
-                                           vip_address='10.0.0.1')
+                                           vip_address='10.0.0.1',
+                                           vip_subnet_id='subnet1')
 
     def test_get_name(self):
         self.assertEqual(namespace_driver.DRIVER_NAME, self.driver.get_name())
@@ -141,7 +148,14 @@ class TestHaproxyNSDriver(base.BaseTestCase):
         list_dir.assert_called_once_with(self.driver.state_path)
         self.driver.exists.assert_called_once_with('lb2')
         self.driver.undeploy_instance.assert_called_once_with(
-            'lb2', cleanup_namespace=True)
+            'lb2', cleanup_namespace=True, delete_namespace=False)
+
+        # the namespace of an orphan taken from the pool is released
+        self.driver.undeploy_instance.reset_mock()
+        self.driver._namespaces['lb2'] = 'qlbaas-pool-1'
+        self.driver.remove_orphans(lb_ids)
+        self.driver.undeploy_instance.assert_called_once_with(
+            'lb2', cleanup_namespace=True, delete_namespace=True)
 
     def test_get_stats(self):
         # Shamelessly stolen from v1 namespace driver tests.
@@ -181,7 +195,7 @@ class TestHaproxyNSDriver(base.BaseTestCase):
             gsp.side_effect = lambda x, y, z: '/pool/' + y
             path_exists.return_value = True
             mocket.return_value = mocket
-            mocket.recv.return_value = raw_stats
+            mocket.recv.side_effect = [raw_stats, '']
             is_active.return_value = True
 
             exp_stats = {'connection_errors': '0',
@@ -210,7 +224,7 @@ class TestHaproxyNSDriver(base.BaseTestCase):
             stats = self.driver.get_stats(self.lb.id)
             self.assertEqual(exp_stats, stats)
 
-            mocket.recv.return_value = raw_stats_empty
+            mocket.recv.side_effect = [raw_stats_empty, '']
             self.assertEqual({'members': {}},
                              self.driver.get_stats(self.lb.id))
 
@@ -232,6 +246,17 @@ class TestHaproxyNSDriver(base.BaseTestCase):
             self.assertEqual({}, self.driver.get_stats(self.lb.id))
             self.assertFalse(mocket.called)
 
+    @mock.patch('socket.socket')
+    def test_get_stats_from_socket_reads_whole_output(self, mocket):
+        mock_socket = mocket.return_value
+        mock_socket.recv.side_effect = ['# pxname,svname,type,stot\n',
+                                        'pool,BACKEND,1,10\n', '']
+        lb_stats, servers_stats = self.driver._get_stats_from_socket(
+            '/path', 6)
+        self.assertEqual('10', lb_stats['total_connections'])
+        self.assertEqual({}, servers_stats)
+        mock_socket.close.assert_called_once_with()
+
     def test_is_active(self):
         # test no listeners
         ret_val = self.driver._is_active(self.lb)
@@ -261,6 +286,12 @@ class TestHaproxyNSDriver(base.BaseTestCase):
         ret_val = self.driver._is_active(self.lb)
         self.assertTrue(ret_val)
 
+    @mock.patch.object(namespace_driver.lockutils, 'lock')
+    def test_deploy_instance_locks_loadbalancer(self, mock_lock):
+        self.driver.deployable = mock.Mock(return_value=False)
+        self.driver.deploy_instance(self.lb)
+        mock_lock.assert_called_once_with('haproxy-driver-%s' % self.lb.id)
+
     def test_deploy_instance(self):
         self.driver.deployable = mock.Mock(return_value=False)
         self.driver.exists = mock.Mock(return_value=True)
@@ -307,6 +338,57 @@ class TestHaproxyNSDriver(base.BaseTestCase):
             self.driver._spawn.assert_called_once_with(self.lb,
                                                        ['-sf', '123'])
 
+    @mock.patch('neutron.common.utils.replace_file')
+    @mock.patch('neutron_lbaas.drivers.haproxy.runtime_api.send_commands')
+    @mock.patch('neutron_lbaas.drivers.haproxy.jinja_cfg.'
+                'render_loadbalancer_obj')
+    def test_update_at_runtime(self, render, send_commands, replace_file):
+        self.driver._get_state_file_path = mock.Mock(return_value='/path')
+        self.driver._spawn = mock.Mock()
+        runtime_state = mock.Mock()
+        new_state = mock.Mock()
+        runtime_state.get_commands.return_value = (['set weight p/m 2'],
+                                                   new_state)
+        self.driver._runtime_states[self.lb.id] = runtime_state
+        send_commands.return_value = True
+
+        self.driver.update(self.lb)
+
+        runtime_state.get_commands.assert_called_once_with(
+            render.return_value)
+        send_commands.assert_called_once_with('/path', ['set weight p/m 2'])
+        replace_file.assert_called_once_with('/path', render.return_value)
+        self.assertFalse(self.driver._spawn.called)
+        self.assertEqual(1, self.driver.reloads_avoided)
+        self.assertIs(new_state, self.driver._runtime_states[self.lb.id])
+
+    @mock.patch('neutron_lbaas.drivers.haproxy.runtime_api.send_commands')
+    @mock.patch('neutron_lbaas.drivers.haproxy.jinja_cfg.'
+                'render_loadbalancer_obj')
+    def test_update_at_runtime_fallback(self, render, send_commands):
+        self.driver._get_state_file_path = mock.Mock(return_value='/path')
+        self.driver._spawn = mock.Mock()
+        runtime_state = mock.Mock()
+        self.driver._runtime_states[self.lb.id] = runtime_state
+
+        # structural change
+        runtime_state.get_commands.return_value = (None, None)
+        with mock.patch('six.moves.builtins.open') as m_open:
+            m_open.return_value.__iter__.return_value = iter(['123'])
+            self.driver.update(self.lb)
+        self.assertFalse(send_commands.called)
+        self.driver._spawn.assert_called_once_with(self.lb, ['-sf', '123'])
+
+        # rejected commands
+        self.driver._spawn.reset_mock()
+        runtime_state.get_commands.return_value = (['cmd'], mock.Mock())
+        send_commands.return_value = False
+        with mock.patch('six.moves.builtins.open') as m_open:
+            m_open.return_value.__iter__.return_value = iter(['123'])
+            self.driver.update(self.lb)
+        self.assertTrue(self.driver._spawn.called)
+        self.assertEqual(0, self.driver.reloads_avoided)
+
     @mock.patch('socket.socket')
     @mock.patch('os.path.exists')
     @mock.patch('neutron.agent.linux.ip_lib.IPWrapper')
@@ -371,8 +453,274 @@ class TestHaproxyNSDriver(base.BaseTestCase):
         self.driver.create(self.lb)
         self.driver._plug.assert_called_once_with(
             namespace_driver.get_ns_name(self.lb.id),
-            self.lb.vip_port, self.lb.vip_address)
+            self.lb.vip_port, self.lb.vip_address, route_table=None)
+        self.driver._spawn.assert_called_once_with(self.lb)
+        self.assertEqual(1, self.driver.create_timings['unpooled'][0])
+
+    @mock.patch('eventlet.spawn_n')
+    @mock.patch('neutron.common.utils.replace_file')
+    def test_create_from_namespace_pool(self, replace_file, spawn_n):
+        self.driver._plug = mock.Mock()
+        self.driver._spawn = mock.Mock()
+        self.driver._namespace_pool = ['qlbaas-pool-1']
+        self.driver.create(self.lb)
+        self.driver._plug.assert_called_once_with(
+            'qlbaas-pool-1', self.lb.vip_port, self.lb.vip_address,
+            route_table=None)
+        replace_file.assert_called_once_with(
+            '/the/path/v2/lb1/namespace', 'qlbaas-pool-1')
+        spawn_n.assert_called_once_with(self.driver._fill_namespace_pool)
+        self.assertEqual([], self.driver._namespace_pool)
+        self.assertEqual('qlbaas-pool-1',
+                         self.driver._get_namespace(self.lb.id))
+        self.assertEqual(1, self.driver.create_timings['pooled'][0])
+
+    @mock.patch('os.path.exists')
+    @mock.patch('os.listdir')
+    @mock.patch('os.path.isdir')
+    def test_load_namespaces(self, isdir, listdir, exists):
+        self.assertEqual(namespace_driver.get_ns_name(self.lb.id),
+                         self.driver._get_namespace(self.lb.id))
+        isdir.return_value = True
+        listdir.return_value = [self.lb.id, 'lb2']
+        exists.side_effect = lambda path: 'lb1' in path
+        files = {'/the/path/v2/lb1/namespace': 'qlbaas-subnet-subnet1\n',
+                 '/the/path/v2/lb1/route_table': '1001'}
+        with mock.patch('six.moves.builtins.open',
+                        side_effect=lambda path: mock.mock_open(
+                            read_data=files[path])()):
+            self.driver._load_namespaces()
+        self.assertEqual('qlbaas-subnet-subnet1',
+                         self.driver._get_namespace(self.lb.id))
+        self.assertEqual({'lb1': 1001}, self.driver._route_tables)
+        self.assertEqual(namespace_driver.get_ns_name('lb2'),
+                         self.driver._get_namespace('lb2'))
+
+    @mock.patch('neutron.agent.linux.ip_lib.IPWrapper')
+    def test_release_namespace(self, ip_wrap):
+        self.conf.haproxy.namespace_pool_size = 1
+        mock_ns = ip_wrap.return_value
+        mock_ns.get_devices.return_value = [collections.namedtuple(
+            'Device', ['name'])(name='test_device')]
+        self.driver._release_namespace('qlbaas-pool-1')
+        self.vif_driver.unplug.assert_called_once_with(
+            'test_device', namespace='qlbaas-pool-1')
+        self.assertFalse(mock_ns.garbage_collect_namespace.called)
+        self.assertEqual(['qlbaas-pool-1'], self.driver._namespace_pool)
+
+        # the pool is full
+        self.driver._release_namespace('qlbaas-pool-2')
+        ip_wrap.assert_called_with(namespace='qlbaas-pool-2')
+        mock_ns.garbage_collect_namespace.assert_called_once_with()
+        self.assertEqual(['qlbaas-pool-1'], self.driver._namespace_pool)
+
+        # namespaces named after their loadbalancer are not reused
+        self.driver._namespace_pool = []
+        mock_ns.reset_mock()
+        self.driver._release_namespace(
+            namespace_driver.get_ns_name(self.lb.id))
+        mock_ns.garbage_collect_namespace.assert_called_once_with()
+        self.assertEqual([], self.driver._namespace_pool)
+
+    @mock.patch('neutron.agent.linux.ip_lib.IPWrapper')
+    def test_release_namespace_takes_pool_lock(self, ip_wrap):
+        self.conf.haproxy.namespace_pool_size = 1
+        ip_wrap.return_value.get_devices.return_value = []
+        with mock.patch.object(namespace_driver.lockutils,
+                               'lock') as lock:
+            self.driver._release_namespace('qlbaas-pool-1')
+        lock.assert_called_once_with('haproxy-namespace-pool')
+        self.assertEqual(['qlbaas-pool-1'], self.driver._namespace_pool)
+
+    @mock.patch('oslo_utils.uuidutils.generate_uuid')
+    @mock.patch('neutron.agent.linux.ip_lib.IPWrapper')
+    def test_fill_namespace_pool(self, ip_wrap, generate_uuid):
+        self.conf.haproxy.namespace_pool_size = 2
+        generate_uuid.side_effect = ['1', '2']
+        self.driver._fill_namespace_pool()
+        ip_wrap.return_value.ensure_namespace.assert_has_calls(
+            [mock.call('qlbaas-pool-1'), mock.call('qlbaas-pool-2')])
+        self.assertEqual(['qlbaas-pool-1', 'qlbaas-pool-2'],
+                         self.driver._namespace_pool)
+
+    def test_init_namespace_pool(self):
+        self.driver._namespaces['lb1'] = 'qlbaas-pool-1'
+        self.driver._release_namespace = mock.Mock()
+        self.driver._fill_namespace_pool = mock.Mock()
+        with mock.patch('neutron.agent.linux.ip_lib.IPWrapper.'
+                        'get_namespaces') as get_namespaces:
+            get_namespaces.return_value = ['qlbaas-pool-1', 'qlbaas-pool-2',
+                                           'qlbaas-lb2', 'qrouter-1']
+            self.driver._init_namespace_pool()
+        self.driver._release_namespace.assert_called_once_with(
+            'qlbaas-pool-2')
+        self.driver._fill_namespace_pool.assert_called_once_with()
+
+    @mock.patch('neutron.common.utils.replace_file')
+    def test_create_shared(self, replace_file):
+        self.conf.haproxy.shared_process = True
+        self.driver._plug = mock.Mock()
+        self.driver._spawn = mock.Mock()
+        self.driver._route_tables = {'lb2': 1000, 'lb3': 1002}
+        self.driver.create(self.lb)
+        self.driver._plug.assert_called_once_with(
+            'qlbaas-subnet-subnet1', self.lb.vip_port, self.lb.vip_address,
+            route_table=1001)
+        self.assertEqual([
+            mock.call('/the/path/v2/lb1/route_table', '1001'),
+            mock.call('/the/path/v2/lb1/namespace', 'qlbaas-subnet-subnet1')],
+            replace_file.call_args_list)
+        self.assertEqual(1001, self.driver._route_tables[self.lb.id])
         self.driver._spawn.assert_called_once_with(self.lb)
+        self.assertEqual('qlbaas-subnet-subnet1',
+                         self.driver._get_namespace(self.lb.id))
+        self.assertEqual(1, self.driver.create_timings['shared'][0])
+
+    @mock.patch('neutron.common.utils.ensure_dir')
+    @mock.patch('neutron_lbaas.drivers.haproxy.jinja_cfg.save_shared_config')
+    @mock.patch('neutron.agent.linux.external_process.ProcessManager')
+    def test_spawn_shared(self, pm_cls, save_shared_config, ensure_dir):
+        pm = pm_cls.return_value
+        pm.active = False
+        self.driver._namespaces = {'lb1': 'qlbaas-subnet-subnet1',
+                                   'lb2': 'qlbaas-subnet-subnet1',
+                                   'lb3': 'qlbaas-subnet-subnet2'}
+        self.driver.deployed_loadbalancers['lb1'] = self.lb
+        self.rpc_mock.get_loadbalancer.return_value = {'id': 'lb2'}
+        self.driver.deployable = mock.Mock(return_value=True)
+
+        self.assertEqual(2, self.driver._spawn_shared('subnet1'))
+        self.rpc_mock.get_loadbalancer.assert_called_once_with('lb2')
+        conf_dir = '/the/path/v2-shared/subnet1/%s'
+        save_shared_config.assert_called_once_with(
+            conf_dir % 'haproxy.conf', 'subnet subnet1',
+            [(self.lb, '/the/path/v2/lb1/'), (mock.ANY, '/the/path/v2/lb2/')],
+            conf_dir % 'haproxy_stats.sock', 'test_group')
+        self.assertEqual('lb2', save_shared_config.call_args[0][2][1][0].id)
+        pm_cls.assert_called_once_with(
+            uuid='subnet1', default_cmd_callback=mock.ANY,
+            namespace='qlbaas-subnet-subnet1', service='lbaas-ns-haproxy',
+            conf=self.conf, pids_path='/the/path/v2-shared/subnet1',
+            pid_file=conf_dir % 'haproxy.pid', custom_reload_callback=mock.ANY)
+        pm.enable.assert_called_once_with()
+        self._process_monitor.register.assert_called_once_with(
+            uuid='subnet1', service_name='lbaas-ns-haproxy',
+            monitored_process=pm)
+        callback = pm_cls.call_args[1]['default_cmd_callback']
+        self.assertEqual(['haproxy', '-f', conf_dir % 'haproxy.conf', '-p',
+                          conf_dir % 'haproxy.pid'],
+                         callback(conf_dir % 'haproxy.pid'))
+
+        # hitless reload of the running haproxy
+        pm.active = True
+        with mock.patch('six.moves.builtins.open') as m_open:
+            file_mock = mock.MagicMock()
+            m_open.return_value = file_mock
+            file_mock.__enter__.return_value = file_mock
+            file_mock.__iter__.return_value = iter(['123'])
+            self.assertEqual(2, self.driver._spawn_shared('subnet1'))
+        pm.reload_cfg.assert_called_once_with()
+        callback = pm_cls.call_args[1]['custom_reload_callback']
+        self.assertEqual(['haproxy', '-f', conf_dir % 'haproxy.conf', '-p',
+                          conf_dir % 'haproxy.pid',
+                          '-x', conf_dir % 'haproxy_stats.sock',
+                          '-sf', '123'],
+                         callback(conf_dir % 'haproxy.pid'))
+
+        # the configuration did not change
+        pm.reload_cfg.reset_mock()
+        save_shared_config.return_value = False
+        self.driver._spawn_shared('subnet1')
+        self.assertFalse(pm.reload_cfg.called)
+
+    @mock.patch('shutil.rmtree')
+    @mock.patch('os.path.isdir')
+    @mock.patch('neutron.agent.linux.external_process.ProcessManager')
+    def test_spawn_shared_without_loadbalancers(self, pm_cls, isdir, rmtree):
+        isdir.return_value = True
+        self.assertEqual(0, self.driver._spawn_shared('subnet1'))
+        pm_cls.return_value.disable.assert_called_once_with()
+        self._process_monitor.unregister.assert_called_once_with(
+            uuid='subnet1', service_name='lbaas-ns-haproxy')
+        rmtree.assert_called_once_with('/the/path/v2-shared/subnet1')
+
+    @mock.patch('shutil.rmtree')
+    @mock.patch('neutron.agent.linux.external_process.ProcessManager')
+    @mock.patch('neutron.agent.linux.ip_lib.IPWrapper')
+    def test_undeploy_shared(self, ip_wrap, pm_cls, rmtree):
+        self.driver._spawn_shared = mock.Mock(return_value=1)
+        self.driver._unplug = mock.Mock()
+        self.driver._restore_shared_routes = mock.Mock()
+        self.driver._execute_ip_batch = mock.Mock()
+        self.driver._namespaces[self.lb.id] = 'qlbaas-subnet-subnet1'
+        self.driver._route_tables[self.lb.id] = 1000
+        self.driver.deployed_loadbalancers[self.lb.id] = self.lb
+        self.driver.undeploy_instance(self.lb.id, cleanup_namespace=True,
+                                      delete_namespace=True)
+        self.assertFalse(pm_cls.called)
+        self.driver._execute_ip_batch.assert_called_once_with(
+            'qlbaas-subnet-subnet1', '10.0.0.1',
+            ['rule del from 10.0.0.1 table 1000'])
+        self.assertNotIn(self.lb.id, self.driver._route_tables)
+        self.driver._unplug.assert_called_once_with('qlbaas-subnet-subnet1',
+                                                    self.lb.vip_port)
+        self.driver._spawn_shared.assert_called_once_with('subnet1')
+        self.driver._restore_shared_routes.assert_called_once_with(
+            'qlbaas-subnet-subnet1')
+        self.assertFalse(ip_wrap.called)
+        self.assertNotIn(self.lb.id, self.driver._namespaces)
+        self.assertNotIn(self.lb.id, self.driver.deployed_loadbalancers)
+
+        # the last loadbalancer of the subnet
+        self.driver._spawn_shared.return_value = 0
+        self.driver._namespaces[self.lb.id] = 'qlbaas-subnet-subnet1'
+        self.driver.undeploy_instance(self.lb.id, delete_namespace=True)
+        ip_wrap.assert_called_once_with(namespace='qlbaas-subnet-subnet1')
+        mock_ns = ip_wrap.return_value
+        mock_ns.garbage_collect_namespace.assert_called_once_with()
+        # the devices of the other loadbalancers are left alone
+        self.assertFalse(mock_ns.get_devices.called)
+        self.assertEqual(1, self.driver._restore_shared_routes.call_count)
+
+    def test_restore_shared_routes(self):
+        self.driver._add_routes = mock.Mock()
+        lb2 = data_models.LoadBalancer(id='lb2', vip_port=mock.Mock())
+        self.driver._namespaces = {'lb1': 'qlbaas-subnet-subnet2',
+                                   'lb2': 'qlbaas-subnet-subnet1',
+                                   'lb3': 'qlbaas-subnet-subnet1'}
+        self.driver.deployed_loadbalancers = {'lb1': self.lb, 'lb2': lb2,
+                                              'lb3': mock.Mock()}
+        self.driver._restore_shared_routes('qlbaas-subnet-subnet1')
+        self.driver._add_routes.assert_called_once_with(
+            'qlbaas-subnet-subnet1', lb2.vip_port)
+
+        # no loadbalancer is left to hold the routes
+        self.driver._add_routes.reset_mock()
+        self.driver._restore_shared_routes('qlbaas-subnet-subnet3')
+        self.assertFalse(self.driver._add_routes.called)
+
+    @mock.patch('os.path.exists')
+    def test_get_stats_shared(self, exists):
+        exists.return_value = True
+        self.driver._namespaces = {'lb1': 'qlbaas-subnet-subnet1',
+                                   'lb2': 'qlbaas-subnet-subnet1'}
+        self.driver.deployed_loadbalancers = {
+            'lb1': data_models.LoadBalancer(
+                id='lb1', pools=[data_models.Pool(id='pool1')]),
+            'lb2': data_models.LoadBalancer(
+                id='lb2', pools=[data_models.Pool(id='pool2')])}
+        self.driver._read_stats_from_socket = mock.Mock(return_value=[
+            '# pxname,svname,scur,type',
+            'pool1,BACKEND,1,1', 'pool1,member1,1,2',
+            'pool2,BACKEND,2,1', 'pool2,member2,2,2'])
+        stats1 = self.driver.get_stats('lb1')
+        stats2 = self.driver.get_stats('lb2')
+        self.driver._read_stats_from_socket.assert_called_once_with(
+            '/the/path/v2-shared/subnet1/haproxy_stats.sock', 6)
+        self.assertEqual('1', stats1['active_connections'])
+        self.assertEqual(['member1'], list(stats1['members']))
+        self.assertEqual('2', stats2['active_connections'])
+        self.assertEqual(['member2'], list(stats2['members']))
 
     def test_deployable(self):
         # test None
@@ -421,9 +769,10 @@ class TestHaproxyNSDriver(base.BaseTestCase):
         self.assertEqual('/the/path/v2/lb1/conf', path)
         self.assertTrue(ensure_dir.called)
 
+    @mock.patch('eventlet.spawn_n', side_effect=lambda f, *a: f(*a))
     @mock.patch('neutron.agent.linux.ip_lib.device_exists')
     @mock.patch('neutron.agent.linux.ip_lib.IPWrapper')
-    def test_plug(self, ip_wrap, device_exists):
+    def test_plug(self, ip_wrap, device_exists, spawn_n):
         device_exists.return_value = True
         interface_name = 'tap-d4nc3'
         self.vif_driver.get_device_name.return_value = interface_name
@@ -438,6 +787,7 @@ class TestHaproxyNSDriver(base.BaseTestCase):
         device_exists.reset_mock()
         self.rpc_mock.plug_vip_port.reset_mock()
         mock_ns = ip_wrap.return_value
+        mock_ns.netns.execute.side_effect = self._read_batch
         self.driver._plug('ns1', self.lb.vip_port, self.lb.vip_address)
         self.rpc_mock.plug_vip_port.assert_called_once_with(
             self.lb.vip_port.id)
@@ -447,13 +797,79 @@ class TestHaproxyNSDriver(base.BaseTestCase):
         expected_cidrs = ['10.0.0.1/24']
         self.vif_driver.init_l3.assert_called_once_with(
             interface_name, expected_cidrs, namespace='ns1')
-        calls = [mock.call(['route', 'add', 'default', 'gw', '192.0.0.1'],
-                           check_exit_code=False),
-                 mock.call(['arping', '-U', '-I', interface_name,
-                            '-c', 3, '10.0.0.1'],
-                           check_exit_code=False)]
-        mock_ns.netns.execute.has_calls(calls)
-        self.assertEqual(2, mock_ns.netns.execute.call_count)
+        ip_wrap.assert_called_with(namespace='ns1')
+        self.assertEqual([
+            mock.call(['ip', '-4', '-force', '-batch', mock.ANY],
+                      check_exit_code=False),
+            mock.call(['arping', '-U', '-I', interface_name, '-c', 3,
+                       '10.0.0.1'], check_exit_code=False)],
+            mock_ns.netns.execute.call_args_list)
+        self.assertEqual(['route add default via 10.0.0.2\n'],
+                         self.batches)
+        for phase in ('vif', 'l3', 'routes', 'arp'):
+            self.assertEqual(1, self.driver.plug_timings[phase][0])
+
+    @mock.patch('eventlet.spawn_n')
+    @mock.patch('neutron.agent.linux.ip_lib.device_exists')
+    @mock.patch('neutron.agent.linux.ip_lib.IPWrapper')
+    def test_plug_host_routes(self, ip_wrap, device_exists, spawn_n):
+        device_exists.return_value = True
+        subnet = self.lb.vip_port.fixed_ips[0].subnet
+        subnet.gateway_ip = None
+        subnet.host_routes.append(data_models.HostRoute(
+            destination='10.1.0.0/16', nexthop='10.0.0.3'))
+        ip_wrap.return_value.netns.execute.side_effect = self._read_batch
+        self.driver._plug('ns1', self.lb.vip_port, self.lb.vip_address)
+        self.assertEqual(1, ip_wrap.return_value.netns.execute.call_count)
+        self.assertEqual(['route add 10.1.0.0/16 via 10.0.0.3\n'],
+                         self.batches)
+        self.assertFalse(spawn_n.called)
+
+    @mock.patch('eventlet.spawn_n')
+    @mock.patch('neutron.agent.linux.ip_lib.device_exists')
+    @mock.patch('neutron.agent.linux.ip_lib.IPWrapper')
+    def test_plug_shared(self, ip_wrap, device_exists, spawn_n):
+        device_exists.return_value = True
+        self.vif_driver.get_device_name.return_value = 'tap-d4nc3'
+        subnet = self.lb.vip_port.fixed_ips[0].subnet
+        subnet.host_routes.append(data_models.HostRoute(
+            destination='10.1.0.0/16', nexthop='10.0.0.3'))
+        mock_ns = ip_wrap.return_value
+        mock_ns.netns.execute.side_effect = self._read_batch
+        self.driver._plug('qlbaas-subnet-subnet1', self.lb.vip_port,
+                          self.lb.vip_address, route_table=1000)
+        self.assertEqual([
+            mock.call(['sysctl', '-w', 'net.ipv4.conf.all.arp_ignore=1',
+                       'net.ipv4.conf.all.arp_announce=2']),
+            mock.call(['ip', '-4', '-force', '-batch', mock.ANY],
+                      check_exit_code=False)],
+            mock_ns.netns.execute.call_args_list)
+        # the replies of the VIP leave through its own device
+        self.assertEqual(['route add 10.1.0.0/16 via 10.0.0.3\n'
+                          'route add default via 10.0.0.2\n'
+                          'route add 10.0.0.0/24 dev tap-d4nc3 table 1000\n'
+                          'route add 10.1.0.0/16 via 10.0.0.3 dev tap-d4nc3 '
+                          'table 1000\n'
+                          'route add default via 10.0.0.2 dev tap-d4nc3 '
+                          'table 1000\n'
+                          'rule del from 10.0.0.1\n'
+                          'rule add from 10.0.0.1 table 1000\n'],
+                         self.batches)
+
+    def test_add_routes_rejects_commands(self):
+        subnet = self.lb.vip_port.fixed_ips[0].subnet
+        subnet.host_routes.append(data_models.HostRoute(
+            destination='10.1.0.0/16', nexthop='10.0.0.3\nnetns exec x'))
+        with mock.patch('neutron.agent.linux.ip_lib.IPWrapper') as ip_wrap:
+            self.assertRaises(netaddr.AddrFormatError,
+                              self.driver._add_routes, 'ns1',
+                              self.lb.vip_port)
+            self.assertFalse(ip_wrap.return_value.netns.execute.called)
+
+    def _read_batch(self, cmd, check_exit_code=True):
+        if '-batch' in cmd:
+            with open(cmd[-1]) as batch:
+                self.batches.append(batch.read())
 
     def test_unplug(self):
         interface_name = 'tap-d4nc3'
@@ -507,6 +923,18 @@ class TestHaproxyNSDriver(base.BaseTestCase):
                 self.driver._spawn(self.lb, extra_cmd_args=extra_cmd_args)
                 mock_reload_cfg.assert_called_once_with()
 
+    @mock.patch('neutron.common.utils.ensure_dir')
+    @mock.patch('neutron_lbaas.drivers.haproxy.jinja_cfg.save_config')
+    def test_spawn_unchanged_config_no_reload(self, jinja_save, ensure_dir):
+        jinja_save.return_value = False
+        with mock.patch.object(external_process.ProcessManager, 'active',
+                               return_value=True):
+            with mock.patch.object(external_process.ProcessManager,
+                                   'reload_cfg') as mock_reload_cfg:
+                self.driver._spawn(self.lb, extra_cmd_args=['-sf', '123'])
+                self.assertFalse(mock_reload_cfg.called)
+        self.assertIn(self.lb.id, self.driver.deployed_loadbalancers)
+
 
 class BaseTestManager(base.BaseTestCase):
 
@@ -0,0 +1,138 @@
+# Copyright 2017 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import socket
+
+import mock
+from neutron.tests import base
+
+from neutron_lbaas.drivers.haproxy import runtime_api
+
+FRONTEND = ("frontend l1\n"
+            "    option tcplog\n"
+            "    bind 10.0.0.2:80\n"
+            "    mode http\n"
+            "    default_backend p1\n\n")
+
+
+def _get_config(members, slots=2, balance='roundrobin'):
+    backend = ("backend p1\n"
+               "    mode http\n"
+               "    balance %s\n" % balance)
+    for member_id, address, weight in members:
+        backend += ("    server %s %s:80 weight %d check inter 3s fall 2\n"
+                    % (member_id, address, weight))
+    if slots:
+        backend += ("    server-template p1_ %d 0.0.0.0:80 weight 1 "
+                    "disabled check inter 3s fall 2\n" % slots)
+    return "global\n    daemon\n\n" + FRONTEND + backend + "\n"
+
+
+class TestRuntimeState(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestRuntimeState, self).setUp()
+        self.state = runtime_api.RuntimeState(_get_config(
+            [('m1', '10.0.0.1', 1), ('m2', '10.0.0.2', 1)]))
+
+    def test_parse_config(self):
+        skeleton, backends = runtime_api.parse_config(_get_config(
+            [('m1', '10.0.0.1', 1)]))
+        self.assertNotIn('server m1', skeleton)
+        self.assertIn('server-template', skeleton)
+        backend = backends['p1']
+        self.assertEqual(
+            runtime_api.Server('10.0.0.1', '80', '1',
+                               ' check inter 3s fall 2'),
+            backend.servers['m1'])
+        self.assertEqual(['p1_1', 'p1_2'], backend.free_slots)
+        self.assertEqual(' check inter 3s fall 2', backend.slot_options)
+
+    def test_weight_change(self):
+        commands, state = self.state.get_commands(_get_config(
+            [('m1', '10.0.0.1', 5), ('m2', '10.0.0.2', 1)]))
+        self.assertEqual(['set weight p1/m1 5'], commands)
+        commands, state = state.get_commands(_get_config(
+            [('m1', '10.0.0.1', 5), ('m2', '10.0.0.2', 1)]))
+        self.assertEqual([], commands)
+
+    def test_member_removed_and_added_back(self):
+        commands, state = self.state.get_commands(_get_config(
+            [('m1', '10.0.0.1', 1)]))
+        self.assertEqual(['disable server p1/m2'], commands)
+        commands, state = state.get_commands(_get_config(
+            [('m1', '10.0.0.1', 1), ('m2', '10.0.0.2', 1)]))
+        self.assertEqual(['enable server p1/m2'], commands)
+
+    def test_member_added_in_slot(self):
+        commands, state = self.state.get_commands(_get_config(
+            [('m1', '10.0.0.1', 1), ('m2', '10.0.0.2', 1),
+             ('m3', '10.0.0.3', 2)]))
+        self.assertEqual(['set server p1/p1_1 addr 10.0.0.3 port 80',
+                          'set weight p1/p1_1 2',
+                          'enable server p1/p1_1'], commands)
+        self.assertEqual('m3', state.get_member_name('p1_1'))
+        self.assertEqual('m1', state.get_member_name('m1'))
+
+        commands, state = state.get_commands(_get_config(
+            [('m1', '10.0.0.1', 1), ('m2', '10.0.0.2', 1)]))
+        self.assertEqual(['disable server p1/p1_1'], commands)
+        self.assertEqual(['p1_2', 'p1_1'], state.backends['p1'].free_slots)
+
+    def test_no_free_slot(self):
+        commands, state = self.state.get_commands(_get_config(
+            [('m%d' % i, '10.0.0.%d' % i, 1) for i in range(5)]))
+        self.assertIsNone(commands)
+        self.assertIsNone(state)
+
+    def test_structural_change(self):
+        commands, state = self.state.get_commands(_get_config(
+            [('m1', '10.0.0.1', 1), ('m2', '10.0.0.2', 1)],
+            balance='leastconn'))
+        self.assertIsNone(commands)
+
+    def test_state_is_not_modified(self):
+        self.state.get_commands(_get_config([('m1', '10.0.0.1', 3)]))
+        self.assertEqual('1', self.state.backends['p1'].servers['m1'].weight)
+        self.assertEqual(set(['p1_1', 'p1_2']),
+                         self.state.backends['p1'].disabled)
+
+
+class TestSendCommands(base.BaseTestCase):
+
+    @mock.patch('socket.socket')
+    def test_send_commands(self, mocket):
+        mock_socket = mocket.return_value
+        mock_socket.recv.side_effect = [
+            "IP changed from '0.0.0.0' to '10.0.0.3' by 'stats socket "
+            "command'\n", '']
+        self.assertTrue(runtime_api.send_commands(
+            '/sock', ['set server p1/p1_1 addr 10.0.0.3 port 80',
+                      'enable server p1/p1_1']))
+        mock_socket.connect.assert_called_once_with('/sock')
+        mock_socket.send.assert_called_once_with(
+            'set server p1/p1_1 addr 10.0.0.3 port 80;'
+            'enable server p1/p1_1\n')
+
+    @mock.patch('socket.socket')
+    def test_send_commands_error(self, mocket):
+        mocket.return_value.recv.side_effect = ['No such server.\n', '']
+        self.assertFalse(runtime_api.send_commands(
+            '/sock', ['enable server p1/m9']))
+
+    @mock.patch('socket.socket')
+    def test_send_commands_socket_error(self, mocket):
+        mocket.return_value.connect.side_effect = socket.error
+        self.assertFalse(runtime_api.send_commands(
+            '/sock', ['enable server p1/m9']))
@@ -0,0 +1,95 @@
+# Copyright 2017 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron.tests import base
+
+from neutron_lbaas.drivers.haproxy import stats_parser
+
+HEADER = ('# pxname,svname,qcur,qmax,scur,smax,slim,stot,bin,bout,dreq,dresp,'
+          'ereq,econ,eresp,wretr,wredis,status,weight,act,bck,chkfail,'
+          'chkdown,lastchg,downtime,qlimit,pid,iid,sid,throttle,lbtot,'
+          'tracked,type,rate,rate_lim,rate_max,check_status,')
+BACKEND_ROW = ('{pool},BACKEND,0,0,{scur},5,0,{stot},100,200,0,0,,1,2,0,0,UP,'
+               '1,1,0,,0,10,0,,1,2,0,,0,,1,0,,0,,')
+SERVER_ROW = ('{pool},{server},0,0,0,1,,7,1120,224,,0,,0,0,0,0,{status},1,1,'
+              '0,{chkfail},1,2623,303,,1,2,1,,7,,2,0,,1,{check_status},')
+
+
+class TestStatsParser(base.BaseTestCase):
+
+    def _get_dump(self, n_backends, n_servers):
+        lines = [HEADER]
+        for b in range(n_backends):
+            pool = 'pool%d' % b
+            lines.append(BACKEND_ROW.format(pool=pool, scur=b, stot=b * 10))
+            for s in range(n_servers):
+                lines.append(SERVER_ROW.format(
+                    pool=pool, server='%s-server%d' % (pool, s),
+                    status='DOWN' if s % 2 else 'UP', chkfail=s,
+                    check_status='L4CON' if s % 2 else 'L7OK'))
+        lines.append('')
+        return lines
+
+    def test_parse_stats(self):
+        lb_stats, servers_stats = stats_parser.parse_stats(
+            self._get_dump(2, 2))
+
+        self.assertEqual({'connection_errors': '1',
+                          'active_connections': '0',
+                          'current_sessions': '0',
+                          'bytes_in': '100',
+                          'max_connections': '5',
+                          'max_sessions': '5',
+                          'bytes_out': '200',
+                          'response_errors': '2',
+                          'total_sessions': '0',
+                          'total_connections': '0'}, lb_stats)
+        self.assertEqual({'status': 'ACTIVE', 'health': 'L7OK',
+                          'failed_checks': '0'},
+                         servers_stats['pool1-server0'])
+        self.assertEqual({'status': 'INACTIVE', 'health': 'L4CON',
+                          'failed_checks': '1'},
+                         servers_stats['pool0-server1'])
+        self.assertEqual(4, len(servers_stats))
+
+    def test_parse_stats_of_proxies(self):
+        lb_stats, servers_stats = stats_parser.parse_stats(
+            self._get_dump(3, 2), proxies=set(['pool1', 'pool2']))
+        self.assertEqual('1', lb_stats['current_sessions'])
+        self.assertEqual(set(['pool1-server0', 'pool1-server1',
+                              'pool2-server0', 'pool2-server1']),
+                         set(servers_stats))
+
+        self.assertEqual(({}, {}), stats_parser.parse_stats(
+            self._get_dump(3, 2), proxies=set()))
+
+    def test_parse_stats_header_only(self):
+        self.assertEqual(({}, {}), stats_parser.parse_stats([HEADER]))
+        self.assertEqual(({}, {}), stats_parser.parse_stats([]))
+
+    def test_parse_stats_short_rows(self):
+        lb_stats, servers_stats = stats_parser.parse_stats(
+            [HEADER, 'pool,server,0', 'pool,BACKEND'])
+        self.assertEqual({}, lb_stats)
+        self.assertEqual({}, servers_stats)
+
+    def test_schema_is_cached(self):
+        self.assertIs(stats_parser.get_schema(HEADER),
+                      stats_parser.get_schema(HEADER))
+
+    def test_parse_large_dump(self):
+        lb_stats, servers_stats = stats_parser.parse_stats(
+            self._get_dump(50, 200))
+        self.assertEqual('0', lb_stats['total_connections'])
+        self.assertEqual(50 * 200, len(servers_stats))
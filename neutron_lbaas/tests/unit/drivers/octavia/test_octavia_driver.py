@@ -13,13 +13,17 @@
 #    under the License.
 
 import copy
+import time
+
 import mock
 from oslo_config import cfg
 
 from neutron import context
 from neutron_lbaas.drivers.octavia import driver
+from neutron_lbaas.drivers.octavia import status_poller
 from neutron_lbaas.services.loadbalancer import constants
 from neutron_lbaas.services.loadbalancer import data_models
+from neutron_lbaas.tests import base
 from neutron_lbaas.tests.unit.db.loadbalancer import test_db_loadbalancerv2
 
 
@@ -107,6 +111,8 @@ class BaseOctaviaDriverTest(test_db_loadbalancerv2.LbaasPluginDbTestCase):
         self.driver = driver.OctaviaDriver(self.plugin)
         # mock of rest call.
         self.driver.req = mock.Mock()
+        # the polls of Octavia are driven by the tests
+        mock.patch.object(status_poller.threading, 'Thread').start()
         self.lb = self._create_fake_models()
 
 
@@ -552,10 +558,80 @@ class TestOctaviaDriver(BaseOctaviaDriverTest):
         m.delete(l7r, l7r_url_id)
 
 
-class TestThreadedDriver(BaseOctaviaDriverTest):
+class TestOctaviaRequest(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestOctaviaRequest, self).setUp()
+        self.auth_session = mock.Mock()
+        self.access = self.auth_session.auth.get_access.return_value
+        self.access.auth_token = 'token'
+        self.access.will_expire_soon.return_value = False
+        self.req = driver.OctaviaRequest('http://octavia', self.auth_session)
+        self.session_request = mock.patch.object(self.req.session,
+                                                 'request').start()
+        self.sleep = mock.patch.object(driver.time, 'sleep').start()
+
+    def _set_responses(self, *status_codes):
+        responses = []
+        for status_code in status_codes:
+            response = mock.Mock(status_code=status_code)
+            response.json.return_value = {'code': status_code}
+            responses.append(response)
+        self.session_request.side_effect = responses
+
+    def test_session_is_reused(self):
+        self._set_responses(200, 200)
+        self.assertEqual({'code': 200}, self.req.get('/v1/loadbalancers'))
+        self.req.post('/v1/loadbalancers', {'name': 'lb'})
+        self.session_request.assert_called_with(
+            'POST', 'http://octavia/v1/loadbalancers', data='{"name": "lb"}',
+            headers={'Content-type': 'application/json',
+                     'X-Auth-Token': 'token'})
+        self.assertEqual(1, self.auth_session.auth.get_access.call_count)
+
+    def test_token_renewed_before_expiration(self):
+        self._set_responses(200, 200)
+        self.req.get('/v1/loadbalancers')
+        self.access.will_expire_soon.return_value = True
+        self.req.get('/v1/loadbalancers')
+        self.assertEqual(2, self.auth_session.auth.get_access.call_count)
+
+    def test_token_renewed_when_unauthorized(self):
+        self._set_responses(401, 200)
+        self.assertEqual({'code': 200}, self.req.get('/v1/loadbalancers'))
+        self.assertEqual(2, self.auth_session.auth.get_access.call_count)
+        self.assertFalse(self.sleep.called)
+
+    def test_retry_on_conflict(self):
+        self._set_responses(409, 409, 201)
+        self.assertEqual({'code': 201},
+                         self.req.post('/v1/loadbalancers', {'name': 'lb'}))
+        self.assertEqual(3, self.session_request.call_count)
+        self.sleep.assert_has_calls([mock.call(0.5), mock.call(1.0)])
+
+    def test_no_retry_on_post_server_error(self):
+        self._set_responses(500)
+        self.assertEqual({'code': 500},
+                         self.req.post('/v1/loadbalancers', {'name': 'lb'}))
+        self.assertEqual(1, self.session_request.call_count)
+
+    def test_retry_on_get_server_error_gives_up(self):
+        self._set_responses(503, 503, 503, 503)
+        self.assertEqual({'code': 503}, self.req.get('/v1/loadbalancers'))
+        self.assertEqual(4, self.session_request.call_count)
+
+    def test_latency_histogram(self):
+        self._set_responses(200, 200)
+        self.req.get('/v1/loadbalancers')
+        self.req.delete('/v1/loadbalancers/id')
+        self.assertEqual(1, sum(self.req.latency_histogram['GET']))
+        self.assertEqual(1, sum(self.req.latency_histogram['DELETE']))
+
+
+class TestStatusPoller(BaseOctaviaDriverTest):
 
         def setUp(self):
-            super(TestThreadedDriver, self).setUp()
+            super(TestStatusPoller, self).setUp()
             cfg.CONF.set_override('request_poll_interval', 1, group='octavia')
             cfg.CONF.set_override('request_poll_timeout', 5, group='octavia')
             self.driver.req.get = mock.MagicMock()
@@ -569,46 +645,204 @@ class TestThreadedDriver(BaseOctaviaDriverTest):
             self.driver.load_balancer.successful_completion = (
                 self.succ_completion)
             self.driver.load_balancer.failed_completion = self.fail_completion
+            self.poller = self.driver.status_poller
+            self.now = time.time() + 1
 
-        def test_thread_op_goes_active(self):
+        def _poll(self, seconds=0):
+            self.now += seconds
+            return self.poller.poll(now=self.now)
+
+        def test_async_op_registers_operation(self):
+            self.driver.load_balancer.create(self.context, self.lb)
+            self.assertEqual(1, self.poller.queue_depth)
+
+        def test_poll_goes_active(self):
             self.driver.req.get.side_effect = [
                 {'provisioning_status': 'PENDING_CREATE'},
                 {'provisioning_status': 'ACTIVE'}
             ]
-            driver.thread_op(self.driver.load_balancer, self.lb)
+            self.poller.register(self.driver.load_balancer, self.lb)
+            self.assertIsNotNone(self._poll())
+            self.assertFalse(self.succ_completion.called)
+            self.assertIsNone(self._poll(1))
             self.succ_completion.assert_called_once_with(self.context, self.lb,
                                                          delete=False)
             self.assertEqual(0, self.fail_completion.call_count)
+            self.assertEqual(0, self.poller.queue_depth)
+            self.assertIsNotNone(self.poller.poll_latency)
 
-        def test_thread_op_goes_deleted(self):
+        def test_poll_goes_deleted(self):
             self.driver.req.get.side_effect = [
                 {'provisioning_status': 'PENDING_DELETE'},
                 {'provisioning_status': 'DELETED'}
             ]
-            driver.thread_op(self.driver.load_balancer, self.lb, delete=True)
+            self.poller.register(self.driver.load_balancer, self.lb,
+                                 delete=True)
+            self._poll()
+            self._poll(1)
             self.succ_completion.assert_called_once_with(self.context, self.lb,
                                                          delete=True)
             self.assertEqual(0, self.fail_completion.call_count)
 
-        def test_thread_op_goes_error(self):
+        def test_poll_goes_error(self):
             self.driver.req.get.side_effect = [
                 {'provisioning_status': 'PENDING_CREATE'},
                 {'provisioning_status': 'ERROR'}
             ]
-            driver.thread_op(self.driver.load_balancer, self.lb)
+            self.poller.register(self.driver.load_balancer, self.lb)
+            self._poll()
+            self._poll(1)
             self.fail_completion.assert_called_once_with(self.context, self.lb)
             self.assertEqual(0, self.succ_completion.call_count)
 
-        def test_thread_op_a_times_out(self):
-            cfg.CONF.set_override('request_poll_timeout', 1, group='octavia')
-            self.driver.req.get.side_effect = [
-                {'provisioning_status': 'PENDING_CREATE'}
-            ]
-            driver.thread_op(self.driver.load_balancer, self.lb)
+        def test_poll_times_out(self):
+            self.driver.req.get.return_value = {
+                'provisioning_status': 'PENDING_CREATE'}
+            self.poller.register(self.driver.load_balancer, self.lb)
+            self._poll()
+            self.assertFalse(self.fail_completion.called)
+            self.assertIsNone(self._poll(10))
             self.fail_completion.assert_called_once_with(self.context, self.lb)
             self.assertEqual(0, self.succ_completion.call_count)
 
-        def test_thread_op_updates_vip_when_vip_delegated(self):
+        def test_poll_backs_off(self):
+            cfg.CONF.set_override('request_poll_max_interval', 3,
+                                  group='octavia')
+            cfg.CONF.set_override('request_poll_timeout', 100,
+                                  group='octavia')
+            self.driver.req.get.return_value = {
+                'provisioning_status': 'PENDING_UPDATE'}
+            self.poller.register(self.driver.load_balancer, self.lb)
+            self._poll()
+            self._poll(0.5)
+            self.assertEqual(1, self.driver.req.get.call_count)
+            self._poll(0.5)
+            self.assertEqual(2, self.driver.req.get.call_count)
+            self._poll(1)
+            self.assertEqual(2, self.driver.req.get.call_count)
+            self._poll(1)
+            self.assertEqual(3, self.driver.req.get.call_count)
+            self._poll(3)
+            self.assertEqual(4, self.driver.req.get.call_count)
+
+        def test_poll_resolves_operations_of_a_load_balancer_at_once(self):
+            self.driver.req.get.side_effect = [
+                {'provisioning_status': 'ACTIVE'}
+            ]
+            member_manager = self.driver.member
+            member_manager.successful_completion = mock.MagicMock()
+            members = [data_models.Member(id='m%d' % i,
+                                          pool=self.lb.pools[0])
+                       for i in range(3)]
+            for member in members:
+                self.poller.register(member_manager, member)
+            self.poller.register(self.driver.load_balancer, self.lb)
+            self.assertEqual(4, self.poller.queue_depth)
+
+            self._poll()
+
+            self.assertEqual(1, self.driver.req.get.call_count)
+            member_manager.successful_completion.assert_has_calls(
+                [mock.call(self.context, member, delete=False)
+                 for member in members])
+            self.succ_completion.assert_called_once_with(self.context, self.lb,
+                                                         delete=False)
+            self.assertEqual(0, self.poller.queue_depth)
+
+        def test_poll_keeps_operations_registered_during_the_get(self):
+            member_manager = self.driver.member
+            member_manager.successful_completion = mock.MagicMock()
+            member = data_models.Member(id='m1', pool=self.lb.pools[0])
+            clock = mock.patch.object(status_poller.time, 'time',
+                                      return_value=self.now).start()
+
+            def get(*args, **kwargs):
+                clock.return_value += 1
+                if self.driver.req.get.call_count == 1:
+                    self.poller.register(member_manager, member)
+                return {'provisioning_status': 'ACTIVE'}
+
+            self.driver.req.get.side_effect = get
+            self.poller.register(self.driver.load_balancer, self.lb)
+            self._poll()
+
+            self.succ_completion.assert_called_once_with(self.context, self.lb,
+                                                         delete=False)
+            self.assertFalse(member_manager.successful_completion.called)
+            self.assertEqual(1, self.poller.queue_depth)
+            self._poll(1)
+            self.assertEqual(2, self.driver.req.get.call_count)
+            member_manager.successful_completion.assert_called_once_with(
+                self.context, member, delete=False)
+            self.assertEqual(0, self.poller.queue_depth)
+
+        def test_notify_polls_load_balancer(self):
+            cfg.CONF.set_override('event_driven_completion', True,
+                                  group='octavia')
+            self.driver.req.get.return_value = {
+                'provisioning_status': 'ACTIVE'}
+            self.poller.register(self.driver.load_balancer, self.lb)
+            self.poller.notify(self.lb.id, 'PENDING_UPDATE')
+            self.assertNotEqual(0, self._poll())
+            self.assertFalse(self.driver.req.get.called)
+            self.poller.notify(self.lb.id, 'ACTIVE')
+            self.assertFalse(self.succ_completion.called)
+            self.assertEqual(1, self.poller.queue_depth)
+            self.assertIsNone(self._poll())
+            self.assertEqual(1, self.driver.req.get.call_count)
+            self.succ_completion.assert_called_once_with(self.context, self.lb,
+                                                         delete=False)
+            self.assertEqual(0, self.poller.queue_depth)
+
+        def test_notify_does_not_complete_later_operations(self):
+            # an event produced before the operation was accepted
+            cfg.CONF.set_override('event_driven_completion', True,
+                                  group='octavia')
+            self.driver.req.get.return_value = {
+                'provisioning_status': 'PENDING_UPDATE'}
+            self.poller.register(self.driver.load_balancer, self.lb)
+            self.poller.notify(self.lb.id, 'ERROR')
+            self._poll()
+            self.assertEqual(1, self.driver.req.get.call_count)
+            self.assertFalse(self.fail_completion.called)
+            self.assertEqual(1, self.poller.queue_depth)
+
+        def test_notify_polls_for_delegated_vip(self):
+            cfg.CONF.set_override('allocates_vip', True, group='octavia')
+            cfg.CONF.set_override('event_driven_completion', True,
+                                  group='octavia')
+            self.driver.req.get.return_value = {
+                'provisioning_status': 'ACTIVE',
+                'vip': {'ip_address': '10.1.1.1'}}
+            self.poller.register(self.driver.load_balancer, self.lb,
+                                 lb_create=True)
+            self.poller.notify(self.lb.id, 'ACTIVE')
+            self.assertFalse(self.succ_completion.called)
+            self._poll()
+            self.succ_completion.assert_called_once_with(self.context, self.lb,
+                                                         delete=False,
+                                                         lb_create=True)
+            self.assertEqual('10.1.1.1', self.lb.vip_address)
+
+        def test_event_driven_completion_polls_slowly(self):
+            cfg.CONF.set_override('event_driven_completion', True,
+                                  group='octavia')
+            cfg.CONF.set_override('event_poll_interval', 30, group='octavia')
+            cfg.CONF.set_override('request_poll_timeout', 100,
+                                  group='octavia')
+            self.driver.req.get.return_value = {
+                'provisioning_status': 'PENDING_UPDATE'}
+            self.poller.register(self.driver.load_balancer, self.lb)
+            self._poll(10)
+            self.assertFalse(self.driver.req.get.called)
+            self._poll(20)
+            self.assertEqual(1, self.driver.req.get.call_count)
+            self._poll(29)
+            self.assertEqual(1, self.driver.req.get.call_count)
+            self._poll(1)
+            self.assertEqual(2, self.driver.req.get.call_count)
+
+        def test_poll_updates_vip_when_vip_delegated(self):
             cfg.CONF.set_override('allocates_vip', True, group='octavia')
             expected_vip = '10.1.1.1'
             self.driver.req.get.side_effect = [
@@ -617,9 +851,10 @@ class TestThreadedDriver(BaseOctaviaDriverTest):
                 {'provisioning_status': 'ACTIVE',
                  'vip': {'ip_address': expected_vip}}
             ]
-            driver.thread_op(self.driver.load_balancer,
-                             self.lb,
-                             lb_create=True)
+            self.poller.register(self.driver.load_balancer, self.lb,
+                                 lb_create=True)
+            self._poll()
+            self._poll(1)
             self.succ_completion.assert_called_once_with(self.context, self.lb,
                                                          delete=False,
                                                          lb_create=True)
@@ -30,16 +30,16 @@ class TestOctaviaMessagingConsumer(test_octavia_driver.BaseOctaviaDriverTest):
     def setUp(self):
         super(test_octavia_driver.BaseOctaviaDriverTest, self).setUp()
         self.plugin = mock.Mock()
+        self.plugin.db.update_statuses.return_value = []
+        self.plugin.db.update_listeners_stats.return_value = []
         self.driver = odriver.OctaviaDriver(self.plugin)
 
     def assert_handle_streamed_event_called(self, model_class, id_param,
                                             payload):
-        call_args_list = self.driver.plugin.db.update_status.call_args_list[0]
-        self.assertEqual(len(call_args_list), 2)
-        self.assertEqual(len(call_args_list[0]), 3)
-        self.assertEqual(model_class, call_args_list[0][1])
-        self.assertEqual(call_args_list[0][2], id_param)
-        self.assertEqual(call_args_list[1], payload)
+        self.driver.plugin.db.update_statuses.assert_called_once_with(
+            mock.ANY, [(model_class, id_param,
+                        payload.get('provisioning_status'),
+                        payload.get('operating_status'))])
 
     def test_info_container_constructor(self):
         ID = 'test_id'
@@ -126,6 +126,9 @@ class TestOctaviaMessagingConsumer(test_octavia_driver.BaseOctaviaDriverTest):
                         group='oslo_messaging')
         cfg.CONF.set_override('event_stream_topic', TOPIC,
                               group='oslo_messaging')
+        self.addCleanup(cfg.CONF.clear_override, 'event_flush_interval',
+                        group='octavia')
+        cfg.CONF.set_override('event_flush_interval', 0, group='octavia')
         self.payload = {'operating_status': 'ONLINE'}
         self.consumer = octavia_messaging_consumer.OctaviaConsumer(
             self.driver)
@@ -138,12 +141,53 @@ class TestOctaviaMessagingConsumer(test_octavia_driver.BaseOctaviaDriverTest):
         self.assertRaises(exceptions.ModelMapException,
                           self.consumer.endpoints[0].update_info, {}, cnt)
 
-    def test_updatedb_ignores_listener_stats(self):
+    def test_updatedb_listener_stats(self):
         self.set_db_mocks()
-        cnt = InfoContainer('listener_stats', 'id', self.payload).to_dict()
-        self.consumer.endpoints[0].update_info({}, cnt)
-        call_len = len(self.driver.plugin.db.update_status.call_args_list)
-        self.assertEqual(call_len, 0)   # See didn't do anything
+        for listener_id, bytes_in in (('l1', 10), ('l2', 5)):
+            cnt = InfoContainer('listener_stats', listener_id,
+                                {'bytes_in': bytes_in, 'bytes_out': 1,
+                                 'active_connections': 2,
+                                 'total_connections': 3,
+                                 'request_errors': 0}).to_dict()
+            self.consumer.endpoints[0].update_info({}, cnt)
+
+        self.assertFalse(self.driver.plugin.db.update_status.called)
+        self.plugin.db.update_listeners_stats.assert_called_with(
+            mock.ANY, {'l2': {'bytes_in': 5, 'bytes_out': 1,
+                              'active_connections': 2,
+                              'total_connections': 3,
+                              'request_errors': 0}})
+        self.assertEqual(2, self.plugin.db.update_listeners_stats.call_count)
+
+    def test_updatedb_coalesces_events(self):
+        self.set_db_mocks()
+        cfg.CONF.set_override('event_flush_interval', 1, group='octavia')
+        with mock.patch('threading.Timer') as timer:
+            for payload in ({'provisioning_status': 'PENDING_UPDATE'},
+                            {'operating_status': 'ONLINE'},
+                            {'provisioning_status': 'ACTIVE'}):
+                cnt = InfoContainer(constants.MEMBER_EVENT, 'member_id',
+                                    payload).to_dict()
+                self.consumer.endpoints[0].update_info({}, cnt)
+            cnt = InfoContainer(constants.POOL_EVENT, 'pool_id',
+                                {'operating_status': 'ONLINE'}).to_dict()
+            self.consumer.endpoints[0].update_info({}, cnt)
+
+        self.assertEqual(1, timer.call_count)
+        self.assertFalse(self.plugin.db.update_statuses.called)
+        self.driver.event_handler.flush()
+        self.plugin.db.update_statuses.assert_called_once_with(
+            mock.ANY, [(models.MemberV2, 'member_id', 'ACTIVE', 'ONLINE'),
+                       (models.PoolV2, 'pool_id', None, 'ONLINE')])
+
+    def test_updatedb_loadbalancer_completes_operations(self):
+        self.set_db_mocks()
+        with mock.patch.object(self.driver.status_poller,
+                               'notify') as notify:
+            cnt = InfoContainer(constants.LOADBALANCER_EVENT, 'lb_id',
+                                {'provisioning_status': 'ACTIVE'}).to_dict()
+            self.consumer.endpoints[0].update_info({}, cnt)
+        notify.assert_called_once_with('lb_id', 'ACTIVE')
 
     def test_updatedb_loadbalancer(self):
         self.set_db_mocks()
@@ -0,0 +1,65 @@
+# Copyright 2017 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron_lbaas.drivers import driver_mixins
+from neutron_lbaas.services.loadbalancer import data_models
+from neutron_lbaas.tests import base
+
+
+class FakeManager(driver_mixins.BaseManagerMixin):
+
+    db_delete_method = None
+
+    def create(self, context, obj):
+        pass
+
+    def update(self, context, obj_old, obj):
+        pass
+
+    def delete(self, context, obj):
+        pass
+
+
+class TestBaseManagerMixin(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestBaseManagerMixin, self).setUp()
+        self.manager = FakeManager(mock.Mock())
+        self.manager.successful_completion = mock.Mock()
+
+    def test_successful_completion_lb_graph(self):
+        member = data_models.Member(id='member1')
+        hm = data_models.HealthMonitor(id='hm1')
+        pool = data_models.Pool(id='pool1', members=[member],
+                                healthmonitor=hm)
+        rule = data_models.L7Rule(id='rule1')
+        policy = data_models.L7Policy(id='policy1', rules=[rule])
+        listener = data_models.Listener(id='listener1', default_pool=pool,
+                                        l7_policies=[policy])
+        lb = data_models.LoadBalancer(id='lb1', listeners=[listener])
+
+        self.manager._successful_completion_lb_graph(mock.sentinel.ctx, lb)
+
+        self.assertIs(lb, listener.loadbalancer)
+        self.assertIs(listener, pool.listener)
+        self.assertIs(pool, hm.pool)
+        self.assertIs(pool, member.pool)
+        self.assertIs(listener, policy.listener)
+        self.assertIs(policy, rule.policy)
+        completed = [c[0][1] for c in
+                     self.manager.successful_completion.call_args_list]
+        self.assertEqual([hm, member, pool, rule, policy, listener, lb],
+                         completed)
@@ -0,0 +1,123 @@
+# Copyright 2017 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_config import cfg
+import requests
+
+from neutron_lbaas.drivers.xos import xos_client
+from neutron_lbaas.tests import base
+
+
+def _response(status_code=200, body=None, headers=None):
+    r = mock.Mock(status_code=status_code, headers=headers or {},
+                  ok=status_code < 400)
+    r.json.return_value = body
+    return r
+
+
+class TestXOSClient(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestXOSClient, self).setUp()
+        cfg.CONF.set_override('request_retry_backoff', 0, group='xos')
+        mock.patch.object(xos_client.time, 'sleep').start()
+        self.session = mock.Mock()
+        mock.patch.object(xos_client, '_get_session',
+                          return_value=self.session).start()
+        self.client = xos_client.XOSClient('http://xos', '/api', 'user',
+                                           'password')
+
+    def test_get(self):
+        self.session.request.return_value = _response(body={'id': 1})
+        self.assertEqual({'id': 1}, self.client.get('/lbs/1'))
+        self.session.request.assert_called_once_with(
+            'GET', 'http://xos/api/lbs/1', data=None, headers=mock.ANY,
+            timeout=(5, 30))
+        self.assertEqual([1, 0],
+                         self.client.latency['GET /lbs/{id}'][:2])
+
+    def test_retries_server_errors(self):
+        self.session.request.side_effect = [_response(503),
+                                            _response(body={'id': 1})]
+        self.assertEqual({'id': 1}, self.client.put('/lbs/1', {'id': 1}))
+        self.assertEqual(2, self.session.request.call_count)
+        self.assertEqual([2, 1],
+                         self.client.latency['PUT /lbs/{id}'][:2])
+
+    def test_does_not_retry_post(self):
+        self.session.request.side_effect = requests.ConnectionError
+        self.assertRaises(requests.ConnectionError,
+                          self.client.post, '/lbs', {})
+        self.assertEqual(1, self.session.request.call_count)
+        self.assertEqual([1, 1], self.client.latency['POST /lbs'][:2])
+
+    def test_read_timeout(self):
+        self.session.request.side_effect = requests.ReadTimeout
+        self.assertRaises(requests.ReadTimeout, self.client.get, '/lbs/1')
+        retries = cfg.CONF.xos.request_max_retries
+        self.assertEqual(retries + 1, self.session.request.call_count)
+        self.assertEqual([retries + 1, retries + 1],
+                         self.client.latency['GET /lbs/{id}'][:2])
+
+    def test_timeout_then_success(self):
+        self.session.request.side_effect = [requests.ConnectTimeout,
+                                            _response(body={'id': 1})]
+        self.assertEqual({'id': 1}, self.client.get('/lbs/1'))
+        self.assertEqual([2, 1],
+                         self.client.latency['GET /lbs/{id}'][:2])
+
+    def test_get_revalidates_cached_body(self):
+        self.session.request.side_effect = [
+            _response(body={'id': 1}, headers={'ETag': '"v1"'}),
+            _response(304)]
+        self.assertEqual({'id': 1}, self.client.get('/lbs/1'))
+        self.assertEqual({'id': 1}, self.client.get('/lbs/1'))
+        headers = self.session.request.call_args[1]['headers']
+        self.assertEqual('"v1"', headers['If-None-Match'])
+
+    def test_cached_body_is_copied(self):
+        self.session.request.side_effect = [
+            _response(body={'id': 1}, headers={'ETag': '"v1"'}),
+            _response(304), _response(304)]
+        self.client.get('/lbs/1')['id'] = 2
+        body = self.client.get('/lbs/1')
+        self.assertEqual({'id': 1}, body)
+        body['id'] = 3
+        self.assertEqual({'id': 1}, self.client.get('/lbs/1'))
+
+    def test_write_invalidates_cached_bodies(self):
+        self.session.request.side_effect = [
+            _response(body=[], headers={'ETag': '"v1"'}),
+            _response(body={'id': 1}, headers={'ETag': '"v1"'}),
+            _response(204),
+            _response(body=[{'id': 1}])]
+        self.client.get('/lbs/')
+        self.client.get('/lbs/1')
+        self.client.delete('/lbs/1')
+        self.assertEqual({}, self.client._cache)
+        self.assertEqual([{'id': 1}], self.client.get('/lbs/'))
+        headers = self.session.request.call_args[1]['headers']
+        self.assertNotIn('If-None-Match', headers)
+
+    def test_cache_is_bounded(self):
+        self.session.request.side_effect = lambda *args, **kwargs: (
+            _response(body={}, headers={'ETag': '"v1"'}))
+        with mock.patch.object(xos_client, 'CACHE_SIZE', 2):
+            self.client.get('/lbs/1')
+            self.client.get('/lbs/2')
+            # revalidating /lbs/1 makes /lbs/2 the least recently used
+            self.client.get('/lbs/1')
+            self.client.get('/lbs/3')
+        self.assertEqual(['/lbs/1', '/lbs/3'], list(self.client._cache))
@@ -0,0 +1,87 @@
+# Copyright 2017 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_config import cfg
+
+# registers the endpoint and credentials options of the XOS driver
+from neutron_lbaas.drivers.xos import xos_driver_v2  # noqa
+from neutron_lbaas.drivers.xos import xos_network
+from neutron_lbaas.tests import base
+
+
+class TestXOSNetworkManager(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestXOSNetworkManager, self).setUp()
+        mock.patch.object(xos_network.xos_client, 'XOSClient').start()
+        self.manager = xos_network.XOSNetworkManager()
+        self.client = self.manager.client
+        self.net = xos_network.XOSNetwork(name='net1',
+                                          subnet_range='10.0.0.0/24')
+        self.owner = '%sapi/core/slices/5/' % cfg.CONF.xos.endpoint
+
+    def test_create(self):
+        self.client.get.side_effect = [[], []]
+        self.client.post.return_value = {'id': 5}
+
+        self.assertEqual('mysite_net1', self.manager.create(self.net))
+        self.client.get.assert_has_calls([
+            mock.call('api/core/slices/?name=mysite_net1'),
+            mock.call('api/core/networks/?name=net1')])
+        self.assertEqual(
+            ['api/core/slices/', 'api/core/networks/'],
+            [c[0][0] for c in self.client.post.call_args_list])
+        self.assertEqual(self.owner,
+                         self.client.post.call_args[0][1]['owner'])
+        self.assertEqual((0, 1), (self.manager.cache_hits,
+                                  self.manager.cache_misses))
+        self.assertEqual({}, self.manager._locks)
+
+    def test_create_cached(self):
+        self.client.get.side_effect = [[{'id': 5}],
+                                       [{'id': 7, 'owner': self.owner}]]
+
+        self.manager.create(self.net)
+        self.manager.create(self.net)
+        self.assertEqual(2, self.client.get.call_count)
+        self.assertFalse(self.client.post.called)
+        self.assertEqual((1, 1), (self.manager.cache_hits,
+                                  self.manager.cache_misses))
+        self.assertEqual({}, self.manager._locks)
+
+        # the network is looked up again once forgotten
+        self.manager.delete('net1')
+        self.client.get.side_effect = [[{'id': 5}],
+                                       [{'id': 7, 'owner': self.owner}]]
+        self.manager.create(self.net)
+        self.assertEqual(4, self.client.get.call_count)
+
+    def test_create_not_cached(self):
+        cfg.CONF.set_override('network_cache_ttl', 0, group='xos')
+        self.client.get.side_effect = lambda url: (
+            [{'id': 5}] if 'slices' in url else
+            [{'id': 7, 'owner': self.owner}])
+
+        self.manager.create(self.net)
+        self.manager.create(self.net)
+        self.assertEqual(4, self.client.get.call_count)
+        self.assertEqual({}, self.manager._cache)
+
+    def test_create_failure_releases_lock(self):
+        self.client.get.side_effect = ValueError
+
+        self.assertRaises(ValueError, self.manager.create, self.net)
+        self.assertEqual({}, self.manager._locks)
+        self.assertEqual({}, self.manager._cache)
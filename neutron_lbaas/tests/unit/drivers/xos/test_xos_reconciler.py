@@ -0,0 +1,160 @@
+# Copyright 2017 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import copy
+
+import mock
+from oslo_config import cfg
+
+from neutron_lbaas.drivers.xos import xos_driver_v2
+from neutron_lbaas.drivers.xos import xos_reconciler
+from neutron_lbaas.services.loadbalancer import data_models
+from neutron_lbaas.tests import base
+
+
+# GET api/tenant/loadbalancers/xlb1/ while XOS allocates the VIP
+XOS_LB_PENDING = {
+    'loadbalancer': {
+        'loadbalancer_id': 'xlb1',
+        'name': 'lb1',
+        'slice_name': 'mysite_net1',
+        'vip_address': '0.0.0.0',
+        'listeners': [],
+        'pools': []}}
+
+# GET api/tenant/loadbalancers/
+XOS_LB_LIST = {
+    'loadbalancers': [
+        {'loadbalancer_id': 'xlb1',
+         'name': 'lb1',
+         'slice_name': 'mysite_net1',
+         'vip_address': '10.0.0.5',
+         'listeners': [],
+         'pools': []},
+        {'loadbalancer_id': 'xlb2',
+         'name': 'lb2',
+         'slice_name': 'mysite_net1',
+         'vip_address': '0.0.0.0',
+         'listeners': [],
+         'pools': []}]}
+
+VIP_PORTS = [
+    {'id': 'port1',
+     'fixed_ips': [{'subnet_id': 'subnet1', 'ip_address': '10.0.0.5'}]}]
+
+
+class TestXOSReconciler(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestXOSReconciler, self).setUp()
+        mock.patch.object(xos_reconciler.ncontext,
+                          'get_admin_context').start()
+        self.driver = mock.Mock(allocates_vip=True)
+        self.manager = xos_driver_v2.LoadBalancerManager(self.driver)
+        self.manager.successful_completion = mock.Mock()
+        self.manager.failed_completion = mock.Mock()
+        self.driver.load_balancer = self.manager
+        self.get_ports = self.driver.plugin.db._core_plugin.get_ports
+        self.get_ports.return_value = VIP_PORTS
+        self.reconciler = xos_reconciler.XOSReconciler(self.driver)
+        self.lb1 = data_models.LoadBalancer(id='lb1',
+                                            vip_subnet_id='subnet1')
+        self.lb2 = data_models.LoadBalancer(id='lb2',
+                                            vip_subnet_id='subnet1')
+
+    def _register(self, *lbs):
+        with mock.patch('threading.Thread'):
+            for lb in lbs:
+                self.reconciler.register(lb, 'x' + lb.id)
+
+    def test_reconcile(self):
+        self.driver.client.get.return_value = copy.deepcopy(XOS_LB_LIST)
+        self._register(self.lb1, self.lb2)
+
+        self.assertEqual(1, self.reconciler.reconcile())
+        self.driver.client.get.assert_called_once_with('/loadbalancers/')
+        self.get_ports.assert_called_once_with(
+            mock.ANY, filters={'fixed_ips': {'ip_address': ['10.0.0.5'],
+                                             'subnet_id': ['subnet1']}},
+            fields=['id', 'fixed_ips'])
+        self.manager.successful_completion.assert_called_once_with(
+            mock.ANY, self.lb1, lb_create=True)
+        self.assertEqual(('port1', '10.0.0.5'),
+                         (self.lb1.vip_port_id, self.lb1.vip_address))
+        self.assertFalse(self.manager.failed_completion.called)
+        self.assertEqual(1, self.reconciler.pending)
+
+    def test_reconcile_nothing_pending(self):
+        self.assertIsNone(self.reconciler.reconcile())
+        self.assertFalse(self.driver.client.get.called)
+
+    def test_reconcile_timeout(self):
+        self.driver.client.get.return_value = copy.deepcopy(XOS_LB_LIST)
+        self._register(self.lb2)
+        deadline = self.reconciler._pending['xlb2'].deadline
+
+        self.assertEqual(1, self.reconciler.reconcile(now=deadline - 1))
+        self.assertIsNone(self.reconciler.reconcile(now=deadline))
+        self.manager.failed_completion.assert_called_once_with(
+            mock.ANY, self.lb2)
+        self.assertFalse(self.manager.successful_completion.called)
+
+    def test_reconcile_vip_not_allocated_by_xos(self):
+        self.driver.allocates_vip = False
+        self.driver.client.get.return_value = copy.deepcopy(XOS_LB_LIST)
+        self._register(self.lb1)
+
+        self.assertEqual(1, self.reconciler.reconcile())
+        self.assertFalse(self.manager.successful_completion.called)
+
+    def test_reconcile_unexpected_list(self):
+        xos_lb = copy.deepcopy(XOS_LB_PENDING)
+        xos_lb['loadbalancer']['vip_address'] = '10.0.0.5'
+        self.driver.client.get.side_effect = [
+            XOS_LB_LIST['loadbalancers'], xos_lb]
+        self._register(self.lb1)
+
+        # the pending load balancers are retrieved one by one
+        self.assertIsNone(self.reconciler.reconcile())
+        self.driver.client.get.assert_has_calls([
+            mock.call('/loadbalancers/'), mock.call('/loadbalancers/xlb1/')])
+        self.manager.successful_completion.assert_called_once_with(
+            mock.ANY, self.lb1, lb_create=True)
+
+    def test_reconcile_get_failure(self):
+        self.driver.client.get.side_effect = [
+            ValueError, copy.deepcopy(XOS_LB_PENDING), ValueError]
+        self._register(self.lb1, self.lb2)
+
+        self.assertEqual(2, self.reconciler.reconcile())
+        self.assertEqual(3, self.driver.client.get.call_count)
+        self.assertFalse(self.manager.successful_completion.called)
+
+    def test_reconcile_completion_failure(self):
+        self.driver.client.get.return_value = copy.deepcopy(XOS_LB_LIST)
+        self.manager.successful_completion.side_effect = ValueError
+        self._register(self.lb1)
+
+        self.assertIsNone(self.reconciler.reconcile())
+        self.assertEqual(0, self.reconciler.pending)
+
+    def test_register_starts_one_thread(self):
+        cfg.CONF.set_override('request_poll_timeout', 10, group='xos')
+        with mock.patch('threading.Thread') as thread:
+            self.reconciler.register(self.lb1, 'xlb1')
+            self.reconciler.register(self.lb2, 'xlb2')
+        thread.assert_called_once_with(target=self.reconciler._run)
+        thread.return_value.start.assert_called_once_with()
+        pending = self.reconciler._pending['xlb1']
+        self.assertEqual(10, pending.deadline - pending.registered)
@@ -16,6 +16,7 @@ import inspect
 import mock
 import testscenarios
 
+from neutron_lbaas.db.loadbalancer import models
 from neutron_lbaas.services.loadbalancer import data_models
 from neutron_lbaas.tests import base
 from neutron_lbaas.tests import tools
@@ -58,6 +59,92 @@ class TestBaseDataModel(base.BaseTestCase):
         model = model_cls.from_dict(dict_)
         self.assertFalse(hasattr(model, 'foo'))
 
+    def test_to_dict_stops_on_reference_cycles(self):
+        lb = data_models.LoadBalancer(id='lb')
+        listener = data_models.Listener(id='listener', loadbalancer=lb)
+        lb.listeners.append(listener)
+
+        lb_dict = lb.to_dict()
+
+        listener_dict = lb_dict['listeners'][0]
+        self.assertEqual('listener', listener_dict['id'])
+        self.assertEqual('lb', listener_dict['loadbalancer']['id'])
+        nested_listener = listener_dict['loadbalancer']['listeners'][0]
+        self.assertIsNone(nested_listener['loadbalancer'])
+
+    def test_to_dict_walks_siblings_from_the_same_path(self):
+        lb = data_models.LoadBalancer(id='lb')
+        for i in range(2):
+            lb.listeners.append(
+                data_models.Listener(id='listener%d' % i, loadbalancer=lb))
+
+        lb_dict = lb.to_dict()
+
+        # the classes seen below the first listener do not leak into the
+        # path of the second one
+        self.assertEqual(lb_dict['listeners'][0]['loadbalancer'],
+                         lb_dict['listeners'][1]['loadbalancer'])
+        self.assertEqual(2, len(
+            lb_dict['listeners'][1]['loadbalancer']['listeners']))
+
+    def test_slotted_model_to_dict(self):
+        member = data_models.Member(id='member', address='10.0.0.1',
+                                    protocol_port=80)
+
+        self.assertFalse(hasattr(member, '__dict__'))
+        member_dict = member.to_dict()
+        self.assertEqual(set(data_models.Member.fields),
+                         set(member_dict.keys()))
+        self.assertEqual('10.0.0.1', member_dict['address'])
+
+    def test_slotted_model_to_api_dict(self):
+        pool = data_models.Pool(id='pool', members=[
+            data_models.Member(id='member')])
+
+        pool_dict = pool.to_api_dict()
+        self.assertEqual([{'id': 'member'}], pool_dict['members'])
+        self.assertIn('sessionpersistence', pool_dict)
+
+
+class TestFromSqlalchemyModel(base.BaseTestCase):
+
+    def _get_lb_db(self, n_listeners=1, n_members=1):
+        lb_db = models.LoadBalancer(id='lb')
+        pool_db = models.PoolV2(id='pool', loadbalancer=lb_db)
+        for i in range(n_members):
+            models.MemberV2(id='member%d' % i, pool=pool_db)
+        for i in range(n_listeners):
+            listener_db = models.Listener(id='listener%d' % i,
+                                          loadbalancer=lb_db,
+                                          default_pool=pool_db)
+            models.L7Policy(id='policy%d' % i, listener=listener_db,
+                            redirect_pool=pool_db)
+        return lb_db
+
+    def test_shared_objects_are_converted_once(self):
+        lb = data_models.LoadBalancer.from_sqlalchemy_model(self._get_lb_db())
+
+        pool = lb.pools[0]
+        listener = lb.listeners[0]
+        self.assertIs(pool, listener.default_pool)
+        self.assertIs(pool, listener.l7_policies[0].redirect_pool)
+        self.assertIs(pool, pool.members[0].pool)
+        self.assertIs(listener, pool.listener)
+        self.assertIs(lb, pool.loadbalancer)
+        self.assertIs(lb, listener.loadbalancer)
+
+    def test_large_graph(self):
+        lb = data_models.LoadBalancer.from_sqlalchemy_model(
+            self._get_lb_db(n_listeners=50, n_members=500))
+
+        self.assertEqual(50, len(lb.listeners))
+        self.assertEqual(1, len(lb.pools))
+        self.assertEqual(500, len(lb.pools[0].members))
+        self.assertEqual(50, len(lb.pools[0].listeners))
+        self.assertEqual(50, len(lb.pools[0].l7_policies))
+        for listener in lb.listeners:
+            self.assertIs(lb.pools[0], listener.default_pool)
+
 
 def _get_models():
     models = []
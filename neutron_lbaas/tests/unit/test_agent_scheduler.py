@@ -32,8 +32,10 @@ from neutron.tests.unit.db import test_agentschedulers_db
 import neutron.tests.unit.extensions
 from neutron.tests.unit.extensions import test_agent
 from neutron_lib import constants as n_constants
+from oslo_config import cfg
 from webob import exc
 
+from neutron_lbaas import agent_scheduler
 from neutron_lbaas.drivers.haproxy import plugin_driver
 from neutron_lbaas.extensions import lbaas_agentschedulerv2
 from neutron_lbaas.services.loadbalancer import constants as lb_const
@@ -80,7 +82,8 @@ class LBaaSAgentSchedulerTestCase(test_agent.AgentDBTestMixIn,
                 'host': test_agent.LBAAS_HOSTA,
                 'topic': 'LOADBALANCER_AGENT',
                 'configurations': {'device_drivers': [
-                    plugin_driver.HaproxyOnHostPluginDriver.device_driver]},
+                    plugin_driver.HaproxyOnHostPluginDriver.device_driver],
+                    'rpc_version': '1.1'},
                 'agent_type': lb_const.AGENT_TYPE_LOADBALANCERV2}
             lbaas_hostb = copy.deepcopy(lbaas_hosta)
             lbaas_hostb['host'] = test_agent.LBAAS_HOSTB
@@ -148,6 +151,24 @@ class LBaaSAgentSchedulerTestCase(test_agent.AgentDBTestMixIn,
                 self.adminContext, loadbalancer['loadbalancer']['id']
             )
 
+    def test_least_loaded_scheduling(self):
+        self._register_agent_states(lbaas_agents=True)
+        self.lbaas_plugin.drivers['lbaas'].loadbalancer_scheduler = (
+            agent_scheduler.LeastLoadedScheduler())
+        with self.loadbalancer() as lb1, self.loadbalancer() as lb2:
+            lb_ids = [lb1['loadbalancer']['id'], lb2['loadbalancer']['id']]
+            agent_ids = set(
+                self._get_lbaas_agent_hosting_loadbalancer(lb_id)['agent']
+                ['id'] for lb_id in lb_ids)
+            self.assertEqual(2, len(agent_ids))
+            self.assertEqual(
+                dict.fromkeys(agent_ids, 1),
+                self.lbaas_plugin.db.get_lbaas_agents_load(
+                    self.adminContext, list(agent_ids)))
+            for lb_id in lb_ids:
+                self.lbaas_plugin.db.update_loadbalancer_provisioning_status(
+                    self.adminContext, lb_id)
+
     def test_schedule_loadbalancer_with_disabled_agent(self):
         lbaas_hosta = {
             'binary': 'neutron-loadbalancer-agent',
@@ -256,3 +277,70 @@ class LBaaSAgentSchedulerTestCase(test_agent.AgentDBTestMixIn,
             self.lbaas_plugin.db.update_loadbalancer_provisioning_status(
                 self.adminContext, loadbalancer['loadbalancer']['id']
             )
+
+
+class LeastLoadedSchedulerTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(LeastLoadedSchedulerTestCase, self).setUp()
+        self.scheduler = agent_scheduler.LeastLoadedScheduler()
+        self.plugin = mock.Mock()
+        self.agents = [{'id': 'agent%d' % i, 'host': 'host%d' % (2 - i)}
+                       for i in range(3)]
+        self.load = dict.fromkeys(['agent0', 'agent1', 'agent2'], 0)
+        self.plugin.db.get_lbaas_agents_load.side_effect = (
+            lambda context, agent_ids, weight: dict(
+                (agent_id, self.load[agent_id]) for agent_id in agent_ids))
+
+    def test_choose_least_loaded(self):
+        self.load.update(agent0=3, agent1=1, agent2=2)
+        self.assertEqual(self.agents[1], self.scheduler._choose_agent(
+            self.plugin, 'ctx', self.agents))
+        self.plugin.db.get_lbaas_agents_load.assert_called_once_with(
+            'ctx', ['agent0', 'agent1', 'agent2'], 'loadbalancers')
+
+    def test_choose_ties_by_host(self):
+        self.assertEqual(self.agents[2], self.scheduler._choose_agent(
+            self.plugin, 'ctx', self.agents))
+
+    def test_choose_by_instances(self):
+        cfg.CONF.set_override('loadbalancer_scheduler_load', 'instances')
+        instances = {'agent0': 2, 'agent1': 5}
+        self.plugin.db.get_configuration_dict.side_effect = (
+            lambda agent: {'instances': instances.get(agent['id'], 7)})
+        self.assertEqual(self.agents[0], self.scheduler._choose_agent(
+            self.plugin, 'ctx', self.agents))
+        self.assertFalse(self.plugin.db.get_lbaas_agents_load.called)
+
+    def test_distribution(self):
+        self.load.update(agent0=4)
+        for i in range(26):
+            agent = self.scheduler._choose_agent(
+                self.plugin, 'ctx', self.agents)
+            self.load[agent['id']] += 1
+        self.assertEqual({'agent0': 10, 'agent1': 10, 'agent2': 10},
+                         self.load)
+
+    def test_place(self):
+        self.load.update(agent0=0, agent1=2, agent2=0)
+        placements = self.scheduler.place(self.plugin, 'ctx', self.agents,
+                                          ['lb1', 'lb2', 'lb3', 'lb4'])
+        self.assertEqual({'agent0': ['lb2', 'lb4'], 'agent2': ['lb1', 'lb3']},
+                         dict((agent['id'], lb_ids)
+                              for agent, lb_ids in placements))
+        self.assertEqual(1, self.plugin.db.get_lbaas_agents_load.call_count)
+
+
+class ChanceSchedulerTestCase(base.BaseTestCase):
+
+    def test_place(self):
+        scheduler = agent_scheduler.ChanceScheduler()
+        agents = [{'id': 'agent1', 'host': 'hosta'},
+                  {'id': 'agent2', 'host': 'hostb'}]
+        with mock.patch('random.choice', side_effect=[
+                agents[1], agents[0], agents[1]]):
+            placements = scheduler.place(mock.Mock(), 'ctx', agents,
+                                         ['lb1', 'lb2', 'lb3'])
+        self.assertEqual({'agent1': ['lb2'], 'agent2': ['lb1', 'lb3']},
+                         dict((agent['id'], lb_ids)
+                              for agent, lb_ids in placements))